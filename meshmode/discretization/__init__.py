@@ -23,9 +23,13 @@ THE SOFTWARE.
 """
 
 import numpy as np
-from pytools import memoize_method, memoize_method_nested
+from pytools import memoize, memoize_method
 import loopy as lp
 import pyopencl as cl
+import pyopencl.array  # noqa
+
+import logging
+logger = logging.getLogger(__name__)
 
 __doc__ = """
 .. autoclass:: ElementGroupBase
@@ -34,6 +38,510 @@ __doc__ = """
 """
 
 
+# {{{ kernels
+
+# The kernel builders below are memoized process-wide, keyed by the
+# node counts (which get fixed in the generated code) and the argument data
+# types, so that each kernel is only built and compiled once per process,
+# not once per discretization. The mapping onto the hardware is chosen
+# by meshmode.discretization.tuning.
+
+@memoize
+def _make_diff_kernel(ndiscr_nodes, vec_dtype):
+    knl = lp.make_kernel(
+        """{[c,k,i,j]:
+            0<=c<ncomponents and
+            0<=k<nelements and
+            0<=i,j<ndiscr_nodes}""",
+        "result[c,k,i] = sum(j, diff_mat[i, j] * vec[c,k,j])",
+        default_offset=lp.auto, name="diff")
+
+    knl = lp.fix_parameters(knl, ndiscr_nodes=ndiscr_nodes)
+    knl = lp.add_and_infer_dtypes(knl, dict(
+        vec=vec_dtype, result=vec_dtype, diff_mat=np.float64))
+    for name in ["result", "vec"]:
+        knl = lp.tag_data_axes(knl, name, "stride:auto,stride:auto,stride:auto")
+
+    from meshmode.discretization.tuning import TunableKernel
+    return TunableKernel(knl, ("diff", ndiscr_nodes, str(vec_dtype)),
+            output_iname="i", n_output_nodes=ndiscr_nodes,
+            reduction_iname="j", matrix_name="diff_mat")
+
+
+@memoize
+def _make_gradient_kernel(ndiscr_nodes, dim, vec_dtypes):
+    nfields = len(vec_dtypes)
+
+    knl = lp.make_kernel(
+        """{[d,k,i,j]:
+            0<=d<dim and
+            0<=k<nelements and
+            0<=i,j<ndiscr_nodes}""",
+        [
+            "result%d[d, k, i] = sum(j, diff_mats[d, i, j] * vec%d[k, j])"
+            % (ifield, ifield)
+            for ifield in range(nfields)],
+        default_offset=lp.auto, name="gradient")
+
+    knl = lp.fix_parameters(knl, ndiscr_nodes=ndiscr_nodes, dim=dim)
+
+    dtypes = {"diff_mats": np.float64}
+    for ifield, vec_dtype in enumerate(vec_dtypes):
+        dtypes["vec%d" % ifield] = vec_dtype
+        dtypes["result%d" % ifield] = vec_dtype
+        knl = lp.tag_data_axes(knl, "result%d" % ifield,
+                "stride:auto,stride:auto,stride:auto")
+    knl = lp.add_and_infer_dtypes(knl, dtypes)
+
+    from meshmode.discretization.tuning import TunableKernel
+    return TunableKernel(knl,
+            ("gradient", ndiscr_nodes, dim)
+            + tuple(str(vec_dtype) for vec_dtype in vec_dtypes),
+            output_iname="i", n_output_nodes=ndiscr_nodes,
+            reduction_iname="j", matrix_name="diff_mats",
+            matrix_inames=["d", "i", "j"])
+
+
+@memoize
+def _make_quad_weights_kernel(ndiscr_nodes, result_dtype):
+    knl = lp.make_kernel(
+        "{[k,i]: 0<=k<nelements and 0<=i<ndiscr_nodes}",
+        "result[k,i] = weights[i]",
+        default_offset=lp.auto, name="quad_weights")
+
+    knl = lp.fix_parameters(knl, ndiscr_nodes=ndiscr_nodes)
+    knl = lp.add_and_infer_dtypes(knl, dict(
+        result=result_dtype, weights=result_dtype))
+
+    from meshmode.discretization.tuning import TunableKernel
+    return TunableKernel(knl, ("quad_weights", ndiscr_nodes, str(result_dtype)),
+            output_iname="i", n_output_nodes=ndiscr_nodes)
+
+
+@memoize
+def _make_nodes_kernel(ndiscr_nodes, nmesh_nodes, nodes_dtype, result_dtype):
+    knl = lp.make_kernel(
+        """{[d,k,i,j]:
+            0<=d<dims and
+            0<=k<nelements and
+            0<=i<ndiscr_nodes and
+            0<=j<nmesh_nodes}""",
+        """
+            result[d, k, i] = \
+                sum(j, resampling_mat[i, j] * nodes[d, k, j])
+            """,
+        name="nodes",
+        default_offset=lp.auto)
+
+    knl = lp.fix_parameters(knl,
+            ndiscr_nodes=ndiscr_nodes, nmesh_nodes=nmesh_nodes)
+    knl = lp.add_and_infer_dtypes(knl, dict(
+        result=result_dtype, nodes=nodes_dtype, resampling_mat=np.float64))
+
+    knl = lp.tag_data_axes(knl, "result",
+            "stride:auto,stride:auto,stride:auto")
+
+    from meshmode.discretization.tuning import TunableKernel
+    return TunableKernel(knl,
+            ("nodes", ndiscr_nodes, nmesh_nodes,
+                str(nodes_dtype), str(result_dtype)),
+            output_iname="i", n_output_nodes=ndiscr_nodes,
+            reduction_iname="j", matrix_name="resampling_mat")
+
+
+@memoize
+def _make_jacobian_kernel(ndiscr_nodes, nmesh_nodes, dim,
+        nodes_dtype, result_dtype):
+    knl = lp.make_kernel(
+        """{[a,r,k,i,j]:
+            0<=a<ambient_dim and
+            0<=r<dim and
+            0<=k<nelements and
+            0<=i<ndiscr_nodes and
+            0<=j<nmesh_nodes}""",
+        """
+            result[a, r, k, i] = \
+                sum(j, diff_mats[r, i, j] * nodes[a, k, j])
+            """,
+        name="jacobian",
+        default_offset=lp.auto)
+
+    knl = lp.fix_parameters(knl,
+            ndiscr_nodes=ndiscr_nodes, nmesh_nodes=nmesh_nodes, dim=dim)
+    knl = lp.add_and_infer_dtypes(knl, dict(
+        result=result_dtype, nodes=nodes_dtype, diff_mats=np.float64))
+
+    knl = lp.tag_data_axes(knl, "result",
+            "stride:auto,stride:auto,stride:auto,stride:auto")
+
+    from meshmode.discretization.tuning import TunableKernel
+    return TunableKernel(knl,
+            ("jacobian", ndiscr_nodes, nmesh_nodes, dim,
+                str(nodes_dtype), str(result_dtype)),
+            output_iname="i", n_output_nodes=ndiscr_nodes,
+            reduction_iname="j", matrix_name="diff_mats",
+            matrix_inames=["r", "i", "j"])
+
+
+@memoize
+def _make_affine_jacobian_kernel(ndiscr_nodes, dim, result_dtype):
+    knl = lp.make_kernel(
+        """{[a,r,k,i]:
+            0<=a<ambient_dim and
+            0<=r<dim and
+            0<=k<nelements and
+            0<=i<ndiscr_nodes}""",
+        "result[a, r, k, i] = el_jacobians[a, r, k]",
+        default_offset=lp.auto, name="affine_jacobian")
+
+    knl = lp.fix_parameters(knl, ndiscr_nodes=ndiscr_nodes, dim=dim)
+    knl = lp.add_and_infer_dtypes(knl, dict(
+        result=result_dtype, el_jacobians=result_dtype))
+
+    knl = lp.tag_data_axes(knl, "result",
+            "stride:auto,stride:auto,stride:auto,stride:auto")
+
+    from meshmode.discretization.tuning import TunableKernel
+    return TunableKernel(knl,
+            ("affine_jacobian", ndiscr_nodes, dim, str(result_dtype)),
+            output_iname="i", n_output_nodes=ndiscr_nodes)
+
+
+def _det_expr(mat):
+    """Return a string expression for the determinant of the small matrix
+    *mat*, given as a list of lists of string expressions.
+    """
+    if len(mat) == 1:
+        return mat[0][0]
+
+    terms = []
+    for j in range(len(mat)):
+        minor = [row[:j] + row[j+1:] for row in mat[1:]]
+        terms.append("%s(%s)*(%s)" % (
+            "-" if j % 2 else "", mat[0][j], _det_expr(minor)))
+
+    return " + ".join(terms)
+
+
+@memoize
+def _make_metric_kernel(ambient_dim, dim, dtype):
+    jac = [["jac[%d, %d, n]" % (a, r) for r in range(dim)]
+            for a in range(ambient_dim)]
+
+    insns = []
+    if ambient_dim == dim:
+        insns.append("<> det = %s" % _det_expr(jac))
+        insns.append("jacobian_determinant[n] = det")
+        insns.append("area_element[n] = fabs(det)")
+
+        for r in range(dim):
+            for a in range(dim):
+                # the adjugate is the transpose of the cofactor matrix
+                minor = [row[:r] + row[r+1:] for row in jac[:a] + jac[a+1:]]
+                cofactor = "%s(%s)" % (
+                        "-" if (a + r) % 2 else "",
+                        _det_expr(minor) if minor else "1")
+                insns.append("inverse_jacobian[%d, %d, n] = %s / det"
+                        % (r, a, cofactor))
+    else:
+        metric = [
+                [" + ".join("%s*%s" % (jac[a][r], jac[a][s])
+                    for a in range(ambient_dim))
+                    for s in range(dim)]
+                for r in range(dim)]
+        insns.append("<> area = sqrt(%s)" % _det_expr(metric))
+        insns.append("area_element[n] = area")
+
+        if ambient_dim == dim + 1:
+            # generalized cross product of the columns of the Jacobian
+            for a in range(ambient_dim):
+                minor = jac[:a] + jac[a+1:]
+                insns.append("normals[%d, n] = %s(%s) / area"
+                        % (a, "-" if a % 2 else "", _det_expr(minor)))
+
+    knl = lp.make_kernel(
+        "{[n]: 0<=n<nnodes}",
+        insns,
+        name="metric")
+
+    knl = lp.add_and_infer_dtypes(knl, dict(jac=dtype))
+    return lp.split_iname(knl, "n", 128, outer_tag="g.0", inner_tag="l.0")
+
+
+def _make_weighted_reduction_kernel(cl_context, kind, dtype, real_dtype,
+        group_layout):
+    """Return a :class:`pyopencl.reduction.ReductionKernel` summing a
+    quantity multiplied by per-node weights (i.e. quadrature weights scaled
+    by area elements) over all nodes of a discretization.
+
+    The quadrature weight of each node is looked up in a table of the
+    weights of all element groups, so that no per-node weight array is
+    needed. *group_layout* is a tuple of ``(node_nr_base, nunit_nodes,
+    table_offset)`` for each element group.
+
+    Not memoized here, since a process-wide cache would keep *cl_context*
+    alive. Each :class:`Discretization` caches the kernels it uses instead.
+    """
+
+    from pyopencl.tools import dtype_to_ctype
+    from pyopencl.reduction import ReductionKernel
+
+    ctype = dtype_to_ctype(dtype)
+    real_ctype = dtype_to_ctype(real_dtype)
+    is_complex = dtype.kind == "c"
+    complex_prefix = ctype.replace("_t", "")
+
+    # The first array argument determines the range of the reduction.
+    arguments = [
+            "%s *a" % ctype,
+            "%s *area_element" % real_ctype,
+            "%s *weight_table" % real_ctype,
+            ]
+
+    # select the group of node i by comparing with the group boundaries
+    weight = None
+    for igrp in range(len(group_layout)-1, -1, -1):
+        node_nr_base, nunit_nodes, table_offset = group_layout[igrp]
+        grp_weight = "weight_table[(i - %d) %% %d + %d]" % (
+                node_nr_base, nunit_nodes, table_offset)
+        if weight is None:
+            weight = grp_weight
+        else:
+            weight = "(i < %d ? %s : %s)" % (
+                    group_layout[igrp+1][0], grp_weight, weight)
+
+    weight = "(%s * area_element[i])" % weight
+
+    if is_complex:
+        abs_a = "%s_abs(a[i])" % complex_prefix
+        abs_a_squared = "%s_abs_squared(a[i])" % complex_prefix
+    else:
+        abs_a = "fabs(a[i])"
+        abs_a_squared = "a[i]*a[i]"
+
+    out_dtype = real_dtype
+    neutral = "0"
+    reduce_expr = "a+b"
+
+    if kind == "integral":
+        out_dtype = dtype
+        if is_complex:
+            map_expr = "%s_rmul(%s, a[i])" % (complex_prefix, weight)
+        else:
+            map_expr = "%s * a[i]" % weight
+
+    elif kind == "inner_product":
+        out_dtype = dtype
+        arguments.append("%s *b" % ctype)
+        if is_complex:
+            map_expr = "%s_rmul(%s, %s_mul(%s_conj(a[i]), b[i]))" % (
+                    complex_prefix, weight, complex_prefix, complex_prefix)
+        else:
+            map_expr = "%s * a[i] * b[i]" % weight
+
+    elif kind == "norm_2":
+        map_expr = "%s * %s" % (weight, abs_a_squared)
+
+    elif kind == "norm_p":
+        arguments.append("%s p" % real_ctype)
+        map_expr = "%s * pow(%s, p)" % (weight, abs_a)
+
+    elif kind == "norm_inf":
+        map_expr = abs_a
+        reduce_expr = "fmax(a, b)"
+
+    else:
+        raise ValueError("unknown reduction kind: '%s'" % kind)
+
+    if out_dtype.kind == "c":
+        neutral = "%s_new(0, 0)" % complex_prefix
+        reduce_expr = "%s_add(a, b)" % complex_prefix
+
+    # Only ask for double precision complex support where it is needed, so
+    # that single precision reductions work on devices without fp64.
+    preamble = []
+    if is_complex:
+        if np.float64 in (dtype, real_dtype) or dtype == np.complex128:
+            preamble.append("#define PYOPENCL_DEFINE_CDOUBLE")
+        preamble.append("#include <pyopencl-complex.h>")
+
+    return ReductionKernel(cl_context, out_dtype,
+            neutral=neutral, reduce_expr=reduce_expr, map_expr=map_expr,
+            arguments=", ".join(arguments),
+            name="meshmode_%s" % kind,
+            preamble="\n".join(preamble))
+
+
+def _compute_metric_terms_host(jac, result):
+    """Host-side equivalent of the kernel built by
+    :func:`_make_metric_kernel`, filling the arrays in the :class:`dict`
+    *result*.
+    """
+
+    import numpy.linalg as la
+
+    ambient_dim, dim, _ = jac.shape
+    node_jac = jac.transpose(2, 0, 1)
+
+    if ambient_dim == dim:
+        det = la.det(node_jac)
+        result["jacobian_determinant"][:] = det
+        result["area_element"][:] = np.abs(det)
+        result["inverse_jacobian"][:] = la.inv(node_jac).transpose(1, 2, 0)
+    else:
+        area = np.sqrt(la.det(np.einsum("nar,nas->nrs", node_jac, node_jac)))
+        result["area_element"][:] = area
+
+        if ambient_dim == dim + 1:
+            for a in range(ambient_dim):
+                minor = np.delete(node_jac, a, axis=1)
+                result["normals"][a] = (-1)**a * la.det(minor) / area
+
+
+def _weighted_reduction_host(weights, kind, a, b=None, p=None):
+    """Host-side equivalent of the kernels built by
+    :func:`_make_weighted_reduction_kernel`.
+    """
+
+    if kind == "integral":
+        return np.dot(weights, a)
+    elif kind == "inner_product":
+        return np.dot(weights, a.conj()*b)
+    elif kind == "norm_2":
+        return np.dot(weights, np.abs(a)**2)
+    elif kind == "norm_p":
+        return np.dot(weights, np.abs(a)**p)
+    elif kind == "norm_inf":
+        return np.abs(a).max()
+    else:
+        raise ValueError("unknown reduction kind: '%s'" % kind)
+
+
+def _get_affine_jacobians(meg, rtol=1e-12):
+    """If all elements of the mesh element group *meg* are affinely mapped,
+    return their (constant) Jacobians as an array of shape
+    ``(ambient_dim, dim, nelements)``. Otherwise, return *None*.
+    """
+
+    # fit x = b + A r to the nodes of each element
+    vdm = np.hstack([
+        np.ones((meg.nunit_nodes, 1)),
+        meg.unit_nodes.T])
+    nodes = meg.nodes.reshape(-1, meg.nunit_nodes).T
+
+    coeffs, _, _, _ = np.linalg.lstsq(vdm, nodes, rcond=None)
+    residual = np.abs(np.dot(vdm, coeffs) - nodes).max()
+    if residual > rtol * max(1, np.abs(nodes).max()):
+        return None
+
+    ambient_dim = meg.nodes.shape[0]
+    return np.ascontiguousarray(
+            coeffs[1:].T.reshape(ambient_dim, meg.nelements, meg.dim)
+            .transpose(0, 2, 1))
+
+# }}}
+
+
+# {{{ multi-component data
+
+def _is_obj_array(vec):
+    return isinstance(vec, np.ndarray) and vec.dtype.char == "O"
+
+
+def _as_components(ary):
+    """Return a view of the array *ary* of shape ``(nnodes,)`` or
+    ``(ncomponents, nnodes)`` with an explicit component axis.
+    """
+    if len(ary.shape) == 1:
+        return ary.reshape(1, ary.shape[0])
+    else:
+        return ary
+
+
+def _check_node_data_shape(vec, nnodes):
+    if len(vec.shape) not in [1, 2] or vec.shape[-1] != nnodes:
+        raise ValueError("invalid shape of incoming data: expected "
+                "(nnodes,) or (ncomponents, nnodes) with nnodes=%d, got %s"
+                % (nnodes, vec.shape))
+
+
+def _stack_components(discr, queue, components, wait_for):
+    """Copy the arrays in the object array *components* into one array of
+    shape ``(ncomponents, nnodes)`` on *discr*, so that operators can treat
+    all of them in one kernel launch.
+
+    :return: the stacked array, or *None* if the components do not all
+        have the same data type and shape ``(nnodes,)``.
+    """
+
+    components = list(components)
+    array_type = np.ndarray if discr.cl_context is None else cl.array.Array
+
+    if not components or not all(
+            isinstance(comp, array_type) and comp.shape == (discr.nnodes,)
+            for comp in components):
+        return None
+
+    dtype = components[0].dtype
+    if any(comp.dtype != dtype for comp in components):
+        return None
+
+    if discr.cl_context is None:
+        return np.array(components)
+
+    result = discr.empty(dtype, extra_dims=(len(components),))
+    for icomp, comp in enumerate(components):
+        evt = cl.enqueue_copy(queue, result.base_data, comp.base_data,
+                byte_count=comp.nbytes,
+                src_offset=comp.offset,
+                dst_offset=result.offset + icomp*comp.nbytes,
+                wait_for=_get_wait_for(wait_for, comp, result))
+        result.add_event(evt)
+
+    return result
+
+
+def _apply_to_components(operator, discr, queue, vec, out, wait_for):
+    """Apply *operator* (a function of an array, *out* and *wait_for*) to
+    the object array *vec*, in one application to the stacked components
+    if possible.
+
+    :arg discr: the discretization on which *vec* lives.
+    :arg out: *None*, or a stacked array to hold the result.
+    :return: an object array of (views of) the results.
+    """
+
+    from pytools.obj_array import make_obj_array
+
+    stacked = _stack_components(discr, queue, vec, wait_for)
+    if stacked is None:
+        if out is not None:
+            raise ValueError("'out' is only supported for object arrays "
+                    "of equally-typed arrays")
+
+        return make_obj_array([
+            operator(comp, None, wait_for) for comp in vec])
+
+    result = operator(stacked, out, None)
+    return make_obj_array([result[icomp] for icomp in range(len(vec))])
+
+# }}}
+
+
+# {{{ events
+
+def _get_wait_for(wait_for, *arrays):
+    """Return a list of the events in *wait_for* and those pending on
+    *arrays*, for passing to a kernel reading from or writing to *arrays*.
+    """
+    result = list(wait_for) if wait_for is not None else []
+    for ary in arrays:
+        result.extend(ary.events)
+    return result
+
+# }}}
+
+
 # {{{ element group base
 
 class ElementGroupBase(object):
@@ -127,27 +635,89 @@ class Discretization(object):
 
     .. attribute :: groups
 
+    .. attribute :: allocator
+
+        Used for all arrays returned by this discretization and by
+        connections into it. Operators returning arrays accept an *out*
+        argument to write into an existing array instead.
+
+    .. attribute:: cl_context
+
+        The :class:`pyopencl.Context` in which this discretization's data
+        lives, or *None*. In the latter case, all data are
+        :class:`numpy.ndarray` instances, and operators (as well as
+        connections between such discretizations) are evaluated on the host
+        using :mod:`numpy`, without compiling any kernels. Their *queue* and
+        *wait_for* arguments are then ignored. This is convenient (and
+        faster) for small problems.
+
+    Operators do not wait for the work they enqueue to finish. They take
+    a *wait_for* list of events, in addition to which they wait for the
+    events pending on their input arrays. The events of the work they
+    enqueue are attached to the returned arrays (see
+    :attr:`pyopencl.array.Array.events`), so that further operations on
+    them can be chained without synchronizing with the host.
+
     .. method:: empty(dtype, queue=None, extra_dims=None)
 
-    .. method:: nodes()
+    .. automethod:: nodes
 
-        shape: ``(ambient_dim, nnodes)``
+    .. automethod:: num_reference_derivative
 
-    .. method:: num_reference_derivative(queue, ref_axes, vec)
+    .. automethod:: num_reference_gradient
 
-    .. method:: quad_weights(queue)
+    .. method:: quad_weights(queue, out=None, wait_for=None)
 
         shape: ``(nnodes)``
+
+    .. rubric:: Geometric factors
+
+    Since the mesh of a discretization never changes, these are computed
+    once (per discretization) and kept on the device. Affinely mapped
+    element groups use closed-form, element-wise constant Jacobians. Each
+    takes an optional *queue*, with the same meaning as for :meth:`nodes`.
+
+    .. automethod:: jacobian
+    .. automethod:: jacobian_determinant
+    .. automethod:: inverse_jacobian
+    .. automethod:: area_element
+    .. automethod:: normals
+
+    .. rubric:: Reductions
+
+    These use the quadrature weights of each element group, scaled by
+    :meth:`area_element`, and return host scalars. Each runs in a single
+    kernel launch over all groups, after waiting for the events in an
+    optional *wait_for* argument.
+
+    .. automethod:: integral
+    .. automethod:: norm
+    .. automethod:: inner_product
+
+    .. automethod:: warm_up
     """
 
-    def __init__(self, cl_ctx, mesh, group_factory, real_dtype=np.float64):
+    def __init__(self, cl_ctx, mesh, group_factory, real_dtype=np.float64,
+            allocator=None):
         """
+        :arg cl_ctx: A :class:`pyopencl.Context`, or *None* to keep all data
+            on the host. See :attr:`cl_context`.
         :arg order: A polynomial-order-like parameter passed unmodified to
             :attr:`group_class`. See subclasses for more precise definition.
+        :arg allocator: A :mod:`pyopencl` allocator. Defaults to a
+            :class:`pyopencl.tools.MemoryPool`, so that repeatedly
+            applying operators does not cause repeated device allocations.
+            Discretizations can share a pool by passing the same allocator.
         """
 
         self.cl_context = cl_ctx
 
+        if allocator is None and cl_ctx is not None:
+            import pyopencl.tools as cl_tools
+            allocator = cl_tools.MemoryPool(cl_tools.DeferredAllocator(cl_ctx))
+
+        self.allocator = allocator
+
         self.mesh = mesh
         self.nnodes = 0
         self.groups = []
@@ -171,95 +741,565 @@ class Discretization(object):
         return self.mesh.ambient_dim
 
     def empty(self, dtype, queue=None, extra_dims=None):
+        shape = (self.nnodes,)
+        if extra_dims is not None:
+            shape = extra_dims + shape
+
+        if self.cl_context is None:
+            return np.empty(shape, dtype=dtype)
+
         if queue is None:
             first_arg = self.cl_context
         else:
             first_arg = queue
 
+        return cl.array.empty(first_arg, shape, dtype=dtype,
+                allocator=self.allocator)
+
+    def _empty_or_out(self, out, dtype, extra_dims=None):
+        if out is None:
+            return self.empty(dtype, extra_dims=extra_dims)
+
         shape = (self.nnodes,)
         if extra_dims is not None:
             shape = extra_dims + shape
 
-        return cl.array.empty(first_arg, shape, dtype=dtype)
+        if out.shape != shape or out.dtype != dtype:
+            raise ValueError("'out' must have shape %s and dtype '%s'"
+                    % (shape, dtype))
+
+        return out
+
+    @memoize_method
+    def _diff_matrix(self, igrp, ref_axes):
+        grp = self.groups[igrp]
+
+        mat = None
+        for ref_axis in ref_axes:
+            next_mat = grp.diff_matrices()[ref_axis]
+            if mat is None:
+                mat = next_mat
+            else:
+                mat = np.dot(next_mat, mat)
+
+        return mat
+
+    # {{{ device-side reference operators
+
+    # Host arrays passed to a kernel get copied to the device with a
+    # blocking transfer, which would wait for all work pending on the
+    # queue. These are therefore uploaded once, on a separate queue.
+
+    @memoize_method
+    def _device_diff_matrix(self, igrp, ref_axes):
+        with cl.CommandQueue(self.cl_context) as queue:
+            return cl.array.to_device(queue,
+                    self._diff_matrix(igrp, ref_axes)).with_queue(None)
+
+    @memoize_method
+    def _device_diff_matrices(self, igrp):
+        with cl.CommandQueue(self.cl_context) as queue:
+            return cl.array.to_device(queue,
+                    np.array(self.groups[igrp].diff_matrices())) \
+                    .with_queue(None)
+
+    @memoize_method
+    def _device_mesh_nodes(self, igrp):
+        with cl.CommandQueue(self.cl_context) as queue:
+            return cl.array.to_device(queue,
+                    self.groups[igrp].mesh_el_group.nodes).with_queue(None)
+
+    @memoize_method
+    def _device_mesh_diff_matrices(self, igrp):
+        with cl.CommandQueue(self.cl_context) as queue:
+            return cl.array.to_device(queue,
+                    np.array(self.groups[igrp].mesh_diff_matrices())) \
+                    .with_queue(None)
+
+    @memoize_method
+    def _device_affine_jacobians(self, igrp):
+        """Return the constant element Jacobians of group *igrp* if its
+        elements are affinely mapped, else *None*.
+        """
+        el_jacobians = _get_affine_jacobians(self.groups[igrp].mesh_el_group)
+        if el_jacobians is None:
+            return None
+
+        with cl.CommandQueue(self.cl_context) as queue:
+            return cl.array.to_device(queue,
+                    el_jacobians.astype(self.real_dtype)).with_queue(None)
+
+    @memoize_method
+    def _quad_weight_tables(self):
+        with cl.CommandQueue(self.cl_context) as queue:
+            return [
+                    cl.array.to_device(queue,
+                        grp.weights.astype(self.real_dtype)).with_queue(None)
+                    for grp in self.groups]
+
+    # }}}
 
     def num_reference_derivative(
-            self, queue, ref_axes, vec):
-        @memoize_method_nested
-        def knl():
-            knl = lp.make_kernel(
-                """{[k,i,j]:
-                    0<=k<nelements and
-                    0<=i,j<ndiscr_nodes}""",
-                "result[k,i] = sum(j, diff_mat[i, j] * vec[k, j])",
-                default_offset=lp.auto, name="diff")
+            self, queue, ref_axes, vec, out=None, wait_for=None):
+        """
+        :arg vec: an array of shape ``(nnodes,)``, a stacked array of shape
+            ``(ncomponents, nnodes)``, or an object array of arrays. All
+            components are differentiated in one kernel launch (per group).
+            Components of object arrays are stacked for this purpose.
+        :return: an array of the same shape as *vec*, or an object array
+            (of views into a stacked result array).
+        """
 
-            knl = lp.split_iname(knl, "i", 16, inner_tag="l.0")
-            return lp.tag_inames(knl, dict(k="g.0"))
+        if _is_obj_array(vec):
+            return _apply_to_components(
+                    lambda comp, comp_out, comp_wait_for:
+                    self.num_reference_derivative(
+                        queue, ref_axes, comp, out=comp_out,
+                        wait_for=comp_wait_for),
+                    self, queue, vec, out, wait_for)
+
+        _check_node_data_shape(vec, self.nnodes)
+        result = self._empty_or_out(out, vec.dtype, extra_dims=vec.shape[:-1])
+
+        if self.cl_context is None:
+            for igrp, grp in enumerate(self.groups):
+                np.matmul(grp.view(vec),
+                        self._diff_matrix(igrp, tuple(ref_axes)).T,
+                        out=grp.view(result))
+            return result
+
+        wait_for = _get_wait_for(wait_for, vec, result)
+
+        for igrp, grp in enumerate(self.groups):
+            knl = _make_diff_kernel(grp.nunit_nodes, vec.dtype)
+            evt, _ = knl(queue,
+                    diff_mat=self._device_diff_matrix(igrp, tuple(ref_axes)),
+                    result=grp.view(_as_components(result)),
+                    vec=grp.view(_as_components(vec)),
+                    wait_for=wait_for)
+            result.add_event(evt)
 
-        result = self.empty(vec.dtype)
+        return result
 
-        for grp in self.groups:
-            mat = None
-            for ref_axis in ref_axes:
-                next_mat = grp.diff_matrices()[ref_axis]
-                if mat is None:
-                    mat = next_mat
-                else:
-                    mat = np.dot(next_mat, mat)
+    def num_reference_gradient(self, queue, vec, out=None, wait_for=None):
+        """Compute the derivatives of *vec* along all reference axes at once,
+        reading each element's data only once.
+
+        :arg vec: an array of shape ``(nnodes,)``, a stacked array of shape
+            ``(ncomponents, nnodes)``, or an object array of arrays of shape
+            ``(nnodes,)``. All components are differentiated in the same
+            kernel launch (per group).
+        :arg out: if given, an array (or object array of arrays, matching
+            *vec*) to write the result to.
+        :return: an array of shape ``(dim, nnodes)`` or
+            ``(ncomponents, dim, nnodes)``, or an object array of arrays of
+            shape ``(dim, nnodes)`` if *vec* is an object array.
+        """
+
+        if _is_obj_array(vec):
+            fields = list(vec)
+            for field in fields:
+                if len(field.shape) != 1:
+                    raise ValueError("components of object arrays must be "
+                            "of shape (nnodes,)")
+                _check_node_data_shape(field, self.nnodes)
+
+            if out is None:
+                outs = [None]*len(fields)
+            elif _is_obj_array(out) and len(out) == len(fields):
+                outs = list(out)
+            else:
+                raise ValueError("'out' must be an object array matching 'vec'")
+
+            results = [
+                    self._empty_or_out(field_out, field.dtype,
+                        extra_dims=(self.dim,))
+                    for field, field_out in zip(fields, outs)]
+
+        else:
+            _check_node_data_shape(vec, self.nnodes)
+            result = self._empty_or_out(out, vec.dtype,
+                    extra_dims=vec.shape[:-1] + (self.dim,))
+
+            if len(vec.shape) == 1:
+                fields = [vec]
+                results = [result]
+            else:
+                fields = [vec[icomp] for icomp in range(vec.shape[0])]
+                results = [result[icomp] for icomp in range(vec.shape[0])]
+
+        if self.cl_context is None:
+            for grp in self.groups:
+                diff_mats_t = np.array(grp.diff_matrices()).transpose(0, 2, 1)
+                for field, field_result in zip(fields, results):
+                    np.matmul(grp.view(field), diff_mats_t,
+                            out=grp.view(field_result))
+        elif _is_obj_array(vec):
+            self._apply_gradient_kernels(queue, fields, results,
+                    _get_wait_for(wait_for, *(fields + results)), results)
+        else:
+            # The per-component views do not carry the events of the
+            # stacked arrays.
+            self._apply_gradient_kernels(queue, fields, results,
+                    _get_wait_for(wait_for, vec, result), [result])
+
+        if _is_obj_array(vec):
+            from pytools.obj_array import make_obj_array
+            return make_obj_array(results)
+        else:
+            return result
 
-            knl()(queue, diff_mat=mat, result=grp.view(result), vec=grp.view(vec))
+    def _apply_gradient_kernels(self, queue, fields, results, wait_for,
+            event_arrays):
+        """
+        :arg event_arrays: the arrays to attach the events of the kernels to.
+        """
+
+        for igrp, grp in enumerate(self.groups):
+            knl = _make_gradient_kernel(grp.nunit_nodes, self.dim,
+                    tuple(field.dtype for field in fields))
+
+            kwargs = {}
+            for ifield, (field, result) in enumerate(zip(fields, results)):
+                kwargs["vec%d" % ifield] = grp.view(field)
+                kwargs["result%d" % ifield] = grp.view(result)
+
+            evt, _ = knl(queue, diff_mats=self._device_diff_matrices(igrp),
+                    wait_for=wait_for, **kwargs)
+            for ary in event_arrays:
+                ary.add_event(evt)
+
+    def quad_weights(self, queue, out=None, wait_for=None):
+        result = self._empty_or_out(out, self.real_dtype)
+
+        if self.cl_context is None:
+            for grp in self.groups:
+                grp.view(result)[:] = grp.weights
+            return result
+
+        wait_for = _get_wait_for(wait_for, result)
+
+        for grp, weights in zip(self.groups, self._quad_weight_tables()):
+            knl = _make_quad_weights_kernel(grp.nunit_nodes, self.real_dtype)
+            evt, _ = knl(queue, result=grp.view(result), weights=weights,
+                    wait_for=wait_for)
+            result.add_event(evt)
 
         return result
 
-    def quad_weights(self, queue):
-        @memoize_method_nested
-        def knl():
-            knl = lp.make_kernel(
-                "{[k,i]: 0<=k<nelements and 0<=i<ndiscr_nodes}",
-                "result[k,i] = weights[i]",
-                name="quad_weights")
+    def _compute_nodes(self, queue):
+        result = self.empty(self.real_dtype, extra_dims=(self.ambient_dim,))
 
-            knl = lp.split_iname(knl, "i", 16, inner_tag="l.0")
-            return lp.tag_inames(knl, dict(k="g.0"))
+        if self.cl_context is None:
+            for grp in self.groups:
+                np.matmul(grp.mesh_el_group.nodes, grp.resampling_matrix().T,
+                        out=grp.view(result))
+            return result
+
+        # see the comment on the device-side reference operators
+        with cl.CommandQueue(self.cl_context) as upload_queue:
+            resampling_mats = [
+                    cl.array.to_device(upload_queue, grp.resampling_matrix())
+                    .with_queue(None)
+                    for grp in self.groups]
+
+        for igrp, grp in enumerate(self.groups):
+            meg = grp.mesh_el_group
+            knl = _make_nodes_kernel(
+                    grp.nunit_nodes, meg.nunit_nodes,
+                    meg.nodes.dtype, self.real_dtype)
+            evt, _ = knl(queue,
+                    resampling_mat=resampling_mats[igrp],
+                    result=grp.view(result),
+                    nodes=self._device_mesh_nodes(igrp))
+            result.add_event(evt)
 
-        result = self.empty(self.real_dtype)
-        for grp in self.groups:
-            knl()(queue, result=grp.view(result), weights=grp.weights)
         return result
 
-    @memoize_method
-    def nodes(self):
-        @memoize_method_nested
-        def knl():
-            knl = lp.make_kernel(
-                """{[d,k,i,j]:
-                    0<=d<dims and
-                    0<=k<nelements and
-                    0<=i<ndiscr_nodes and
-                    0<=j<nmesh_nodes}""",
-                """
-                    result[d, k, i] = \
-                        sum(j, resampling_mat[i, j] * nodes[d, k, j])
-                    """,
-                name="nodes",
-                default_offset=lp.auto)
-
-            knl = lp.split_iname(knl, "i", 16, inner_tag="l.0")
-            knl = lp.tag_inames(knl, dict(k="g.0"))
-            knl = lp.tag_data_axes(knl, "result",
-                    "stride:auto,stride:auto,stride:auto")
-            return knl
+    def nodes(self, queue=None):
+        """
+        :arg queue: If given, and the nodes have not been computed yet, the
+            computation is enqueued on *queue* and not waited for. Otherwise,
+            a temporary queue is used, and the computation is complete upon
+            return.
+        :return: an array of shape ``(ambient_dim, nnodes)``, computed once
+            and then cached.
+        """
 
-        result = self.empty(self.real_dtype, extra_dims=(self.ambient_dim,))
+        return self._get_cached("_nodes", self._compute_nodes, queue)
 
-        with cl.CommandQueue(self.cl_context) as queue:
+    def _get_cached(self, attr_name, compute, queue):
+        """Return the attribute *attr_name*, setting it to ``compute(queue)``
+        first if it does not exist. If *queue* is *None*, a temporary queue
+        is used and finished before returning.
+        """
+
+        try:
+            return getattr(self, attr_name)
+        except AttributeError:
+            pass
+
+        if queue is None and self.cl_context is not None:
+            with cl.CommandQueue(self.cl_context) as queue:
+                result = compute(queue)
+        else:
+            result = compute(queue)
+
+        setattr(self, attr_name, result)
+        return result
+
+    # {{{ geometric factors
+
+    def _compute_jacobian(self, queue):
+        result = self.empty(self.real_dtype,
+                extra_dims=(self.ambient_dim, self.dim))
+
+        if self.cl_context is None:
             for grp in self.groups:
                 meg = grp.mesh_el_group
-                knl()(queue,
-                        resampling_mat=grp.resampling_matrix(),
-                        result=grp.view(result), nodes=meg.nodes)
+
+                el_jacobians = _get_affine_jacobians(meg)
+                if el_jacobians is not None:
+                    grp.view(result)[:] = el_jacobians[:, :, :, np.newaxis]
+                else:
+                    grp.view(result)[:] = np.einsum("rij,akj->arki",
+                            np.array(grp.mesh_diff_matrices()), meg.nodes)
+
+            return result
+
+        for igrp, grp in enumerate(self.groups):
+            meg = grp.mesh_el_group
+
+            el_jacobians = self._device_affine_jacobians(igrp)
+            if el_jacobians is not None:
+                knl = _make_affine_jacobian_kernel(
+                        grp.nunit_nodes, self.dim, self.real_dtype)
+                evt, _ = knl(queue,
+                        el_jacobians=el_jacobians,
+                        result=grp.view(result))
+            else:
+                knl = _make_jacobian_kernel(
+                        grp.nunit_nodes, meg.nunit_nodes, self.dim,
+                        meg.nodes.dtype, self.real_dtype)
+                evt, _ = knl(queue,
+                        diff_mats=self._device_mesh_diff_matrices(igrp),
+                        result=grp.view(result),
+                        nodes=self._device_mesh_nodes(igrp))
+            result.add_event(evt)
 
         return result
 
+    def jacobian(self, queue=None):
+        """
+        :arg queue: as for :meth:`nodes`.
+        :return: the derivatives of the element maps, with shape
+            ``(ambient_dim, dim, nnodes)``, computed once and then cached.
+        """
+        return self._get_cached("_jacobian", self._compute_jacobian, queue)
+
+    def _compute_metric_terms(self, queue):
+        result = {
+                "area_element": self.empty(self.real_dtype)
+                }
+        if self.dim == self.ambient_dim:
+            result["jacobian_determinant"] = self.empty(self.real_dtype)
+            result["inverse_jacobian"] = self.empty(self.real_dtype,
+                    extra_dims=(self.dim, self.ambient_dim))
+        elif self.dim + 1 == self.ambient_dim:
+            result["normals"] = self.empty(self.real_dtype,
+                    extra_dims=(self.ambient_dim,))
+
+        jac = self.jacobian(queue)
+
+        if self.cl_context is None:
+            _compute_metric_terms_host(jac, result)
+            return result
+
+        knl = _make_metric_kernel(self.ambient_dim, self.dim, self.real_dtype)
+        evt, _ = knl(queue, jac=jac, wait_for=_get_wait_for(None, jac),
+                **result)
+        for ary in result.values():
+            ary.add_event(evt)
+
+        return result
+
+    def _metric_terms(self, queue=None):
+        return self._get_cached(
+                "_metric_terms_dict", self._compute_metric_terms, queue)
+
+    def jacobian_determinant(self, queue=None):
+        """
+        :return: the determinant of :meth:`jacobian`, with shape
+            ``(nnodes,)``. Only available if :attr:`dim` equals
+            :attr:`ambient_dim`.
+        """
+        if self.dim != self.ambient_dim:
+            raise ValueError("Jacobian determinant only available for "
+                    "discretizations of full-dimensional meshes")
+
+        return self._metric_terms(queue)["jacobian_determinant"]
+
+    def inverse_jacobian(self, queue=None):
+        """
+        :return: the inverse of :meth:`jacobian`, i.e. the derivatives of
+            the reference coordinates with respect to the ambient ones, with
+            shape ``(dim, ambient_dim, nnodes)``. Only available if
+            :attr:`dim` equals :attr:`ambient_dim`.
+        """
+        if self.dim != self.ambient_dim:
+            raise ValueError("inverse Jacobian only available for "
+                    "discretizations of full-dimensional meshes")
+
+        return self._metric_terms(queue)["inverse_jacobian"]
+
+    def area_element(self, queue=None):
+        """
+        :return: the factor relating reference and physical measure,
+            :math:`\\sqrt{\\det(J^TJ)}`, with shape ``(nnodes,)``.
+        """
+        return self._metric_terms(queue)["area_element"]
+
+    def normals(self, queue=None):
+        """
+        :return: the unit normals, with shape ``(ambient_dim, nnodes)``.
+            Only available if :attr:`dim` is one less than
+            :attr:`ambient_dim`. Their direction follows from the
+            orientation of the elements: in two dimensions, they point to the
+            right of the direction of traversal.
+        """
+        if self.dim + 1 != self.ambient_dim:
+            raise ValueError("normals only available for "
+                    "discretizations of codimension-1 meshes")
+
+        return self._metric_terms(queue)["normals"]
+
+    # }}}
+
+    # {{{ reductions
+
+    @memoize_method
+    def _device_weight_table(self):
+        """Return the quadrature weights of all groups, concatenated, and the
+        *group_layout* for :func:`_make_weighted_reduction_kernel`.
+        """
+
+        group_layout = []
+        table_offset = 0
+        for grp in self.groups:
+            group_layout.append(
+                    (grp.node_nr_base, grp.nunit_nodes, table_offset))
+            table_offset += grp.nunit_nodes
+
+        weight_table = np.concatenate(
+                [grp.weights for grp in self.groups]).astype(self.real_dtype)
+
+        with cl.CommandQueue(self.cl_context) as queue:
+            return (cl.array.to_device(queue, weight_table).with_queue(None),
+                    tuple(group_layout))
+
+    @memoize_method
+    def _weighted_reduction_kernel(self, kind, dtype):
+        _, group_layout = self._device_weight_table()
+        return _make_weighted_reduction_kernel(
+                self.cl_context, kind, dtype, self.real_dtype, group_layout)
+
+    def _weighted_reduction(self, queue, kind, a, b=None, p=None,
+            wait_for=None):
+        if a.shape != (self.nnodes,):
+            raise ValueError("invalid shape of incoming data")
+        if b is not None and b.shape != (self.nnodes,):
+            raise ValueError("invalid shape of incoming data")
+
+        if self.cl_context is None:
+            return _weighted_reduction_host(
+                    self.quad_weights(None) * self.area_element(),
+                    kind, a, b=b, p=p)
+
+        dtype = a.dtype
+        if b is not None and b.dtype != dtype:
+            dtype = np.result_type(a.dtype, b.dtype)
+            a = a.astype(dtype, queue=queue)
+            b = b.astype(dtype, queue=queue)
+
+        knl = self._weighted_reduction_kernel(kind, dtype)
+        weight_table, _ = self._device_weight_table()
+        area_element = self.area_element(queue)
+
+        extra_args = []
+        if b is not None:
+            extra_args.append(b)
+        if p is not None:
+            extra_args.append(p)
+
+        return knl(a, area_element, weight_table, *extra_args, queue=queue,
+                wait_for=_get_wait_for(wait_for, a, area_element,
+                    *[b] if b is not None else [])).get()
+
+    def integral(self, queue, vec, wait_for=None):
+        """Return the integral of *vec* over the discretized domain."""
+        return self._weighted_reduction(queue, "integral", vec,
+                wait_for=wait_for)
+
+    def norm(self, queue, vec, p=2, wait_for=None):
+        """Return the :math:`L^p` norm of *vec*. *p* may be ``np.inf``, in
+        which case the maximum absolute value at the nodes is returned.
+        """
+
+        if p == 2:
+            return np.sqrt(self._weighted_reduction(queue, "norm_2", vec,
+                wait_for=wait_for))
+        elif p == np.inf:
+            return self._weighted_reduction(queue, "norm_inf", vec,
+                    wait_for=wait_for)
+        else:
+            return self._weighted_reduction(
+                    queue, "norm_p", vec, p=self.real_dtype.type(p),
+                    wait_for=wait_for)**(1/p)
+
+    def inner_product(self, queue, a, b, wait_for=None):
+        """Return the :math:`L^2` inner product of *a* and *b*. If they are
+        complex, *a* is conjugated.
+        """
+        return self._weighted_reduction(queue, "inner_product", a, b=b,
+                wait_for=wait_for)
+
+    # }}}
+
+    def warm_up(self, queue, dtypes=None):
+        """Build and compile all kernels needed by this discretization's
+        operators, and compute its reference-element operators.
+
+        :arg dtypes: a list of data types for which to prepare the
+            operators acting on data, defaulting to :attr:`real_dtype`.
+        :return: the wall time spent, in seconds.
+        """
+
+        from time import time
+        start_time = time()
+
+        if dtypes is None:
+            dtypes = [self.real_dtype]
+
+        self.nodes(queue)
+        self._metric_terms(queue)
+        self.quad_weights(queue)
+
+        # On the host, there are no kernels to compile.
+        if self.cl_context is not None:
+            for dtype in dtypes:
+                vec = self.empty(dtype, queue=queue)
+                vec.fill(0)
+                for ref_axis in range(self.dim):
+                    self.num_reference_derivative(queue, (ref_axis,), vec)
+                self.num_reference_gradient(queue, vec)
+                self.integral(queue, vec)
+                self.norm(queue, vec)
+
+            queue.finish()
+
+        elapsed = time() - start_time
+        logger.info("discretization warm-up: %g s" % elapsed)
+        return elapsed
+
 
 # vim: fdm=marker
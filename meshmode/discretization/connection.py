@@ -27,10 +27,15 @@ THE SOFTWARE.
 """
 
 import numpy as np
+import numpy.linalg as la
 import modepy as mp
 import pyopencl as cl
 import pyopencl.array  # noqa
-from pytools import memoize_method, memoize_method_nested, Record
+from pytools import memoize, memoize_method, Record
+
+from meshmode.discretization import (
+        ElementGroupBase, _get_wait_for, _is_obj_array, _as_components,
+        _check_node_data_shape, _apply_to_components)
 
 import logging
 logger = logging.getLogger(__name__)
@@ -39,10 +44,30 @@ logger = logging.getLogger(__name__)
 __doc__ = """
 .. autoclass:: DiscretizationConnection
 
+.. autoclass:: ChainedDiscretizationConnection
+
+.. autoclass:: IdentityDiscretizationConnection
+
+.. autoclass:: AdjointDiscretizationConnection
+
 .. autofunction:: make_same_mesh_connection
 
+.. autofunction:: make_order_change_connection
+
 .. autofunction:: make_boundary_restriction
 
+.. autofunction:: make_refinement_connection
+
+.. autofunction:: make_coarsening_connection
+
+.. autofunction:: make_refinement_hierarchy
+
+.. autoclass:: RefinementHierarchy
+
+.. autofunction:: make_point_evaluation_connection
+
+.. autoclass:: PointEvaluationConnection
+
 Implementation details
 ^^^^^^^^^^^^^^^^^^^^^^
 
@@ -52,6 +77,355 @@ Implementation details
 """
 
 
+# {{{ kernels
+
+# Kernels are built once per process, keyed by the (fixed) node counts and
+# argument data types, rather than once per connection. The mapping onto the
+# hardware is chosen by meshmode.discretization.tuning.
+#
+# All kernels act on data with a leading component axis (see
+# _as_components), so that each resampling matrix is applied to all
+# components of a field in one launch.
+
+@memoize
+def _make_resample_kernel(n_to_nodes, n_from_nodes, vec_dtype,
+        source_index_dtype, target_index_dtype):
+    import loopy as lp
+    knl = lp.make_kernel(
+        """{[c,k,i,j]:
+            0<=c<ncomponents and
+            0<=k<nelements and
+            0<=i<n_to_nodes and
+            0<=j<n_from_nodes}""",
+        "result[c, target_element_indices[k], i] \
+            = sum(j, resample_mat[i, j] \
+            * vec[c, source_element_indices[k], j])",
+        [
+            lp.GlobalArg("result", vec_dtype,
+                shape="ncomponents, nelements_result, n_to_nodes",
+                dim_tags="stride:auto,stride:auto,stride:auto",
+                offset=lp.auto),
+            lp.GlobalArg("vec", vec_dtype,
+                shape="ncomponents, nelements_vec, n_from_nodes",
+                dim_tags="stride:auto,stride:auto,stride:auto",
+                offset=lp.auto),
+            lp.GlobalArg("resample_mat", np.float64,
+                shape="n_to_nodes, n_from_nodes"),
+            lp.GlobalArg("source_element_indices", source_index_dtype,
+                shape="nelements"),
+            lp.GlobalArg("target_element_indices", target_index_dtype,
+                shape="nelements"),
+            lp.ValueArg("nelements_result", np.int32),
+            lp.ValueArg("nelements_vec", np.int32),
+            "...",
+            ],
+        name="oversample")
+
+    knl = lp.fix_parameters(knl, n_to_nodes=n_to_nodes, n_from_nodes=n_from_nodes)
+
+    from meshmode.discretization.tuning import TunableKernel
+    return TunableKernel(knl,
+            ("oversample", n_to_nodes, n_from_nodes, str(vec_dtype),
+                str(source_index_dtype), str(target_index_dtype)),
+            output_iname="i", n_output_nodes=n_to_nodes,
+            reduction_iname="j", matrix_name="resample_mat")
+
+
+@memoize
+def _make_fused_resample_kernel(n_to_nodes, n_from_nodes, vec_dtype):
+    import loopy as lp
+    knl = lp.make_kernel(
+        """{[c,k,i,j]:
+            0<=c<ncomponents and
+            0<=k<nelements and
+            0<=i<n_to_nodes and
+            0<=j<n_from_nodes}""",
+        "result[c, to_node_starts[k] + i] \
+            = sum(j, resample_mats[batch_ids[k], i, j] \
+            * vec[c, from_node_starts[k] + j])",
+        [
+            lp.GlobalArg("result", vec_dtype,
+                shape="ncomponents, nnodes_result",
+                dim_tags="stride:auto,stride:auto", offset=lp.auto),
+            lp.GlobalArg("vec", vec_dtype,
+                shape="ncomponents, nnodes_vec",
+                dim_tags="stride:auto,stride:auto", offset=lp.auto),
+            lp.GlobalArg("resample_mats", np.float64,
+                shape="nmats, n_to_nodes, n_from_nodes"),
+            lp.GlobalArg("batch_ids", np.int32, shape="nelements"),
+            lp.GlobalArg("from_node_starts", np.intp, shape="nelements"),
+            lp.GlobalArg("to_node_starts", np.intp, shape="nelements"),
+            lp.ValueArg("nnodes_result", np.int32),
+            lp.ValueArg("nnodes_vec", np.int32),
+            lp.ValueArg("nmats", np.int32),
+            "...",
+            ],
+        name="oversample_fused")
+
+    knl = lp.fix_parameters(knl, n_to_nodes=n_to_nodes, n_from_nodes=n_from_nodes)
+
+    # The matrix depends on the element, so it cannot be prefetched.
+    from meshmode.discretization.tuning import TunableKernel
+    return TunableKernel(knl,
+            ("oversample_fused", n_to_nodes, n_from_nodes, str(vec_dtype)),
+            output_iname="i", n_output_nodes=n_to_nodes)
+
+
+@memoize
+def _make_block_resample_kernel(n_to_nodes, n_from_nodes, vec_dtype):
+    import loopy as lp
+    knl = lp.make_kernel(
+        """{[c,k,i,j]:
+            0<=c<ncomponents and
+            0<=k<nelements and
+            0<=i<n_to_nodes and
+            0<=j<n_from_nodes}""",
+        "result[c, k, i] = sum(j, resample_mat[i, j] * vec[c, k, j])",
+        default_offset=lp.auto, name="resample_block")
+
+    knl = lp.fix_parameters(knl, n_to_nodes=n_to_nodes, n_from_nodes=n_from_nodes)
+    knl = lp.add_and_infer_dtypes(knl, dict(
+        result=vec_dtype, vec=vec_dtype, resample_mat=np.float64))
+    for name in ["result", "vec"]:
+        knl = lp.tag_data_axes(knl, name, "stride:auto,stride:auto,stride:auto")
+
+    from meshmode.discretization.tuning import TunableKernel
+    return TunableKernel(knl,
+            ("resample_block", n_to_nodes, n_from_nodes, str(vec_dtype)),
+            output_iname="i", n_output_nodes=n_to_nodes,
+            reduction_iname="j", matrix_name="resample_mat")
+
+
+@memoize
+def _make_adjoint_resample_kernel(n_to_nodes, n_from_nodes, vec_dtype,
+        from_index_dtype, to_index_dtype):
+    import loopy as lp
+    knl = lp.make_kernel(
+        """{[c,k,i,j]:
+            0<=c<ncomponents and
+            0<=k<nelements and
+            0<=j<n_to_nodes and
+            0<=i<n_from_nodes}""",
+        "result[c, to_element_indices[k], j] \
+            = result[c, to_element_indices[k], j] \
+            + sum(i, resample_mat[i, j] \
+            * vec[c, from_element_indices[k], i])",
+        [
+            lp.GlobalArg("result", vec_dtype,
+                shape="ncomponents, nelements_result, n_to_nodes",
+                dim_tags="stride:auto,stride:auto,stride:auto",
+                offset=lp.auto),
+            lp.GlobalArg("vec", vec_dtype,
+                shape="ncomponents, nelements_vec, n_from_nodes",
+                dim_tags="stride:auto,stride:auto,stride:auto",
+                offset=lp.auto),
+            lp.GlobalArg("resample_mat", np.float64,
+                shape="n_from_nodes, n_to_nodes"),
+            lp.GlobalArg("from_element_indices", from_index_dtype,
+                shape="nelements"),
+            lp.GlobalArg("to_element_indices", to_index_dtype,
+                shape="nelements"),
+            lp.ValueArg("nelements_result", np.int32),
+            lp.ValueArg("nelements_vec", np.int32),
+            "...",
+            ],
+        name="resample_adjoint")
+
+    knl = lp.fix_parameters(knl, n_to_nodes=n_to_nodes, n_from_nodes=n_from_nodes)
+
+    # The kernel accumulates into its result, so it cannot be timed by
+    # running it repeatedly.
+    from meshmode.discretization.tuning import TunableKernel
+    return TunableKernel(knl,
+            ("resample_adjoint", n_to_nodes, n_from_nodes, str(vec_dtype),
+                str(from_index_dtype), str(to_index_dtype)),
+            output_iname="j", n_output_nodes=n_to_nodes, tune=False)
+
+
+@memoize
+def _make_point_evaluation_kernel(n_from_nodes, vec_dtype):
+    import loopy as lp
+    knl = lp.make_kernel(
+        """{[c,p,j]:
+            0<=c<ncomponents and
+            0<=p<npoints and
+            0<=j<n_from_nodes}""",
+        "result[c, point_indices[p]] \
+            = sum(j, basis_values[p, j] \
+            * vec[c, element_node_starts[p] + j])",
+        [
+            lp.GlobalArg("result", vec_dtype,
+                shape="ncomponents, npoints_result",
+                dim_tags="stride:auto,stride:auto", offset=lp.auto),
+            lp.GlobalArg("vec", vec_dtype,
+                shape="ncomponents, nnodes_vec",
+                dim_tags="stride:auto,stride:auto", offset=lp.auto),
+            lp.GlobalArg("basis_values", np.float64,
+                shape="npoints, n_from_nodes"),
+            lp.GlobalArg("point_indices", np.intp, shape="npoints"),
+            lp.GlobalArg("element_node_starts", np.intp, shape="npoints"),
+            lp.ValueArg("npoints_result", np.int32),
+            lp.ValueArg("nnodes_vec", np.int32),
+            "...",
+            ],
+        name="evaluate_at_points")
+
+    knl = lp.fix_parameters(knl, n_from_nodes=n_from_nodes)
+
+    # one work item per point
+    from meshmode.discretization.tuning import TunableKernel, POINT_CANDIDATES
+    return TunableKernel(knl,
+            ("evaluate_at_points", n_from_nodes, str(vec_dtype)),
+            output_iname="p", n_output_nodes=None,
+            candidates=POINT_CANDIDATES)
+
+# }}}
+
+
+# {{{ helpers
+
+def _to_device(queue, ary):
+    """Copy the index data *ary* to the device. For discretizations that
+    keep their data on the host, *queue* is *None*, and *ary* is returned
+    as is.
+    """
+    if queue is None:
+        return ary
+    else:
+        return cl.array.to_device(queue, ary).with_queue(None)
+
+
+class _HostBatch(Record):
+    """The data of an :class:`InterpolationBatch`, with element indices
+    in host-side :class:`numpy.ndarray` instances. See
+    :func:`_make_connection_groups`.
+    """
+
+    def __init__(self, source_element_indices, target_element_indices,
+            result_unit_nodes, resample_matrix=None):
+        Record.__init__(self,
+                source_element_indices=source_element_indices,
+                target_element_indices=target_element_indices,
+                result_unit_nodes=result_unit_nodes,
+                resample_matrix=resample_matrix)
+
+
+def _make_connection_groups(cl_context, host_groups):
+    """
+    :arg host_groups: a list (one entry per group) of lists of
+        :class:`_HostBatch` instances.
+    :return: a list of :class:`DiscretizationConnectionElementGroup`
+        instances, with the element indices uploaded to *cl_context*
+        (unless that is *None*).
+    """
+
+    def make_groups(queue):
+        return [
+                DiscretizationConnectionElementGroup([
+                    InterpolationBatch(
+                        source_element_indices=_to_device(
+                            queue, batch.source_element_indices),
+                        target_element_indices=_to_device(
+                            queue, batch.target_element_indices),
+                        result_unit_nodes=batch.result_unit_nodes,
+                        resample_matrix=batch.resample_matrix)
+                    for batch in host_batches])
+                for host_batches in host_groups]
+
+    if cl_context is None:
+        return make_groups(None)
+
+    with cl.CommandQueue(cl_context) as queue:
+        return make_groups(queue)
+
+
+def _host_empty_or_out(discr, out, dtype, extra_dims=()):
+    shape = extra_dims + (discr.nnodes,)
+
+    if out is None:
+        return np.empty(shape, dtype=dtype)
+
+    if out.shape != shape or out.dtype != dtype:
+        raise ValueError("'out' must have shape %s and dtype '%s'"
+                % (shape, dtype))
+
+    return out
+
+
+def _copy_nodes(queue, result, to_start, vec, from_start, nnodes, wait_for):
+    """Enqueue a copy of *nnodes* entries of (each component of) *vec*,
+    starting at *from_start*, to *result*, starting at *to_start*, and
+    attach its events to *result*.
+    """
+    result_comps = _as_components(result)
+    vec_comps = _as_components(vec)
+
+    itemsize = vec.dtype.itemsize
+    for icomp in range(vec_comps.shape[0]):
+        evt = cl.enqueue_copy(queue, result.base_data, vec.base_data,
+                byte_count=nnodes*itemsize,
+                src_offset=(vec.offset + icomp*vec_comps.strides[0]
+                    + from_start*itemsize),
+                dst_offset=(result.offset + icomp*result_comps.strides[0]
+                    + to_start*itemsize),
+                wait_for=wait_for)
+        result.add_event(evt)
+
+# }}}
+
+
+def _call_connection(connection, queue, vec, out, wait_for, **kwargs):
+    """Implement ``__call__`` of the connection classes in terms of their
+    ``_apply`` and ``apply_host`` methods. *kwargs* are passed to
+    ``_apply``.
+    """
+
+    if _is_obj_array(vec):
+        return _apply_to_components(
+                lambda comp, comp_out, comp_wait_for: connection(
+                    queue, comp, out=comp_out, wait_for=comp_wait_for,
+                    **kwargs),
+                connection.from_discr, queue, vec, out, wait_for)
+
+    if isinstance(vec, np.ndarray):
+        return connection.apply_host(vec, out=out)
+
+    if not isinstance(vec, cl.array.Array):
+        return vec
+
+    _check_node_data_shape(vec, connection.from_discr.nnodes)
+    result = connection.to_discr._empty_or_out(
+            out, vec.dtype, extra_dims=vec.shape[:-1])
+    connection._apply(queue, result, vec, wait_for=wait_for, **kwargs)
+    return result
+
+# }}}
+
+
+# {{{ warm-up
+
+def _warm_up_connection(connection, queue, dtypes):
+    from time import time
+    start_time = time()
+
+    if dtypes is None:
+        dtypes = [connection.from_discr.real_dtype]
+
+    for dtype in dtypes:
+        vec = connection.from_discr.empty(dtype, queue=queue)
+        vec.fill(0)
+        connection(queue, vec)
+
+    if queue is not None:
+        queue.finish()
+
+    elapsed = time() - start_time
+    logger.info("%s warm-up: %g s" % (type(connection).__name__, elapsed))
+    return elapsed
+
+# }}}
+
+
 class InterpolationBatch(object):
     """One interpolation batch captures how a batch of elements *within* an
     element group should be an interpolated. Note that while it's possible that
@@ -80,13 +454,23 @@ class InterpolationBatch(object):
         storing the coordinates of the nodes (in unit coordinates
         of the *from* reference element) from which the node
         locations of this element should be interpolated.
+
+        May be *None* if :attr:`resample_matrix` is given.
+
+    .. attribute:: resample_matrix
+
+        *None*, or a :class:`numpy.ndarray` of shape
+        ``(to_group.nunit_nodes, from_group.nunit_nodes)``
+        to be used in place of the matrix interpolating from the *from*
+        group's unit nodes to :attr:`result_unit_nodes`.
     """
 
     def __init__(self, source_element_indices,
-            target_element_indices, result_unit_nodes):
+            target_element_indices, result_unit_nodes, resample_matrix=None):
         self.source_element_indices = source_element_indices
         self.target_element_indices = target_element_indices
         self.result_unit_nodes = result_unit_nodes
+        self.resample_matrix = resample_matrix
 
     @property
     def nelements(self):
@@ -103,6 +487,32 @@ class DiscretizationConnectionElementGroup(object):
         self.batches = batches
 
 
+class _FusedBatchData(Record):
+    """All batches of a :class:`DiscretizationConnection` that share a
+    resampling matrix shape, concatenated for application in a single
+    kernel launch.
+
+    .. attribute:: resample_mats
+
+        A :class:`pyopencl.array.Array` of shape
+        ``(nbatches, n_to_nodes, n_from_nodes)``.
+
+    .. attribute:: batch_ids
+
+        For each element, the index into :attr:`resample_mats`.
+
+    .. attribute:: from_node_starts
+
+        For each element, the index of its first node in the
+        (whole-discretization) *from* array.
+
+    .. attribute:: to_node_starts
+
+        For each element, the index of its first node in the
+        (whole-discretization) *to* array.
+    """
+
+
 class DiscretizationConnection(object):
     """
     .. attribute:: from_discr
@@ -114,6 +524,12 @@ class DiscretizationConnection(object):
         a list of :class:`MeshConnectionGroup` instances, with
         a one-to-one correspondence to the groups in
         :attr:`from_discr` and :attr:`to_discr`.
+
+    .. automethod:: __call__
+    .. automethod:: to_sparse
+    .. automethod:: apply_host
+    .. automethod:: adjoint
+    .. automethod:: warm_up
     """
 
     def __init__(self, from_discr, to_discr, groups):
@@ -131,88 +547,905 @@ class DiscretizationConnection(object):
     def _resample_matrix(self, elgroup_index, ibatch_index):
         import modepy as mp
         ibatch = self.groups[elgroup_index].batches[ibatch_index]
+        if ibatch.resample_matrix is not None:
+            return ibatch.resample_matrix
+
         from_grp = self.from_discr.groups[elgroup_index]
 
-        return mp.resampling_matrix(
-                mp.simplex_onb(self.from_discr.dim, from_grp.order),
-                ibatch.result_unit_nodes, from_grp.unit_nodes)
-
-    def __call__(self, queue, vec):
-        @memoize_method_nested
-        def knl():
-            import loopy as lp
-            knl = lp.make_kernel(
-                """{[k,i,j]:
-                    0<=k<nelements and
-                    0<=i<n_to_nodes and
-                    0<=j<n_from_nodes}""",
-                "result[target_element_indices[k], i] \
-                    = sum(j, resample_mat[i, j] \
-                    * vec[source_element_indices[k], j])",
-                [
-                    lp.GlobalArg("result", None,
-                        shape="nelements_result, n_to_nodes",
-                        offset=lp.auto),
-                    lp.GlobalArg("vec", None,
-                        shape="nelements_vec, n_from_nodes",
-                        offset=lp.auto),
-                    lp.ValueArg("nelements_result", np.int32),
-                    lp.ValueArg("nelements_vec", np.int32),
-                    "...",
-                    ],
-                name="oversample")
-
-            knl = lp.split_iname(knl, "i", 16, inner_tag="l.0")
-            return lp.tag_inames(knl, dict(k="g.0"))
+        from meshmode.discretization.reference_cache import (
+                get_reference_operator_cache, array_hash)
+        return get_reference_operator_cache().get(
+                ("connection_resample_matrix",
+                    self.from_discr.dim, from_grp.order,
+                    array_hash(ibatch.result_unit_nodes),
+                    array_hash(from_grp.unit_nodes)),
+                lambda: mp.resampling_matrix(
+                    mp.simplex_onb(self.from_discr.dim, from_grp.order),
+                    ibatch.result_unit_nodes, from_grp.unit_nodes))
 
-        if not isinstance(vec, cl.array.Array):
-            return vec
+    @memoize_method
+    def _device_resample_matrix(self, elgroup_index, ibatch_index):
+        # Passing the host-side matrix to a kernel would upload it with a
+        # blocking transfer, waiting for all work pending on the queue.
+        with cl.CommandQueue(self.cl_context) as queue:
+            return cl.array.to_device(queue,
+                    self._resample_matrix(elgroup_index, ibatch_index)) \
+                    .with_queue(None)
+
+    @memoize_method
+    def _host_element_indices(self):
+        """
+        :return: a list (one entry per group) of lists (one entry per batch)
+            of tuples ``(source_element_indices, target_element_indices)``
+            of host-side :class:`numpy.ndarray` instances.
+        """
+        if self.cl_context is None:
+            return [
+                    [
+                        (batch.source_element_indices,
+                            batch.target_element_indices)
+                        for batch in cgrp.batches]
+                    for cgrp in self.groups]
+
+        with cl.CommandQueue(self.cl_context) as queue:
+            return [
+                    [
+                        (batch.source_element_indices.get(queue=queue),
+                            batch.target_element_indices.get(queue=queue))
+                        for batch in cgrp.batches]
+                    for cgrp in self.groups]
+
+    @memoize_method
+    def _identity_map_groups(self):
+        """Find groups whose data is carried over element-by-element, i.e.
+        groups with a single batch mapping each element to the element with
+        the same number. These do not need any index indirection.
+
+        :return: a :class:`dict` mapping the indices of such groups to
+            a :class:`bool` indicating whether their resampling matrix
+            is (numerically) the identity, in which case data simply gets
+            copied.
+        """
+
+        result = {}
+
+        host_indices = self._host_element_indices()
+        for i_grp, (fgrp, tgrp, cgrp) in enumerate(
+                zip(self.from_discr.groups, self.to_discr.groups, self.groups)):
+            if len(cgrp.batches) != 1 or fgrp.nelements != tgrp.nelements:
+                continue
+
+            (from_el_indices, to_el_indices), = host_indices[i_grp]
+            all_elements = np.arange(fgrp.nelements)
+            if not (
+                    np.array_equal(from_el_indices, all_elements)
+                    and np.array_equal(to_el_indices, all_elements)):
+                continue
+
+            mat = self._resample_matrix(i_grp, 0)
+            result[i_grp] = (
+                    mat.shape[0] == mat.shape[1]
+                    and np.allclose(mat, np.eye(len(mat)),
+                        rtol=0, atol=1e-13))
 
-        result = self.to_discr.empty(vec.dtype)
+        return result
+
+    def _apply_identity_map_groups(self, queue, result, vec, wait_for):
+        for i_grp, is_copy in six.iteritems(self._identity_map_groups()):
+            fgrp = self.from_discr.groups[i_grp]
+            tgrp = self.to_discr.groups[i_grp]
+
+            if is_copy:
+                _copy_nodes(queue,
+                        result, tgrp.node_nr_base, vec, fgrp.node_nr_base,
+                        tgrp.nnodes, wait_for)
+            else:
+                mat = self._resample_matrix(i_grp, 0)
+                knl = _make_block_resample_kernel(
+                        mat.shape[0], mat.shape[1], vec.dtype)
+                evt, _ = knl(queue,
+                        resample_mat=self._device_resample_matrix(i_grp, 0),
+                        result=tgrp.view(_as_components(result)),
+                        vec=fgrp.view(_as_components(vec)),
+                        wait_for=wait_for)
+                result.add_event(evt)
+
+    @memoize_method
+    def _fused_batch_data(self):
+        """Concatenate all batches (across all groups) into as few sets of
+        index arrays as possible, so that the whole connection can be applied
+        in one kernel launch per distinct resampling matrix shape.
+
+        :return: a list of :class:`_FusedBatchData` instances.
+        """
+
+        # maps (n_to_nodes, n_from_nodes) to a list of
+        # (resample_mat, from_node_starts, to_node_starts)
+        shape_to_batches = {}
 
-        if vec.shape != (self.from_discr.nnodes,):
-            raise ValueError("invalid shape of incoming resampling data")
+        host_indices = self._host_element_indices()
+
+        identity_map_groups = self._identity_map_groups()
+
+        for i_grp, (fgrp, tgrp, cgrp) in enumerate(
+                zip(self.from_discr.groups, self.to_discr.groups, self.groups)):
+            if i_grp in identity_map_groups:
+                continue
+
+            for i_batch, batch in enumerate(cgrp.batches):
+                if not len(batch.source_element_indices):
+                    continue
+
+                from_el_indices, to_el_indices = host_indices[i_grp][i_batch]
+                mat = self._resample_matrix(i_grp, i_batch)
+
+                shape_to_batches.setdefault(mat.shape, []).append((
+                    mat,
+                    fgrp.node_nr_base + from_el_indices*fgrp.nunit_nodes,
+                    tgrp.node_nr_base + to_el_indices*tgrp.nunit_nodes))
+
+        result = []
+        with cl.CommandQueue(self.cl_context) as queue:
+            for batches in six.itervalues(shape_to_batches):
+                mats, from_starts, to_starts = zip(*batches)
+
+                batch_ids = np.concatenate([
+                    np.zeros(len(starts), np.int32) + i
+                    for i, starts in enumerate(from_starts)])
+
+                result.append(_FusedBatchData(
+                    resample_mats=cl.array.to_device(queue, np.array(mats))
+                    .with_queue(None),
+                    batch_ids=cl.array.to_device(queue, batch_ids)
+                    .with_queue(None),
+                    from_node_starts=cl.array.to_device(
+                        queue, np.concatenate(from_starts).astype(np.intp))
+                    .with_queue(None),
+                    to_node_starts=cl.array.to_device(
+                        queue, np.concatenate(to_starts).astype(np.intp))
+                    .with_queue(None)))
+
+        return result
+
+    def _apply_fused(self, queue, result, vec, wait_for):
+        for fused_data in self._fused_batch_data():
+            _, n_to_nodes, n_from_nodes = fused_data.resample_mats.shape
+            knl = _make_fused_resample_kernel(
+                    n_to_nodes, n_from_nodes, vec.dtype)
+            evt, _ = knl(queue,
+                    resample_mats=fused_data.resample_mats,
+                    batch_ids=fused_data.batch_ids,
+                    from_node_starts=fused_data.from_node_starts,
+                    to_node_starts=fused_data.to_node_starts,
+                    result=_as_components(result), vec=_as_components(vec),
+                    wait_for=wait_for)
+            result.add_event(evt)
+
+    def _apply(self, queue, result, vec, fused, wait_for=None):
+        _check_node_data_shape(vec, self.from_discr.nnodes)
+
+        wait_for = _get_wait_for(wait_for, vec, result)
+
+        self._apply_identity_map_groups(queue, result, vec, wait_for)
+
+        if fused:
+            self._apply_fused(queue, result, vec, wait_for)
+            return
+
+        identity_map_groups = self._identity_map_groups()
 
         for i_grp, (sgrp, tgrp, cgrp) in enumerate(
                 zip(self.to_discr.groups, self.from_discr.groups, self.groups)):
+            if i_grp in identity_map_groups:
+                continue
+
             for i_batch, batch in enumerate(cgrp.batches):
                 if len(batch.source_element_indices):
-                    knl()(queue,
-                            resample_mat=self._resample_matrix(i_grp, i_batch),
-                            result=sgrp.view(result), vec=tgrp.view(vec),
+                    mat = self._resample_matrix(i_grp, i_batch)
+                    knl = _make_resample_kernel(
+                            mat.shape[0], mat.shape[1], vec.dtype,
+                            batch.source_element_indices.dtype,
+                            batch.target_element_indices.dtype)
+                    evt, _ = knl(queue,
+                            resample_mat=self._device_resample_matrix(
+                                i_grp, i_batch),
+                            result=sgrp.view(_as_components(result)),
+                            vec=tgrp.view(_as_components(vec)),
                             source_element_indices=batch.source_element_indices,
-                            target_element_indices=batch.target_element_indices)
+                            target_element_indices=batch.target_element_indices,
+                            wait_for=wait_for)
+                    result.add_event(evt)
+
+    def __call__(self, queue, vec, fused=True, out=None, wait_for=None):
+        """
+        :arg fused: If *True*, all batches of all groups are applied in a
+            single kernel launch (per distinct resampling matrix shape).
+            Otherwise, one kernel is launched per batch.
+        :arg out: If given, an array on :attr:`to_discr` to write the result
+            to. Otherwise, one is allocated from the allocator of
+            :attr:`to_discr`.
+        :arg wait_for: A list of events to wait for, in addition to those
+            pending on *vec*. The events of the enqueued work are attached
+            to the result, which is not waited for.
+
+        *vec* may be of shape ``(nnodes,)`` or a stacked array of shape
+        ``(ncomponents, nnodes)``, in which case all components are
+        resampled in the same kernel launches. Object arrays get stacked
+        for this purpose, and an object array of views into the stacked
+        result is returned. In that case, *out* must be *None* or
+        a stacked array. If *vec* is a :class:`numpy.ndarray`, this is the
+        same as :meth:`apply_host`.
+        """
+        return _call_connection(self, queue, vec, out, wait_for, fused=fused)
+
+    # {{{ host-side representations
+
+    def to_sparse(self, format="csr"):
+        """Return the connection as an explicit matrix.
+
+        :arg format: ``"csr"`` or ``"bsr"``. The latter uses the resampling
+            matrices as blocks and is only available if all of them have the
+            same shape and the groups are laid out compatibly.
+        :return: a :mod:`scipy.sparse` matrix of shape
+            ``(to_discr.nnodes, from_discr.nnodes)``.
+        """
+
+        import scipy.sparse as sparse
+
+        rows = []
+        cols = []
+        data = []
+        block_shapes = set()
+
+        host_indices = self._host_element_indices()
+        for i_grp, (fgrp, tgrp, cgrp) in enumerate(
+                zip(self.from_discr.groups, self.to_discr.groups, self.groups)):
+            for i_batch in range(len(cgrp.batches)):
+                from_el_indices, to_el_indices = host_indices[i_grp][i_batch]
+                mat = self._resample_matrix(i_grp, i_batch)
+                n_to_nodes, n_from_nodes = mat.shape
+                block_shapes.add(mat.shape)
+
+                # all shaped (nelements, n_to_nodes, n_from_nodes)
+                batch_rows = (
+                        tgrp.node_nr_base
+                        + to_el_indices[:, np.newaxis, np.newaxis]*n_to_nodes
+                        + np.arange(n_to_nodes)[np.newaxis, :, np.newaxis])
+                batch_cols = (
+                        fgrp.node_nr_base
+                        + from_el_indices[:, np.newaxis, np.newaxis]*n_from_nodes
+                        + np.arange(n_from_nodes)[np.newaxis, np.newaxis, :])
+                shape = (len(to_el_indices),) + mat.shape
+
+                rows.append(np.broadcast_to(batch_rows, shape).ravel())
+                cols.append(np.broadcast_to(batch_cols, shape).ravel())
+                data.append(np.broadcast_to(mat, shape).ravel())
+
+        shape = (self.to_discr.nnodes, self.from_discr.nnodes)
+        if not data:
+            return sparse.csr_matrix(shape)
+
+        result = sparse.coo_matrix(
+                (np.concatenate(data),
+                    (np.concatenate(rows), np.concatenate(cols))),
+                shape=shape)
+
+        if format == "csr":
+            return result.tocsr()
+        elif format == "bsr":
+            if len(block_shapes) != 1:
+                raise ValueError("BSR format requires resampling matrices "
+                        "of a single shape")
+            block_shape, = block_shapes
+            return result.tobsr(blocksize=block_shape)
+        else:
+            raise ValueError("unknown sparse matrix format: '%s'" % format)
+
+    def apply_host(self, vec, out=None):
+        """Apply the connection to the :class:`numpy.ndarray` *vec* on the
+        host, without involving an OpenCL device.
+
+        :arg out: If given, a :class:`numpy.ndarray` to write the result to.
+        """
+
+        _check_node_data_shape(vec, self.from_discr.nnodes)
+
+        result = _host_empty_or_out(
+                self.to_discr, out, vec.dtype, vec.shape[:-1])
+
+        host_indices = self._host_element_indices()
+        for i_grp, (fgrp, tgrp, cgrp) in enumerate(
+                zip(self.from_discr.groups, self.to_discr.groups, self.groups)):
+            from_view = fgrp.view(vec)
+            to_view = tgrp.view(result)
+
+            for i_batch in range(len(cgrp.batches)):
+                from_el_indices, to_el_indices = host_indices[i_grp][i_batch]
+                to_view[..., to_el_indices, :] = np.matmul(
+                        from_view[..., from_el_indices, :],
+                        self._resample_matrix(i_grp, i_batch).T)
 
         return result
 
     # }}}
 
+    @memoize_method
+    def adjoint(self):
+        """
+        :return: an :class:`AdjointDiscretizationConnection` applying the
+            transpose of this connection, e.g. to lift boundary data
+            back into the volume.
+        """
+        return AdjointDiscretizationConnection(self)
+
+    def warm_up(self, queue, dtypes=None):
+        """Build and compile all kernels needed to apply this connection, and
+        compute its resampling matrices and index data.
+
+        :arg dtypes: a list of data types for which to prepare the
+            connection, defaulting to the ``real_dtype`` of
+            :attr:`from_discr`.
+        :return: the wall time spent, in seconds.
+        """
+        return _warm_up_connection(self, queue, dtypes)
+
+
+class IdentityDiscretizationConnection(DiscretizationConnection):
+    """A :class:`DiscretizationConnection` between two discretizations with
+    identical nodes, so that applying it amounts to no work at all.
+    :meth:`__call__` returns its argument unchanged (i.e. *not* a copy),
+    unless *out* or *wait_for* is given. In the latter case, a copy is
+    made so that the events in *wait_for* can be attached to the result.
+
+    .. automethod:: __call__
+    """
+
+    def _apply(self, queue, result, vec, fused, wait_for=None):
+        _check_node_data_shape(vec, self.from_discr.nnodes)
+
+        _copy_nodes(queue, result, 0, vec, 0, self.from_discr.nnodes,
+                _get_wait_for(wait_for, vec, result))
+
+    def __call__(self, queue, vec, fused=True, out=None, wait_for=None):
+        if (isinstance(vec, cl.array.Array)
+                and out is None and not wait_for):
+            _check_node_data_shape(vec, self.from_discr.nnodes)
+            return vec
+
+        return _call_connection(self, queue, vec, out, wait_for, fused=fused)
+
+    def apply_host(self, vec, out=None):
+        _check_node_data_shape(vec, self.from_discr.nnodes)
+
+        if out is None:
+            return vec
+
+        result = _host_empty_or_out(
+                self.to_discr, out, vec.dtype, vec.shape[:-1])
+        result[...] = vec
+        return result
+
+    @memoize_method
+    def adjoint(self):
+        return IdentityDiscretizationConnection(
+                self.to_discr, self.from_discr, self.groups)
+
+
+# {{{ adjoint connection
+
+def _color_repeated_indices(indices):
+    """
+    :return: an integer array of the same length as *indices*, assigning each
+        entry a 'color' such that no two entries of the same color refer to
+        the same index. Colors are consecutive and start at zero.
+    """
+    order = np.argsort(indices, kind="mergesort")
+    sorted_indices = indices[order]
+
+    positions = np.arange(len(indices))
+    is_run_start = np.ones(len(indices), dtype=bool)
+    is_run_start[1:] = sorted_indices[1:] != sorted_indices[:-1]
+    run_starts = np.maximum.accumulate(np.where(is_run_start, positions, 0))
+
+    colors = np.empty(len(indices), dtype=np.int32)
+    colors[order] = positions - run_starts
+    return colors
+
+
+class AdjointDiscretizationConnection(object):
+    """Applies the transpose of a :class:`DiscretizationConnection`,
+    scattering (and summing) data from the *to* discretization of the
+    original connection back into its *from* discretization.
+
+    Each batch is applied with one kernel launch that reads the target
+    elements of the original batch and accumulates into its source elements.
+    No atomics are needed: A batch in which a source element occurs more than
+    once (which does not happen, for instance, for boundary restrictions,
+    which are batched by face) is split into several launches, each of which
+    writes every element at most once.
+
+    .. attribute:: from_discr
+    .. attribute:: to_discr
+    .. attribute:: connection
+
+        The :class:`DiscretizationConnection` whose transpose is applied.
+
+    .. automethod:: __call__
+    .. automethod:: to_sparse
+    .. automethod:: apply_host
+    .. automethod:: adjoint
+    .. automethod:: warm_up
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.cl_context = connection.cl_context
+        self.from_discr = connection.to_discr
+        self.to_discr = connection.from_discr
+
+    @memoize_method
+    def _colored_batch_indices(self):
+        """
+        :return: a list (one entry per group) of lists of tuples
+            ``(ibatch_index, host_from_indices, host_to_indices)``, where
+            each entry of *host_to_indices* occurs at most once.
+            Each of these gets applied in a single kernel launch.
+        """
+
+        result = []
+        for grp_indices in self.connection._host_element_indices():
+            grp_result = []
+            for i_batch, (cnx_from_indices, cnx_to_indices) in enumerate(
+                    grp_indices):
+                if not len(cnx_from_indices):
+                    continue
+
+                colors = _color_repeated_indices(cnx_from_indices)
+                for color in range(np.max(colors) + 1):
+                    color_mask = colors == color
+                    grp_result.append((i_batch,
+                        cnx_to_indices[color_mask],
+                        cnx_from_indices[color_mask]))
+
+            result.append(grp_result)
+
+        return result
+
+    @memoize_method
+    def _device_batch_indices(self):
+        with cl.CommandQueue(self.cl_context) as queue:
+            return [
+                    [
+                        (i_batch,
+                            cl.array.to_device(queue, from_indices)
+                            .with_queue(None),
+                            cl.array.to_device(queue, to_indices)
+                            .with_queue(None))
+                        for i_batch, from_indices, to_indices in grp_indices]
+                    for grp_indices in self._colored_batch_indices()]
+
+    def _apply(self, queue, result, vec, fused=True, wait_for=None):
+        _check_node_data_shape(vec, self.from_discr.nnodes)
+
+        wait_for = _get_wait_for(wait_for, vec, result)
+
+        result.fill(0, queue=queue, wait_for=wait_for)
+
+        # Launches accumulate into the same entries, so each one waits for
+        # the previous one, even on an out-of-order queue.
+        wait_for = _get_wait_for(wait_for, result)
+
+        cnx = self.connection
+        for i_grp, (fgrp, tgrp, grp_indices) in enumerate(zip(
+                self.from_discr.groups, self.to_discr.groups,
+                self._device_batch_indices())):
+            for i_batch, from_indices, to_indices in grp_indices:
+                mat = cnx._resample_matrix(i_grp, i_batch)
+                knl = _make_adjoint_resample_kernel(
+                        mat.shape[1], mat.shape[0], vec.dtype,
+                        from_indices.dtype, to_indices.dtype)
+                evt, _ = knl(queue,
+                        resample_mat=cnx._device_resample_matrix(
+                            i_grp, i_batch),
+                        result=tgrp.view(_as_components(result)),
+                        vec=fgrp.view(_as_components(vec)),
+                        from_element_indices=from_indices,
+                        to_element_indices=to_indices,
+                        wait_for=wait_for)
+                result.add_event(evt)
+                wait_for = [evt]
+
+    def __call__(self, queue, vec, out=None, wait_for=None):
+        """See :meth:`DiscretizationConnection.__call__`."""
+        return _call_connection(self, queue, vec, out, wait_for)
+
+    def to_sparse(self, format="csr"):
+        return self.connection.to_sparse(format=format).T.asformat(format)
+
+    def apply_host(self, vec, out=None):
+        _check_node_data_shape(vec, self.from_discr.nnodes)
+
+        result = _host_empty_or_out(
+                self.to_discr, out, vec.dtype, vec.shape[:-1])
+        result.fill(0)
+
+        cnx = self.connection
+        for i_grp, (fgrp, tgrp, grp_indices) in enumerate(zip(
+                self.from_discr.groups, self.to_discr.groups,
+                self._colored_batch_indices())):
+            from_view = fgrp.view(vec)
+            to_view = tgrp.view(result)
+
+            for i_batch, from_indices, to_indices in grp_indices:
+                to_view[..., to_indices, :] += np.matmul(
+                        from_view[..., from_indices, :],
+                        cnx._resample_matrix(i_grp, i_batch))
+
+        return result
+
+    def adjoint(self):
+        return self.connection
+
+    def warm_up(self, queue, dtypes=None):
+        """See :meth:`DiscretizationConnection.warm_up`."""
+        return _warm_up_connection(self, queue, dtypes)
+
+# }}}
+
+
+# {{{ chained connection
+
+def _compose_connections(first, second):
+    """Build a single :class:`DiscretizationConnection` equivalent to applying
+    *first*, then *second*, by multiplying their per-batch resampling
+    matrices.
+
+    :return: the composed connection, or *None* if the element maps of
+        *first* and *second* do not line up, i.e. if an element of the
+        intermediate discretization is not written by exactly one batch of
+        *first*.
+    """
+
+    if not (isinstance(first, DiscretizationConnection)
+            and isinstance(second, DiscretizationConnection)):
+        return None
+
+    if len(first.groups) != len(second.groups):
+        return None
+
+    first_indices = first._host_element_indices()
+    second_indices = second._host_element_indices()
+
+    host_groups = []
+    for i_grp, mid_grp in enumerate(first.to_discr.groups):
+        # for each intermediate element: the batch of *first* that
+        # writes it, and the element it reads from
+        batch_of_el = np.empty(mid_grp.nelements, np.int32)
+        batch_of_el.fill(-1)
+        source_of_el = np.empty(mid_grp.nelements, np.intp)
+
+        for i_batch, (from_indices, to_indices) in enumerate(
+                first_indices[i_grp]):
+            if len(np.unique(to_indices)) != len(to_indices):
+                return None
+            if (batch_of_el[to_indices] != -1).any():
+                return None
+
+            batch_of_el[to_indices] = i_batch
+            source_of_el[to_indices] = from_indices
+
+        host_batches = []
+        for i_batch, (from_indices, to_indices) in enumerate(
+                second_indices[i_grp]):
+            first_batch_nrs = batch_of_el[from_indices]
+            if (first_batch_nrs == -1).any():
+                return None
+
+            second_mat = second._resample_matrix(i_grp, i_batch)
+
+            for i_first_batch in np.unique(first_batch_nrs):
+                batch_mask = first_batch_nrs == i_first_batch
+
+                host_batches.append(_HostBatch(
+                    source_element_indices=source_of_el[
+                        from_indices[batch_mask]],
+                    target_element_indices=to_indices[batch_mask],
+                    result_unit_nodes=None,
+                    resample_matrix=np.dot(
+                        second_mat,
+                        first._resample_matrix(i_grp, i_first_batch))))
+
+        host_groups.append(host_batches)
+
+    groups = _make_connection_groups(first.cl_context, host_groups)
+
+    return DiscretizationConnection(first.from_discr, second.to_discr, groups)
+
+
+class ChainedDiscretizationConnection(object):
+    """Applies a sequence of :class:`DiscretizationConnection` instances, in
+    order. Wherever the element maps of consecutive connections line up, the
+    connections are composed ahead of time into one, with a single
+    (pre-multiplied) resampling matrix per batch, so that no intermediate
+    data is computed at all. Otherwise, the connections are applied one
+    after the other. The intermediate arrays are allocated once (per data
+    type and number of components) from the allocators of the intermediate
+    discretizations, and reused by later calls.
+
+    .. attribute:: from_discr
+
+    .. attribute:: to_discr
+
+    .. attribute:: connections
+
+        The list of connections passed to the constructor.
+
+    .. automethod:: __call__
+    .. automethod:: to_sparse
+    .. automethod:: apply_host
+    .. automethod:: adjoint
+    .. automethod:: warm_up
+    """
+
+    def __init__(self, connections):
+        if not connections:
+            raise ValueError("must pass at least one connection")
+
+        for first, second in zip(connections, connections[1:]):
+            if first.to_discr is not second.from_discr:
+                raise ValueError("chained connections must share "
+                        "intermediate discretizations")
+
+        self.from_discr = connections[0].from_discr
+        self.to_discr = connections[-1].to_discr
+        self.connections = connections
+
+        # Nested chains get flattened, so that their connections can be
+        # composed with the surrounding ones.
+        flat_connections = []
+        for cnx in connections:
+            if isinstance(cnx, ChainedDiscretizationConnection):
+                flat_connections.extend(cnx._applied_connections)
+            else:
+                flat_connections.append(cnx)
+
+        applied_connections = [
+                cnx for cnx in flat_connections
+                if not isinstance(cnx, IdentityDiscretizationConnection)]
+        if not applied_connections:
+            applied_connections = flat_connections[:1]
+
+        applied_connections, remaining_connections = \
+                applied_connections[:1], applied_connections[1:]
+        for cnx in remaining_connections:
+            composed = _compose_connections(applied_connections[-1], cnx)
+            if composed is not None:
+                applied_connections[-1] = composed
+            else:
+                applied_connections.append(cnx)
+
+        logger.info("chained connection: %d connections composed into %d"
+                % (len(connections), len(applied_connections)))
+
+        self._applied_connections = applied_connections
+
+        # maps (dtype, extra_dims) to lists of intermediate arrays
+        self._intermediates = {}
+
+    def _get_intermediates(self, dtype, extra_dims):
+        """Return the intermediate arrays, one per connection but the last,
+        allocated on first use for each data type and component count and
+        then reused.
+        """
+        key = (np.dtype(dtype), extra_dims)
+        try:
+            return self._intermediates[key]
+        except KeyError:
+            pass
+
+        result = [
+                cnx.to_discr.empty(dtype, extra_dims=extra_dims)
+                for cnx in self._applied_connections[:-1]]
+        self._intermediates[key] = result
+        return result
+
+    def _apply(self, queue, result, vec, fused, wait_for=None):
+        intermediates = self._get_intermediates(vec.dtype, vec.shape[:-1])
+
+        for i_cnx, cnx in enumerate(self._applied_connections):
+            if i_cnx + 1 < len(self._applied_connections):
+                cnx_result = intermediates[i_cnx]
+            else:
+                cnx_result = result
+
+            # Connections wait for the events attached to their input and
+            # output arrays. In particular, writing an intermediate array
+            # waits for the reads of it by the previous call.
+            cnx._apply(queue, cnx_result, vec, fused,
+                    wait_for if i_cnx == 0 else None)
+
+            if i_cnx > 0:
+                # *vec* is an intermediate array. Record its reads.
+                for evt in cnx_result.events:
+                    if evt not in vec.events:
+                        vec.add_event(evt)
+
+            vec = cnx_result
+
+    def __call__(self, queue, vec, fused=True, out=None, wait_for=None):
+        """See :meth:`DiscretizationConnection.__call__`."""
+        return _call_connection(self, queue, vec, out, wait_for, fused=fused)
+
+    def to_sparse(self, format="csr"):
+        """See :meth:`DiscretizationConnection.to_sparse`. *format* is
+        ignored unless the connections could all be composed into one.
+        """
+
+        if len(self._applied_connections) == 1:
+            return self._applied_connections[0].to_sparse(format=format)
+
+        result = None
+        for cnx in self._applied_connections:
+            mat = cnx.to_sparse()
+            result = mat if result is None else mat.dot(result)
+
+        return result.tocsr()
+
+    def apply_host(self, vec, out=None):
+        """See :meth:`DiscretizationConnection.apply_host`."""
+
+        for i_cnx, cnx in enumerate(self._applied_connections):
+            if i_cnx + 1 < len(self._applied_connections):
+                vec = cnx.apply_host(vec)
+            else:
+                vec = cnx.apply_host(vec, out=out)
+
+        return vec
+
+    @memoize_method
+    def adjoint(self):
+        """See :meth:`DiscretizationConnection.adjoint`."""
+
+        return ChainedDiscretizationConnection([
+            cnx.adjoint() for cnx in self._applied_connections[::-1]])
+
+    def warm_up(self, queue, dtypes=None):
+        """See :meth:`DiscretizationConnection.warm_up`."""
+        return _warm_up_connection(self, queue, dtypes)
+
+# }}}
+
 
 # {{{ same-mesh constructor
 
 def make_same_mesh_connection(queue, to_discr, from_discr):
+    """Build a :class:`DiscretizationConnection` between two discretizations
+    of the same mesh. If both discretizations use the same unit nodes, an
+    :class:`IdentityDiscretizationConnection` is returned.
+    """
+
     if from_discr.mesh is not to_discr.mesh:
         raise ValueError("from_discr and to_discr must be based on "
                 "the same mesh")
 
-    assert queue.context == from_discr.cl_context
-    assert queue.context == to_discr.cl_context
+    if queue is not None:
+        assert queue.context == from_discr.cl_context
+        assert queue.context == to_discr.cl_context
 
-    groups = []
+    host_groups = []
+    is_identity = True
     for fgrp, tgrp in zip(from_discr.groups, to_discr.groups):
-        all_elements = cl.array.arange(queue,
-                fgrp.nelements,
-                dtype=np.intp).with_queue(None)
-        ibatch = InterpolationBatch(
+        all_elements = np.arange(fgrp.nelements, dtype=np.intp)
+        host_groups.append([
+            _HostBatch(
                 source_element_indices=all_elements,
                 target_element_indices=all_elements,
-                result_unit_nodes=tgrp.unit_nodes)
+                result_unit_nodes=tgrp.unit_nodes)])
 
-        groups.append(
-                DiscretizationConnectionElementGroup([ibatch]))
+        is_identity = is_identity and (
+                fgrp.unit_nodes.shape == tgrp.unit_nodes.shape
+                and np.allclose(fgrp.unit_nodes, tgrp.unit_nodes,
+                    rtol=0, atol=1e-14))
 
-    return DiscretizationConnection(
-            from_discr, to_discr, groups)
+    if is_identity:
+        cnx_class = IdentityDiscretizationConnection
+    else:
+        cnx_class = DiscretizationConnection
+
+    return cnx_class(from_discr, to_discr,
+            _make_connection_groups(from_discr.cl_context, host_groups))
+
+# }}}
+
+
+# {{{ order-change connection
+
+def _projection_matrix(to_grp, from_grp, from_unit_vertices=None):
+    """Return the matrix mapping nodal values on *from_grp* to nodal
+    values on *to_grp* of their :math:`L^2` projection onto polynomials of
+    the order of *to_grp*. If that order is at least the order of
+    *from_grp*, this is just interpolation.
+
+    :arg from_unit_vertices: if not *None*, the vertices of the *from*
+        element in the unit coordinates of the (larger) *to* element, of
+        shape *(dim, dim+1)*. The result is then the contribution of the
+        *from* element to the projection onto the *to* element, assuming
+        the *to* element is affinely mapped.
+    """
+
+    dim = from_grp.dim
+
+    if dim == 1:
+        quad = mp.LegendreGaussQuadrature(max(to_grp.order, from_grp.order))
+        quad_nodes = quad.nodes.reshape(1, -1)
+    else:
+        quad = mp.XiaoGimbutasSimplexQuadrature(
+                to_grp.order + from_grp.order, dim)
+        quad_nodes = quad.nodes
+
+    quad_weights = quad.weights
+    to_quad_nodes = quad_nodes
+
+    if from_unit_vertices is not None:
+        from meshmode.mesh.refinement import _map_unit_nodes
+        to_quad_nodes = _map_unit_nodes(from_unit_vertices, quad_nodes)
+
+        spans = from_unit_vertices[:, 1:] - from_unit_vertices[:, :1]
+        quad_weights = quad_weights * abs(la.det(spans)) / 2**dim
+
+    # Expand the data on from_grp in the orthonormal basis of the
+    # order of to_grp, then evaluate at the nodes of to_grp.
+    to_basis = mp.simplex_onb(dim, to_grp.order)
+    from_nodal_at_quad = mp.resampling_matrix(
+            mp.simplex_onb(dim, from_grp.order),
+            quad_nodes, from_grp.unit_nodes)
+    to_modes_at_quad = mp.vandermonde(to_basis, to_quad_nodes)
+
+    modal_projection = np.dot(
+            to_modes_at_quad.T * quad_weights, from_nodal_at_quad)
+    return np.dot(mp.vandermonde(to_basis, to_grp.unit_nodes),
+            modal_projection)
+
+
+def make_order_change_connection(queue, to_discr, from_discr):
+    """Build a :class:`DiscretizationConnection` between two discretizations
+    of the same mesh that may differ in their (per-group) orders, e.g.
+    for p-refinement. Data is interpolated where the order of a group rises
+    and :math:`L^2`-projected where it drops.
+
+    The matrices are computed once for each pair of orders (and unit nodes)
+    and kept in the reference operator cache.
+    """
+
+    if from_discr.mesh is not to_discr.mesh:
+        raise ValueError("from_discr and to_discr must be based on "
+                "the same mesh")
+
+    if queue is not None:
+        assert queue.context == from_discr.cl_context
+        assert queue.context == to_discr.cl_context
+
+    from meshmode.discretization.reference_cache import (
+            get_reference_operator_cache, array_hash)
+
+    host_groups = []
+    for fgrp, tgrp in zip(from_discr.groups, to_discr.groups):
+        resample_matrix = get_reference_operator_cache().get(
+                ("order_change_projection", fgrp.dim,
+                    fgrp.order, array_hash(fgrp.unit_nodes),
+                    tgrp.order, array_hash(tgrp.unit_nodes)),
+                lambda: _projection_matrix(tgrp, fgrp))
+
+        all_elements = np.arange(fgrp.nelements, dtype=np.intp)
+        host_groups.append([
+            _HostBatch(
+                source_element_indices=all_elements,
+                target_element_indices=all_elements,
+                result_unit_nodes=None,
+                resample_matrix=resample_matrix)])
+
+    return DiscretizationConnection(from_discr, to_discr,
+            _make_connection_groups(from_discr.cl_context, host_groups))
 
 # }}}
 
@@ -224,10 +1457,10 @@ class _ConnectionBatchData(Record):
 
 
 def _build_boundary_connection(queue, vol_discr, bdry_discr, connection_data):
-    connection_groups = []
+    host_groups = []
     for igrp, (vol_grp, bdry_grp) in enumerate(
             zip(vol_discr.groups, bdry_discr.groups)):
-        connection_batches = []
+        host_batches = []
         mgrp = vol_grp.mesh_el_group
 
         for face_id in range(len(mgrp.face_vertex_indices())):
@@ -236,27 +1469,22 @@ def _build_boundary_connection(queue, vol_discr, bdry_discr, connection_data):
             bdry_unit_nodes_01 = (bdry_grp.unit_nodes + 1)*0.5
             result_unit_nodes = (np.dot(data.A, bdry_unit_nodes_01).T + data.b).T
 
-            connection_batches.append(
-                    InterpolationBatch(
-                        source_element_indices=cl.array.to_device(
-                            queue,
+            host_batches.append(
+                    _HostBatch(
+                        source_element_indices=(
                             vol_grp.mesh_el_group.element_nr_base
-                            + data.group_source_element_indices)
-                        .with_queue(None),
-                        target_element_indices=cl.array.to_device(
-                            queue,
+                            + data.group_source_element_indices),
+                        target_element_indices=(
                             bdry_grp.mesh_el_group.element_nr_base
-                            + data.group_target_element_indices)
-                        .with_queue(None),
+                            + data.group_target_element_indices),
                         result_unit_nodes=result_unit_nodes,
                         ))
 
-        connection_groups.append(
-                DiscretizationConnectionElementGroup(
-                    connection_batches))
+        host_groups.append(host_batches)
 
     return DiscretizationConnection(
-            vol_discr, bdry_discr, connection_groups)
+            vol_discr, bdry_discr,
+            _make_connection_groups(vol_discr.cl_context, host_groups))
 
 
 def make_boundary_restriction(queue, discr, group_factory):
@@ -415,7 +1643,8 @@ def make_boundary_restriction(queue, discr, group_factory):
 
     from meshmode.discretization import Discretization
     bdry_discr = Discretization(
-            discr.cl_context, bdry_mesh, group_factory)
+            discr.cl_context, bdry_mesh, group_factory,
+            allocator=discr.allocator)
 
     connection = _build_boundary_connection(
             queue, discr, bdry_discr, connection_data)
@@ -429,8 +1658,663 @@ def make_boundary_restriction(queue, discr, group_factory):
 
 # {{{ refinement connection
 
-def make_refinement_connection(refiner, coarse_discr):
-    pass
+def make_refinement_connection(refiner, coarse_discr, group_factory):
+    """Build a :class:`DiscretizationConnection` from *coarse_discr* to a
+    discretization of the mesh most recently produced by *refiner*.
+
+    All children occupying the same sub-simplex of their parents share
+    one :class:`InterpolationBatch`. Elements that were not split form
+    a batch of their own.
+
+    :arg refiner: a :class:`meshmode.mesh.refinement.Refiner` whose
+        :attr:`~meshmode.mesh.refinement.Refiner.previous_mesh` is the mesh
+        of *coarse_discr*.
+    :arg group_factory: used to build the fine discretization.
+    :return: the connection, whose :attr:`DiscretizationConnection.to_discr`
+        is the fine discretization.
+    """
+
+    if coarse_discr.mesh is not refiner.previous_mesh:
+        raise ValueError("the mesh of coarse_discr must be the mesh "
+                "the refiner last refined")
+
+    from meshmode.discretization import Discretization
+    fine_discr = Discretization(coarse_discr.cl_context, refiner.last_mesh,
+            group_factory, real_dtype=coarse_discr.real_dtype)
+
+    from meshmode.mesh.refinement import _map_unit_nodes
+
+    parents = refiner.last_parent_elements
+    child_unit_vertices = refiner.last_child_unit_vertices
+
+    host_groups = []
+    for coarse_grp, fine_grp in zip(coarse_discr.groups, fine_discr.groups):
+        coarse_mgrp = coarse_grp.mesh_el_group
+        fine_mgrp = fine_grp.mesh_el_group
+        fine_el_range = slice(
+                fine_mgrp.element_nr_base,
+                fine_mgrp.element_nr_base + fine_mgrp.nelements)
+
+        grp_parents = parents[fine_el_range] - coarse_mgrp.element_nr_base
+        grp_unit_vertices = child_unit_vertices[fine_el_range]
+
+        child_types, child_type_indices = np.unique(
+                grp_unit_vertices.reshape(fine_mgrp.nelements, -1),
+                axis=0, return_inverse=True)
+        child_type_indices = child_type_indices.ravel()
+
+        ref_unit_vertices = coarse_mgrp.vertex_unit_coordinates().T
+
+        host_batches = []
+        for ichild_type, child_type in enumerate(child_types):
+            child_type = child_type.reshape(ref_unit_vertices.shape)
+            to_el_indices = np.nonzero(child_type_indices == ichild_type)[0]
+
+            if np.array_equal(child_type, ref_unit_vertices):
+                # elements that were not split
+                result_unit_nodes = fine_grp.unit_nodes
+            else:
+                result_unit_nodes = _map_unit_nodes(
+                        child_type, fine_grp.unit_nodes)
+
+            host_batches.append(
+                    _HostBatch(
+                        source_element_indices=grp_parents[to_el_indices],
+                        target_element_indices=to_el_indices,
+                        result_unit_nodes=result_unit_nodes))
+
+        host_groups.append(host_batches)
+
+    return DiscretizationConnection(coarse_discr, fine_discr,
+            _make_connection_groups(coarse_discr.cl_context, host_groups))
+
+# }}}
+
+
+# {{{ coarsening connection
+
+def make_coarsening_connection(refiner, fine_discr, group_factory):
+    """Build a connection from *fine_discr* to a discretization of the
+    mesh most recently produced by
+    :meth:`meshmode.mesh.refinement.Refiner.coarsen`, computing the
+    :math:`L^2` projection of the data onto each coarse element (assumed
+    to be affinely mapped).
+
+    The projection is applied as the adjoint of a coarse-to-fine connection
+    with one batch (and one matrix) per type of child, i.e. per sub-simplex
+    of the coarse element occupied by a fine element. Fine elements that were
+    not merged form a batch of their own.
+
+    :arg fine_discr: a discretization of
+        :attr:`~meshmode.mesh.refinement.Refiner.last_coarsened_mesh`.
+    :arg group_factory: used to build the coarse discretization.
+    :return: an :class:`AdjointDiscretizationConnection`, whose
+        :attr:`~AdjointDiscretizationConnection.to_discr` is the coarse
+        discretization.
+    """
+
+    if fine_discr.mesh is not refiner.last_coarsened_mesh:
+        raise ValueError("the mesh of fine_discr must be the mesh "
+                "the refiner last coarsened")
+
+    from meshmode.discretization import Discretization
+    coarse_discr = Discretization(fine_discr.cl_context, refiner.last_mesh,
+            group_factory, real_dtype=fine_discr.real_dtype)
+
+    from meshmode.discretization.reference_cache import (
+            get_reference_operator_cache, array_hash)
+
+    parents = refiner.last_coarsening_parent_elements
+    child_unit_vertices = refiner.last_coarsening_child_unit_vertices
+
+    host_groups = []
+    for coarse_grp, fine_grp in zip(coarse_discr.groups, fine_discr.groups):
+        coarse_mgrp = coarse_grp.mesh_el_group
+        fine_mgrp = fine_grp.mesh_el_group
+        fine_el_range = slice(
+                fine_mgrp.element_nr_base,
+                fine_mgrp.element_nr_base + fine_mgrp.nelements)
+
+        grp_parents = parents[fine_el_range] - coarse_mgrp.element_nr_base
+        grp_unit_vertices = child_unit_vertices[fine_el_range]
+
+        child_types, child_type_indices = np.unique(
+                grp_unit_vertices.reshape(fine_mgrp.nelements, -1),
+                axis=0, return_inverse=True)
+        child_type_indices = child_type_indices.ravel()
+
+        host_batches = []
+        for ichild_type, child_type in enumerate(child_types):
+            child_type = child_type.reshape(grp_unit_vertices.shape[1:])
+            fine_el_indices = np.nonzero(child_type_indices == ichild_type)[0]
+
+            projection = get_reference_operator_cache().get(
+                    ("child_projection", fine_grp.dim,
+                        fine_grp.order, array_hash(fine_grp.unit_nodes),
+                        coarse_grp.order, array_hash(coarse_grp.unit_nodes),
+                        array_hash(child_type)),
+                    lambda: _projection_matrix(
+                        coarse_grp, fine_grp, child_type))
+
+            # The adjoint applies the transpose.
+            host_batches.append(
+                    _HostBatch(
+                        source_element_indices=grp_parents[fine_el_indices],
+                        target_element_indices=fine_el_indices,
+                        result_unit_nodes=None,
+                        resample_matrix=projection.T.copy()))
+
+        host_groups.append(host_batches)
+
+    return DiscretizationConnection(coarse_discr, fine_discr,
+            _make_connection_groups(fine_discr.cl_context, host_groups)) \
+                    .adjoint()
+
+# }}}
+
+
+# {{{ refinement hierarchy
+
+class RefinementHierarchy(object):
+    """A sequence of uniformly refined meshes, with discretizations of them
+    and transfer operators between consecutive levels. Level 0 is the
+    coarsest. Discretizations and operators are built on first use and
+    cached.
+
+    .. attribute:: meshes
+
+        A list of :class:`meshmode.mesh.Mesh` instances, one per level.
+
+    .. attribute:: refiners
+
+        A list of :class:`meshmode.mesh.refinement.Refiner` instances, with
+        the one at index *i* having refined level *i* into level *i+1*.
+
+    .. automethod:: discretization
+    .. automethod:: prolongation
+    .. automethod:: restriction
+    """
+
+    def __init__(self, cl_ctx, refiners, group_factory, real_dtype=np.float64):
+        self.cl_context = cl_ctx
+        self.refiners = refiners
+        self.meshes = (
+                [refiners[0].previous_mesh]
+                + [refiner.last_mesh for refiner in refiners])
+        self.group_factory = group_factory
+        self.real_dtype = real_dtype
+
+    @property
+    def nlevels(self):
+        return len(self.meshes)
+
+    @memoize_method
+    def discretization(self, ilevel):
+        if ilevel == 0:
+            from meshmode.discretization import Discretization
+            return Discretization(self.cl_context, self.meshes[0],
+                    self.group_factory, real_dtype=self.real_dtype)
+        else:
+            return self.prolongation(ilevel - 1).to_discr
+
+    @memoize_method
+    def prolongation(self, ilevel):
+        """
+        :return: a :class:`DiscretizationConnection` from level *ilevel* to
+            level *ilevel+1*.
+        """
+        return make_refinement_connection(self.refiners[ilevel],
+                self.discretization(ilevel), self.group_factory)
+
+    @memoize_method
+    def restriction(self, ilevel):
+        """
+        :return: the adjoint of :meth:`prolongation`, from level *ilevel+1*
+            to level *ilevel*.
+        """
+        return self.prolongation(ilevel).adjoint()
+
+
+def make_refinement_hierarchy(cl_ctx, mesh, group_factory, nlevels,
+        real_dtype=np.float64):
+    """Refine *mesh* uniformly (see
+    :meth:`meshmode.mesh.refinement.Refiner.refine_uniformly`) *nlevels-1*
+    times.
+
+    :arg cl_ctx: the :class:`pyopencl.Context` of the discretizations, or
+        *None* to keep their data on the host.
+    :return: a :class:`RefinementHierarchy` with *nlevels* levels.
+    """
+
+    if nlevels < 2:
+        raise ValueError("a hierarchy needs at least two levels")
+
+    from meshmode.mesh.refinement import Refiner
+
+    refiners = []
+    for ilevel in range(nlevels - 1):
+        refiner = Refiner(mesh)
+        mesh = refiner.refine_uniformly()
+        refiners.append(refiner)
+
+    return RefinementHierarchy(cl_ctx, refiners, group_factory, real_dtype)
+
+# }}}
+
+
+# {{{ point evaluation
+
+class PointEvaluationConnection(object):
+    """Evaluates functions on :attr:`from_discr` at a fixed set of points.
+    Points are grouped by discretization group and, within each group,
+    sorted by the element containing them. The values of the basis
+    functions of each point's element at the point are computed once, so
+    that each evaluation amounts to one gather-and-contract kernel launch
+    per group.
+
+    .. attribute:: from_discr
+
+    .. attribute:: points
+
+        An array of shape *(ambient_dim, npoints)*.
+
+    .. attribute:: element_nrs
+
+        For each point, the (mesh-wide) number of the element containing it,
+        or -1 if it lies outside the mesh. The result is NaN at such points.
+
+    .. attribute:: unit_coords
+
+        An array of shape *(dim, npoints)* holding the unit coordinates of
+        each point in its element.
+
+    .. automethod:: __call__
+    .. automethod:: apply_host
+    """
+
+    def __init__(self, from_discr, points, element_nrs, unit_coords):
+        self.cl_context = from_discr.cl_context
+        self.from_discr = from_discr
+        self.points = points
+        self.element_nrs = element_nrs
+        self.unit_coords = unit_coords
+
+    @property
+    def npoints(self):
+        return len(self.element_nrs)
+
+    @memoize_method
+    def _host_group_data(self):
+        """
+        :return: a list (one entry per group) of tuples
+            ``(point_indices, element_node_starts, basis_values)``, where
+            *basis_values* is of shape ``(npoints_in_group, nunit_nodes)``.
+        """
+
+        result = []
+        for grp in self.from_discr.groups:
+            mgrp = grp.mesh_el_group
+            grp_element_nrs = self.element_nrs - mgrp.element_nr_base
+
+            point_indices, = np.nonzero(
+                    (grp_element_nrs >= 0) & (grp_element_nrs < mgrp.nelements))
+            point_indices = point_indices[
+                    np.argsort(grp_element_nrs[point_indices], kind="mergesort")]
+
+            basis_values = mp.resampling_matrix(
+                    mp.simplex_onb(grp.dim, grp.order),
+                    self.unit_coords[:, point_indices], grp.unit_nodes)
+
+            result.append((
+                point_indices,
+                grp.node_nr_base
+                + grp_element_nrs[point_indices]*grp.nunit_nodes,
+                basis_values))
+
+        return result
+
+    @memoize_method
+    def _device_group_data(self):
+        with cl.CommandQueue(self.cl_context) as queue:
+            return [
+                    tuple(
+                        cl.array.to_device(queue, ary).with_queue(None)
+                        for ary in (
+                            point_indices.astype(np.intp),
+                            element_node_starts.astype(np.intp),
+                            basis_values))
+                    for point_indices, element_node_starts, basis_values
+                    in self._host_group_data()]
+
+    @property
+    @memoize_method
+    def _has_missing_points(self):
+        return bool(np.any(self.element_nrs < 0))
+
+    def _check_out(self, out, shape, dtype):
+        if out.shape != shape or out.dtype != dtype:
+            raise ValueError("'out' must have shape %s and dtype '%s'"
+                    % (shape, dtype))
+
+    def _apply(self, queue, result, vec, wait_for=None):
+        if self._has_missing_points:
+            result.fill(np.nan, queue=queue, wait_for=wait_for)
+
+        wait_for = _get_wait_for(wait_for, vec, result)
+
+        for (point_indices, element_node_starts, basis_values), grp in zip(
+                self._device_group_data(), self.from_discr.groups):
+            if not len(point_indices):
+                continue
+
+            knl = _make_point_evaluation_kernel(grp.nunit_nodes, vec.dtype)
+            evt, _ = knl(queue,
+                    result=_as_components(result), vec=_as_components(vec),
+                    basis_values=basis_values, point_indices=point_indices,
+                    element_node_starts=element_node_starts,
+                    wait_for=wait_for)
+            result.add_event(evt)
+
+    def __call__(self, queue, vec, out=None, wait_for=None):
+        """
+        :arg vec: data on :attr:`from_discr`, of shape ``(nnodes,)`` or
+            ``(ncomponents, nnodes)``, or an object array of such arrays.
+            If it is a :class:`numpy.ndarray`, this is the same as
+            :meth:`apply_host`.
+        :arg out: If given, an array of shape ``(npoints,)`` or
+            ``(ncomponents, npoints)`` to write the result to.
+        :arg wait_for: A list of events to wait for, in addition to those
+            pending on *vec*. The events of the enqueued work are attached
+            to the result, which is not waited for.
+        """
+
+        if _is_obj_array(vec):
+            return _apply_to_components(
+                    lambda comp, comp_out, comp_wait_for: self(
+                        queue, comp, out=comp_out, wait_for=comp_wait_for),
+                    self.from_discr, queue, vec, out, wait_for)
+
+        if isinstance(vec, np.ndarray):
+            return self.apply_host(vec, out=out)
+
+        if not isinstance(vec, cl.array.Array):
+            return vec
+
+        _check_node_data_shape(vec, self.from_discr.nnodes)
+
+        shape = vec.shape[:-1] + (self.npoints,)
+        if out is None:
+            result = cl.array.empty(queue, shape, dtype=vec.dtype,
+                    allocator=self.from_discr.allocator).with_queue(None)
+        else:
+            self._check_out(out, shape, vec.dtype)
+            result = out
+
+        self._apply(queue, result, vec, wait_for=wait_for)
+        return result
+
+    def apply_host(self, vec, out=None):
+        """Evaluate the :class:`numpy.ndarray` *vec* at the points on the
+        host, without involving an OpenCL device.
+
+        :arg out: If given, a :class:`numpy.ndarray` to write the result to.
+        """
+
+        _check_node_data_shape(vec, self.from_discr.nnodes)
+
+        shape = vec.shape[:-1] + (self.npoints,)
+        if out is None:
+            result = np.empty(shape, dtype=vec.dtype)
+        else:
+            self._check_out(out, shape, vec.dtype)
+            result = out
+
+        if self._has_missing_points:
+            result.fill(np.nan)
+
+        for (point_indices, element_node_starts, basis_values), grp in zip(
+                self._host_group_data(), self.from_discr.groups):
+            node_indices = (element_node_starts[:, np.newaxis]
+                    + np.arange(grp.nunit_nodes))
+            result[..., point_indices] = np.sum(
+                    vec[..., node_indices] * basis_values, axis=-1)
+
+        return result
+
+
+def make_point_evaluation_connection(discr, points, tree=None):
+    """Locate *points* in the mesh of *discr* using
+    :func:`meshmode.mesh.tools.locate_points`, and build a connection
+    evaluating functions on *discr* at them.
+
+    :arg points: an array of shape *(ambient_dim, npoints)*.
+    :arg tree: passed on to :func:`meshmode.mesh.tools.locate_points`.
+    :return: a :class:`PointEvaluationConnection`.
+    """
+
+    from meshmode.mesh.tools import locate_points
+    element_nrs, unit_coords = locate_points(discr.mesh, points, tree=tree)
+
+    return PointEvaluationConnection(discr, points, element_nrs, unit_coords)
+
+# }}}
+
+
+# {{{ mesh-to-mesh transfer
+
+def _composite_simplex_quadrature(dim, order, nsubdivisions):
+    """Return a tuple *(nodes, weights)* of a quadrature rule on the unit
+    simplex exact for polynomials of degree *order* on each of the
+    ``nsubdivisions**dim`` sub-simplices of a uniform subdivision.
+    """
+
+    if dim == 1:
+        quad = mp.LegendreGaussQuadrature(order)
+        quad_nodes = quad.nodes.reshape(1, -1)
+    else:
+        quad = mp.XiaoGimbutasSimplexQuadrature(order, dim)
+        quad_nodes = quad.nodes
+
+    from pytools import \
+            generate_nonnegative_integer_tuples_summing_to_at_most as gnitstam
+    from modepy.tools import submesh
+    from meshmode.mesh.refinement import _map_unit_nodes
+
+    node_tuples = list(gnitstam(nsubdivisions, dim))
+    node_unit_coords = (
+            2*np.array(node_tuples, dtype=np.float64).T / nsubdivisions - 1)
+
+    nodes = []
+    weights = []
+    for child_node_indices in submesh(node_tuples):
+        child_unit_vertices = node_unit_coords[:, list(child_node_indices)]
+        spans = child_unit_vertices[:, 1:] - child_unit_vertices[:, :1]
+
+        nodes.append(_map_unit_nodes(child_unit_vertices, quad_nodes))
+        weights.append(quad.weights * abs(la.det(spans)) / 2**dim)
+
+    return np.hstack(nodes), np.hstack(weights)
+
+
+class _CompositeQuadratureElementGroup(ElementGroupBase):
+    """An element group with the nodes and weights of
+    :func:`_composite_simplex_quadrature`.
+    """
+
+    def __init__(self, mesh_el_group, order, nsubdivisions, node_nr_base):
+        ElementGroupBase.__init__(self, mesh_el_group, order, node_nr_base)
+        self.unit_nodes, self.weights = _composite_simplex_quadrature(
+                mesh_el_group.dim, order, nsubdivisions)
+
+    @memoize_method
+    def resampling_matrix(self):
+        meg = self.mesh_el_group
+        return mp.resampling_matrix(
+                mp.simplex_onb(self.dim, meg.order),
+                self.unit_nodes, meg.unit_nodes)
+
+
+class _CompositeQuadratureGroupFactory(object):
+    def __init__(self, order, nsubdivisions):
+        self.order = order
+        self.nsubdivisions = nsubdivisions
+
+    def __call__(self, mesh_el_group, node_nr_base):
+        return _CompositeQuadratureElementGroup(
+                mesh_el_group, self.order, self.nsubdivisions, node_nr_base)
+
+
+class MeshTransferConnection(object):
+    """Transfers data between discretizations of different meshes covering
+    the same domain, which need not conform to one another.
+
+    The nodes of :attr:`to_discr` (or, in conservative mode, the nodes of
+    a quadrature rule on the elements of its mesh) are located in the mesh
+    of :attr:`from_discr` and grouped by the source element containing
+    them, with their unit coordinates in that element (see
+    :class:`PointEvaluationConnection`). Nodes outside the source mesh
+    receive NaN.
+
+    .. attribute:: from_discr
+
+    .. attribute:: to_discr
+
+    .. attribute:: point_evaluation
+
+        A :class:`PointEvaluationConnection` on :attr:`from_discr`.
+
+    .. attribute:: projection
+
+        *None*, or, in conservative mode, a :class:`DiscretizationConnection`
+        computing the :math:`L^2` projection onto :attr:`to_discr` of the
+        values found by :attr:`point_evaluation` at quadrature nodes.
+
+    .. automethod:: __call__
+    .. automethod:: apply_host
+    """
+
+    def __init__(self, from_discr, to_discr, point_evaluation, projection=None):
+        if from_discr.cl_context != to_discr.cl_context:
+            raise ValueError("from_discr and to_discr must live in the "
+                    "same OpenCL context")
+
+        self.cl_context = from_discr.cl_context
+
+        self.from_discr = from_discr
+        self.to_discr = to_discr
+        self.point_evaluation = point_evaluation
+        self.projection = projection
+
+    def __call__(self, queue, vec, out=None, wait_for=None):
+        """
+        :arg vec: data on :attr:`from_discr`, as for
+            :meth:`DiscretizationConnection.__call__`.
+        :arg out: If given, an array on :attr:`to_discr` to write the result
+            to.
+        """
+
+        if self.projection is not None:
+            return self.projection(queue,
+                    self.point_evaluation(queue, vec, wait_for=wait_for),
+                    out=out)
+
+        if out is None and isinstance(vec, cl.array.Array):
+            out = self.to_discr.empty(vec.dtype, extra_dims=vec.shape[:-1])
+
+        return self.point_evaluation(queue, vec, out=out, wait_for=wait_for)
+
+    def apply_host(self, vec, out=None):
+        """Apply the connection to the :class:`numpy.ndarray` *vec* on the
+        host, without involving an OpenCL device.
+        """
+
+        if self.projection is not None:
+            return self.projection.apply_host(
+                    self.point_evaluation.apply_host(vec), out=out)
+
+        return self.point_evaluation.apply_host(vec, out=out)
+
+
+def make_mesh_transfer_connection(to_discr, from_discr, conservative=False,
+        quadrature_order=None, nsubdivisions=2, tree=None):
+    """Build a :class:`MeshTransferConnection` from *from_discr* to
+    *to_discr*, whose meshes may be unrelated.
+
+    By default, the connection interpolates the data at the nodes of
+    *to_discr*. If *conservative* is *True*, it instead computes the
+    :math:`L^2` projection onto (affinely mapped) elements of *to_discr*,
+    which preserves integrals up to quadrature error. The projection uses
+    a composite quadrature rule on each target element, with each element
+    uniformly subdivided into ``nsubdivisions**dim`` sub-simplices and a
+    rule of order *quadrature_order* on each of them. This does not
+    resolve the boundaries of the source elements exactly (as quadrature on
+    a supermesh, built from the intersections of source and target
+    elements, would), but the quadrature error decreases as
+    *nsubdivisions* grows.
+
+    :arg quadrature_order: defaults to the sum of the largest orders of
+        *from_discr* and *to_discr*.
+    :arg tree: an :class:`meshmode.mesh.tools.ElementLookupTree` for the
+        mesh of *from_discr*, passed on to
+        :func:`meshmode.mesh.tools.locate_points`.
+    """
+
+    if from_discr.dim != to_discr.dim \
+            or from_discr.ambient_dim != to_discr.ambient_dim:
+        raise ValueError("from_discr and to_discr must have the same "
+                "dimensions")
+
+    if not conservative:
+        target_discr = to_discr
+    else:
+        if quadrature_order is None:
+            quadrature_order = (
+                    max(grp.order for grp in from_discr.groups)
+                    + max(grp.order for grp in to_discr.groups))
+
+        from meshmode.discretization import Discretization
+        target_discr = Discretization(to_discr.cl_context, to_discr.mesh,
+                _CompositeQuadratureGroupFactory(
+                    quadrature_order, nsubdivisions),
+                real_dtype=to_discr.real_dtype)
+
+    points = target_discr.nodes()
+    if not isinstance(points, np.ndarray):
+        with cl.CommandQueue(target_discr.cl_context) as queue:
+            points = points.get(queue=queue)
+
+    point_evaluation = make_point_evaluation_connection(
+            from_discr, points, tree=tree)
+
+    if not conservative:
+        return MeshTransferConnection(from_discr, to_discr, point_evaluation)
+
+    # {{{ projection from the quadrature nodes onto to_discr
+
+    host_groups = []
+    for quad_grp, to_grp in zip(target_discr.groups, to_discr.groups):
+        to_basis = mp.simplex_onb(to_grp.dim, to_grp.order)
+        to_modes_at_quad = mp.vandermonde(to_basis, quad_grp.unit_nodes)
+
+        projection = np.dot(
+                mp.vandermonde(to_basis, to_grp.unit_nodes),
+                to_modes_at_quad.T * quad_grp.weights)
+
+        all_elements = np.arange(to_grp.nelements)
+        host_groups.append([
+            _HostBatch(
+                source_element_indices=all_elements,
+                target_element_indices=all_elements,
+                result_unit_nodes=None,
+                resample_matrix=projection)])
+
+    projection = DiscretizationConnection(target_discr, to_discr,
+            _make_connection_groups(to_discr.cl_context, host_groups))
+
+    # }}}
+
+    return MeshTransferConnection(from_discr, to_discr, point_evaluation,
+            projection)
 
 # }}}
 
@@ -45,6 +45,7 @@ Group factories
 .. autoclass:: InterpolatoryQuadratureSimplexGroupFactory
 .. autoclass:: QuadratureSimplexGroupFactory
 .. autoclass:: PolynomialWarpAndBlendGroupFactory
+.. autoclass:: PerElementOrderGroupFactory
 """
 
 # FIXME Most of the loopy kernels will break as soon as we start using multiple
@@ -57,6 +58,25 @@ Group factories
 
 
 from meshmode.discretization import ElementGroupBase
+from meshmode.discretization.reference_cache import (
+        cached_reference_operator, array_hash)
+
+
+# {{{ reference operator cache keys
+
+def _element_key(grp):
+    # The group class determines the node family.
+    grp_class = type(grp)
+    return (
+            "%s.%s" % (grp_class.__module__, grp_class.__name__),
+            grp.mesh_el_group.dim, grp.order)
+
+
+def _mesh_resampling_key(grp):
+    meg = grp.mesh_el_group
+    return _element_key(grp) + (meg.order, array_hash(meg.unit_nodes))
+
+# }}}
 
 
 # {{{ concrete element groups
@@ -66,6 +86,7 @@ class PolynomialSimplexElementGroupBase(ElementGroupBase):
         return mp.simplex_onb(self.dim, self.order)
 
     @memoize_method
+    @cached_reference_operator(_mesh_resampling_key)
     def from_mesh_interp_matrix(self):
         meg = self.mesh_el_group
         return mp.resampling_matrix(
@@ -74,6 +95,7 @@ class PolynomialSimplexElementGroupBase(ElementGroupBase):
                 meg.unit_nodes)
 
     @memoize_method
+    @cached_reference_operator(_element_key)
     def diff_matrices(self):
         result = mp.differentiation_matrices(
                 self.basis(),
@@ -86,12 +108,33 @@ class PolynomialSimplexElementGroupBase(ElementGroupBase):
             return result
 
     @memoize_method
+    @cached_reference_operator(_mesh_resampling_key)
     def resampling_matrix(self):
         meg = self.mesh_el_group
         return mp.resampling_matrix(
                 mp.simplex_onb(self.dim, meg.order),
                 self.unit_nodes, meg.unit_nodes)
 
+    @memoize_method
+    @cached_reference_operator(_mesh_resampling_key)
+    def mesh_diff_matrices(self):
+        """Return a tuple of matrices, one per reference axis, mapping values
+        at the unit nodes of the mesh element group to reference derivatives
+        (of their interpolant) at :attr:`unit_nodes`.
+        """
+        meg = self.mesh_el_group
+
+        vdm = mp.vandermonde(mp.simplex_onb(self.dim, meg.order), meg.unit_nodes)
+        grad_vdms = mp.vandermonde(
+                mp.grad_simplex_onb(self.dim, meg.order), self.unit_nodes)
+        if not isinstance(grad_vdms, tuple):
+            grad_vdms = (grad_vdms,)
+
+        import numpy.linalg as la
+        return tuple(
+                la.solve(vdm.T, grad_vdm.T).T
+                for grad_vdm in grad_vdms)
+
 
 class InterpolatoryQuadratureSimplexElementGroup(PolynomialSimplexElementGroupBase):
     """Elemental discretization supplying a high-order quadrature rule
@@ -111,6 +154,7 @@ class InterpolatoryQuadratureSimplexElementGroup(PolynomialSimplexElementGroupBa
 
     @property
     @memoize_method
+    @cached_reference_operator(_element_key)
     def unit_nodes(self):
         result = self._quadrature_rule().nodes
         if len(result.shape) == 1:
@@ -122,6 +166,7 @@ class InterpolatoryQuadratureSimplexElementGroup(PolynomialSimplexElementGroupBa
 
     @property
     @memoize_method
+    @cached_reference_operator(_element_key)
     def weights(self):
         return self._quadrature_rule().weights
 
@@ -145,11 +190,13 @@ class QuadratureSimplexElementGroup(PolynomialSimplexElementGroupBase):
 
     @property
     @memoize_method
+    @cached_reference_operator(_element_key)
     def unit_nodes(self):
         return self._quadrature_rule().nodes
 
     @property
     @memoize_method
+    @cached_reference_operator(_element_key)
     def weights(self):
         return self._quadrature_rule().weights
 
@@ -162,6 +209,7 @@ class PolynomialWarpAndBlendElementGroup(PolynomialSimplexElementGroupBase):
     """
     @property
     @memoize_method
+    @cached_reference_operator(_element_key)
     def unit_nodes(self):
         dim = self.mesh_el_group.dim
         result = mp.warp_and_blend_nodes(dim, self.order)
@@ -172,6 +220,7 @@ class PolynomialWarpAndBlendElementGroup(PolynomialSimplexElementGroupBase):
 
     @property
     @memoize_method
+    @cached_reference_operator(_element_key)
     def weights(self):
         return np.dot(
                 mp.mass_matrix(self.basis(), self.unit_nodes),
@@ -212,6 +261,46 @@ class PolynomialWarpAndBlendGroupFactory(OrderBasedGroupFactory):
     mesh_group_class = _MeshSimplexElementGroup
     group_class = PolynomialWarpAndBlendElementGroup
 
+
+class PerElementOrderGroupFactory(ElementGroupFactory):
+    """Use a different order for each mesh element group, as given by a
+    per-element order array. Since each discretization group has a single
+    order, use :func:`meshmode.mesh.processing.split_mesh_groups` to split
+    the mesh groups by order first::
+
+        mesh, old_element_numbers = split_mesh_groups(mesh, element_orders)
+        discr = Discretization(cl_ctx, mesh, PerElementOrderGroupFactory(
+            PolynomialWarpAndBlendGroupFactory,
+            element_orders[old_element_numbers]))
+
+    See :func:`meshmode.discretization.connection.make_order_change_connection`
+    for moving data between discretizations of different orders.
+    """
+
+    def __init__(self, order_based_factory_class, element_orders):
+        """
+        :arg order_based_factory_class: a subclass of
+            :class:`OrderBasedGroupFactory`, such as
+            :class:`PolynomialWarpAndBlendGroupFactory`.
+        :arg element_orders: an array with one order per element of the mesh.
+        """
+        self.order_based_factory_class = order_based_factory_class
+        self.element_orders = np.asarray(element_orders)
+
+    def __call__(self, mesh_el_group, node_nr_base):
+        grp_orders = self.element_orders[
+                mesh_el_group.element_nr_base:
+                mesh_el_group.element_nr_base + mesh_el_group.nelements]
+
+        from pytools import is_single_valued
+        if not len(grp_orders) or not is_single_valued(grp_orders):
+            raise ValueError("all elements of a mesh element group must have "
+                    "the same order, split the groups with "
+                    "meshmode.mesh.processing.split_mesh_groups first")
+
+        factory = self.order_based_factory_class(int(grp_orders[0]))
+        return factory(mesh_el_group, node_nr_base)
+
 # }}}
 
 
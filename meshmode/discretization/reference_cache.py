@@ -0,0 +1,265 @@
+from __future__ import division
+from __future__ import absolute_import
+import six
+
+__copyright__ = "Copyright (C) 2015 Andreas Kloeckner"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+__doc__ = """
+Reference-element operators (unit nodes, quadrature weights, differentiation
+and resampling matrices) only depend on the element type, its dimension and
+order, and the node family, not on any particular mesh. They are therefore
+shared process-wide through a :class:`ReferenceOperatorCache`, so that
+neither a new :class:`~meshmode.discretization.Discretization` nor a new
+group of a multi-group mesh recomputes them.
+
+If the environment variable :envvar:`MESHMODE_REFERENCE_CACHE_DISK` is set
+to a non-empty value other than ``0``, the process-wide cache is additionally
+backed by an on-disk :class:`pytools.persistent_dict.PersistentDict`, so that
+newly started processes do not need to recompute these operators either.
+
+.. autoclass:: ReferenceOperatorCache
+
+.. autofunction:: get_reference_operator_cache
+.. autofunction:: set_reference_operator_cache
+.. autofunction:: cached_reference_operator
+.. autofunction:: array_hash
+"""
+
+
+# {{{ helpers
+
+def array_hash(ary):
+    """Return a string uniquely (for all practical purposes) identifying
+    the contents, shape, and data type of the :class:`numpy.ndarray` *ary*,
+    for use in keys of a :class:`ReferenceOperatorCache`.
+    """
+    import hashlib
+    ary = np.ascontiguousarray(ary)
+
+    h = hashlib.sha1()
+    h.update(str(ary.dtype).encode())
+    h.update(repr(ary.shape).encode())
+    h.update(ary.tobytes())
+    return h.hexdigest()
+
+
+def _get_nbytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    elif isinstance(value, (tuple, list)):
+        return sum(_get_nbytes(v) for v in value)
+    else:
+        return 0
+
+
+def _make_read_only(value):
+    # Cached values are shared between all users, so accidental modification
+    # would be catastrophic.
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    elif isinstance(value, (tuple, list)):
+        for v in value:
+            _make_read_only(v)
+
+# }}}
+
+
+# {{{ cache
+
+class ReferenceOperatorCache(object):
+    """A thread-safe least-recently-used cache for reference-element operators,
+    with a bound on the total memory used by the cached arrays.
+
+    Values are :class:`numpy.ndarray` instances (or tuples of them). They are
+    made read-only upon insertion, since they are shared among all users of
+    the cache.
+
+    .. attribute:: max_nbytes
+
+        Once the cached arrays occupy more than this many bytes, the least
+        recently used entries are evicted.
+
+    .. attribute:: nbytes
+
+        The number of bytes currently occupied by cached arrays.
+
+    .. attribute:: hits
+    .. attribute:: misses
+
+    .. automethod:: get
+    .. automethod:: clear
+    .. automethod:: __len__
+    """
+
+    def __init__(self, max_nbytes=256*1024**2, disk_cache=False):
+        """
+        :arg disk_cache: If *True*, back the in-memory cache with an on-disk
+            :class:`pytools.persistent_dict.PersistentDict`. If it is a
+            :class:`str`, it is used as the directory for the persistent
+            dictionary.
+        """
+
+        self.max_nbytes = max_nbytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        # maps key to (value, nbytes), ordered from least to most recently used
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        if disk_cache:
+            from pytools.persistent_dict import PersistentDict
+            if isinstance(disk_cache, six.string_types):
+                container_dir = disk_cache
+            else:
+                container_dir = None
+
+            self._disk_cache = PersistentDict(
+                    "meshmode-reference-operators-v1",
+                    container_dir=container_dir)
+        else:
+            self._disk_cache = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        """Empty the in-memory part of the cache."""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def _fetch_from_disk(self, key):
+        if self._disk_cache is None:
+            return None
+
+        from pytools.persistent_dict import NoSuchEntryError
+        try:
+            return self._disk_cache.fetch(key)
+        except NoSuchEntryError:
+            return None
+
+    def get(self, key, compute):
+        """Return the operator stored under *key*, which must be a (possibly
+        nested) tuple of strings and numbers. If it is not (yet) available,
+        call *compute* without arguments to obtain it and store the result.
+        """
+
+        with self._lock:
+            try:
+                value, nbytes = self._entries.pop(key)
+            except KeyError:
+                pass
+            else:
+                self._entries[key] = (value, nbytes)
+                self.hits += 1
+                return value
+
+            self.misses += 1
+
+        # Compute outside the lock: *compute* may itself depend on other
+        # cached operators, and computing the same value twice in two threads
+        # is harmless.
+
+        value = self._fetch_from_disk(key)
+        if value is None:
+            value = compute()
+            if self._disk_cache is not None:
+                self._disk_cache.store(key, value)
+
+        _make_read_only(value)
+        nbytes = _get_nbytes(value)
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (value, nbytes)
+                self.nbytes += nbytes
+
+            while self.nbytes > self.max_nbytes and len(self._entries) > 1:
+                evicted_key, (_, evicted_nbytes) = \
+                        self._entries.popitem(last=False)
+                self.nbytes -= evicted_nbytes
+                logger.debug("evicted reference operator '%s'"
+                        % (evicted_key,))
+
+        return value
+
+# }}}
+
+
+# {{{ process-wide instance
+
+def _make_default_cache():
+    disk_cache = os.environ.get("MESHMODE_REFERENCE_CACHE_DISK", "")
+    return ReferenceOperatorCache(disk_cache=disk_cache not in ["", "0"])
+
+
+_cache = _make_default_cache()
+
+
+def get_reference_operator_cache():
+    """Return the process-wide :class:`ReferenceOperatorCache`."""
+    return _cache
+
+
+def set_reference_operator_cache(cache):
+    """Replace the process-wide :class:`ReferenceOperatorCache` with
+    *cache*, e.g. to change its size limit or enable on-disk storage.
+    """
+    global _cache
+    _cache = cache
+
+
+def cached_reference_operator(key_func):
+    """A decorator for methods computing reference-element operators.
+    The operator is looked up in the process-wide cache under a key consisting
+    of the method name and the tuple returned by ``key_func(self, *args)``.
+    """
+
+    def decorator(method):
+        name = method.__name__
+
+        def wrapper(self, *args):
+            key = (name,) + tuple(key_func(self, *args))
+            return get_reference_operator_cache().get(
+                    key, lambda: method(self, *args))
+
+        from functools import update_wrapper
+        return update_wrapper(wrapper, method)
+
+    return decorator
+
+# }}}
+
+# vim: foldmethod=marker
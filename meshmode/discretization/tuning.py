@@ -0,0 +1,322 @@
+from __future__ import division
+from __future__ import absolute_import
+
+__copyright__ = "Copyright (C) 2015 Andreas Kloeckner"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import os
+
+import loopy as lp
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+__doc__ = """
+Most kernels in :mod:`meshmode` loop over elements (always using the
+iname ``k``) and, within each element, over the nodes of the result,
+often contracting with a small matrix. Which way of mapping these loops
+onto the hardware is fastest depends on the number of nodes per element,
+the data type, and the device. A :class:`TunableKernel` therefore times a
+few candidate transformations the first time it is run on a device and
+sticks with the fastest one. The choice is stored on disk, so that later
+processes do not need to time the candidates again.
+
+Candidate transformations:
+
+* ``"split_nodes"``: one work item per result node, in chunks of 16, and one
+  element per work group. This is used whenever tuning is disabled.
+* ``"element_per_work_item"``: each work item handles one whole element.
+* ``"elements_per_group"``: one work item per result node, with as many
+  elements per group as fit into 128 work items.
+* ``"prefetch_matrix"``: as ``"elements_per_group"``, with the matrix
+  prefetched into local memory.
+
+Kernels that evaluate data at scattered points instead loop over the
+points, and choose among the following candidates:
+
+* ``"points_per_group_128"``: one work item per point, in groups of 128.
+  This is the default.
+* ``"points_per_group_32"``, ``"points_per_group_64"``,
+  ``"points_per_group_256"``: the same, with other group sizes.
+
+Tuning can be disabled by setting the environment variable
+:envvar:`MESHMODE_KERNEL_TUNING` to ``0``.
+
+.. autoclass:: TunableKernel
+"""
+
+
+DEFAULT_CANDIDATE = "split_nodes"
+
+
+def _is_tuning_enabled():
+    return os.environ.get("MESHMODE_KERNEL_TUNING", "1") != "0"
+
+
+# {{{ candidate transformations
+
+def _split_nodes(knl, tknl):
+    knl = lp.split_iname(knl, tknl.output_iname, 16, inner_tag="l.0")
+    return lp.tag_inames(knl, dict(k="g.0"))
+
+
+def _element_per_work_item(knl, tknl):
+    return lp.split_iname(knl, "k", 64, outer_tag="g.0", inner_tag="l.0")
+
+
+def _elements_per_group(knl, tknl):
+    nelements_per_group = max(1, 128 // tknl.n_output_nodes)
+    knl = lp.split_iname(knl, "k", nelements_per_group,
+            outer_tag="g.0", inner_tag="l.1")
+    return lp.tag_inames(knl, {tknl.output_iname: "l.0"})
+
+
+def _prefetch_matrix(knl, tknl):
+    knl = _elements_per_group(knl, tknl)
+    return lp.add_prefetch(knl, tknl.matrix_name, tknl.matrix_inames,
+            fetch_outer_inames="k_outer", default_tag="l.auto")
+
+
+def _points_per_group(group_size):
+    def transform(knl, tknl):
+        return lp.split_iname(knl, tknl.output_iname, group_size,
+                outer_tag="g.0", inner_tag="l.0")
+
+    return transform
+
+
+_CANDIDATES = [
+        ("split_nodes", _split_nodes),
+        ("element_per_work_item", _element_per_work_item),
+        ("elements_per_group", _elements_per_group),
+        ("prefetch_matrix", _prefetch_matrix),
+        ] + [
+        ("points_per_group_%d" % group_size, _points_per_group(group_size))
+        for group_size in [128, 32, 64, 256]]
+
+POINT_CANDIDATES = [
+        "points_per_group_128", "points_per_group_32",
+        "points_per_group_64", "points_per_group_256"]
+
+# }}}
+
+
+# {{{ persistent storage of choices
+
+_tuning_results = None
+
+
+def _get_tuning_results():
+    global _tuning_results
+    if _tuning_results is None:
+        from pytools.persistent_dict import PersistentDict
+        _tuning_results = PersistentDict("meshmode-kernel-tuning-v1")
+
+    return _tuning_results
+
+
+def _get_device_key(device):
+    return (device.platform.name, device.platform.version,
+            device.name, device.driver_version)
+
+# }}}
+
+
+class TunableKernel(object):
+    """A :mod:`loopy` kernel without hardware mapping, along with the
+    information needed to apply the candidate transformations listed
+    above. Calling it works just like calling a :mod:`loopy` kernel.
+
+    .. attribute:: kernel
+
+        The kernel, with all data types specified and all node counts
+        fixed.
+
+    .. attribute:: key
+
+        A tuple of strings and numbers identifying the kernel, including
+        the data types and node counts it was specialized for.
+
+    .. attribute:: output_iname
+
+        The iname looping over the result nodes within an element, or over
+        the points for kernels using :attr:`candidates`.
+
+    .. attribute:: n_output_nodes
+
+    .. attribute:: reduction_iname
+
+        The iname contracted with the second axis of :attr:`matrix_name`,
+        or *None*.
+
+    .. attribute:: matrix_name
+
+        The name of a (per-element invariant) matrix argument, or *None*.
+
+    .. attribute:: matrix_inames
+
+        The inames used to index :attr:`matrix_name`. Defaults to
+        :attr:`output_iname` and :attr:`reduction_iname`.
+
+    .. attribute:: tune
+
+        If *False*, always use the default transformation. This is necessary
+        for kernels that accumulate into their result, since those cannot be
+        timed by running them repeatedly.
+
+    .. attribute:: candidates
+
+        The names of the candidate transformations to choose from, the
+        first one being the default, or *None* to use the ones for loops
+        over elements.
+
+    .. automethod:: __call__
+    """
+
+    def __init__(self, kernel, key, output_iname, n_output_nodes,
+            reduction_iname=None, matrix_name=None, matrix_inames=None,
+            tune=True, candidates=None):
+        self.kernel = kernel
+        self.key = key
+        self.output_iname = output_iname
+        self.n_output_nodes = n_output_nodes
+        self.reduction_iname = reduction_iname
+        self.matrix_name = matrix_name
+
+        if matrix_inames is None:
+            matrix_inames = [output_iname, reduction_iname]
+        self.matrix_inames = matrix_inames
+
+        self.tune = tune
+        self.candidates = candidates
+
+        # maps candidate names to transformed kernels
+        self._transformed_kernels = {}
+
+        # maps device keys to transformed kernels
+        self._device_kernels = {}
+
+    def _get_transformed_kernel(self, candidate):
+        try:
+            return self._transformed_kernels[candidate]
+        except KeyError:
+            transform = dict(_CANDIDATES)[candidate]
+            knl = transform(self.kernel, self)
+            self._transformed_kernels[candidate] = knl
+            return knl
+
+    @property
+    def default_candidate(self):
+        if self.candidates is not None:
+            return self.candidates[0]
+        return DEFAULT_CANDIDATE
+
+    def _get_feasible_candidates(self, device, kwargs):
+        if self.candidates is not None:
+            # Failing candidates get skipped while tuning.
+            return list(self.candidates)
+
+        result = [DEFAULT_CANDIDATE, "element_per_work_item"]
+
+        if self.n_output_nodes <= device.max_work_group_size:
+            result.append("elements_per_group")
+
+            if (self.matrix_name is not None
+                    and 2*kwargs[self.matrix_name].nbytes
+                    <= device.local_mem_size):
+                result.append("prefetch_matrix")
+
+        return result
+
+    def _time_candidate(self, queue, candidate, kwargs, nruns=3):
+        from time import time
+
+        knl = self._get_transformed_kernel(candidate)
+
+        # compile, and make sure the transformation is valid
+        knl(queue, **kwargs)
+        queue.finish()
+
+        best_time = None
+        for i in range(nruns):
+            start_time = time()
+            knl(queue, **kwargs)
+            queue.finish()
+            elapsed = time() - start_time
+
+            if best_time is None or elapsed < best_time:
+                best_time = elapsed
+
+        return best_time
+
+    def _choose_candidate(self, queue, kwargs):
+        if not (self.tune and _is_tuning_enabled()):
+            return self.default_candidate
+
+        from pytools.persistent_dict import NoSuchEntryError
+
+        storage_key = (self.key, _get_device_key(queue.device))
+        try:
+            return _get_tuning_results().fetch(storage_key)
+        except NoSuchEntryError:
+            pass
+
+        timings = []
+        for candidate in self._get_feasible_candidates(queue.device, kwargs):
+            try:
+                timings.append(
+                        (self._time_candidate(queue, candidate, kwargs),
+                            candidate))
+            except Exception as e:
+                logger.warning("%s: candidate '%s' failed: %s"
+                        % (self.key, candidate, e))
+
+        if not timings:
+            return self.default_candidate
+
+        _, best_candidate = min(timings)
+        logger.info("%s: tuned to '%s' on '%s'"
+                % (self.key, best_candidate, queue.device.name))
+
+        _get_tuning_results().store(storage_key, best_candidate)
+        return best_candidate
+
+    def __call__(self, queue, **kwargs):
+        """Run the best transformation found for *queue*'s device, tuning
+        on the arguments *kwargs* first if no choice has been made yet.
+        The tuning runs write to the output arguments, so the kernel must not
+        read its output arguments. They also synchronize with the host, so
+        the first call on each device waits for all events in *wait_for*.
+        """
+
+        device_key = _get_device_key(queue.device)
+        try:
+            knl = self._device_kernels[device_key]
+        except KeyError:
+            candidate = self._choose_candidate(queue, kwargs)
+            knl = self._get_transformed_kernel(candidate)
+            self._device_kernels[device_key] = knl
+
+        return knl(queue, **kwargs)
+
+# vim: foldmethod=marker
@@ -27,6 +27,7 @@ THE SOFTWARE.
 import numpy as np
 from pytools import memoize_method
 import pyopencl as cl
+import pyopencl.array  # noqa
 
 __doc__ = """
 
@@ -82,13 +83,25 @@ class Visualizer(object):
         self.vis_discr = vis_discr
         self.connection = connection
 
-    def _resample_and_get(self, queue, vec):
+    def _resample(self, queue, vec):
         from pytools.obj_array import with_object_array_or_scalar
 
-        def resample_and_get_one(fld):
-            return self.connection(queue, fld).get(queue=queue)
+        def resample_one(fld):
+            return self.connection(queue, fld)
 
-        return with_object_array_or_scalar(resample_and_get_one, vec)
+        return with_object_array_or_scalar(resample_one, vec)
+
+    @staticmethod
+    def _get(queue, vec):
+        from pytools.obj_array import with_object_array_or_scalar
+
+        def get_one(fld):
+            if isinstance(fld, cl.array.Array):
+                return fld.get(queue=queue)
+            else:
+                return fld
+
+        return with_object_array_or_scalar(get_one, vec)
 
     @memoize_method
     def _vis_connectivity(self):
@@ -133,15 +146,19 @@ class Visualizer(object):
         do_show = kwargs.pop("do_show", True)
 
         with cl.CommandQueue(self.vis_discr.cl_context) as queue:
-            nodes = self.vis_discr.nodes().with_queue(queue).get()
+            # Enqueue all device work before waiting for any of it, and
+            # do the host-side work in the meantime.
+            nodes = self.vis_discr.nodes(queue)
+            field = self._resample(queue, field)
+
+            vis_connectivity = self._vis_connectivity()
 
-            field = self._resample_and_get(queue, field)
+            nodes = nodes.get(queue=queue)
+            field = self._get(queue, field)
 
         assert nodes.shape[0] == self.vis_discr.ambient_dim
         #mlab.points3d(nodes[0], nodes[1], 0*nodes[0])
 
-        vis_connectivity = self._vis_connectivity()
-
         if self.vis_discr.dim == 1:
             nodes = list(nodes)
             # pad to 3D with zeros
@@ -192,13 +209,19 @@ class Visualizer(object):
         el_type = el_types[self.vis_discr.dim]
 
         with cl.CommandQueue(self.vis_discr.cl_context) as queue:
-            nodes = self.vis_discr.nodes().with_queue(queue).get()
-
+            # Enqueue all device work before waiting for any of it, and
+            # do the host-side work in the meantime.
+            nodes = self.vis_discr.nodes(queue)
             names_and_fields = [
-                    (name, self._resample_and_get(queue, fld))
+                    (name, self._resample(queue, fld))
                     for name, fld in names_and_fields]
 
-        connectivity = self._vis_connectivity()
+            connectivity = self._vis_connectivity()
+
+            nodes = nodes.get(queue=queue)
+            names_and_fields = [
+                    (name, self._get(queue, fld))
+                    for name, fld in names_and_fields]
 
         nprimitive_elements = (
                 connectivity.shape[0]
@@ -237,7 +260,7 @@ def make_visualizer(queue, discr, vis_order):
     vis_discr = Discretization(
             discr.cl_context, discr.mesh,
             PolynomialWarpAndBlendGroupFactory(vis_order),
-            real_dtype=discr.real_dtype)
+            real_dtype=discr.real_dtype, allocator=discr.allocator)
     from meshmode.discretization.connection import \
             make_same_mesh_connection
     cnx = make_same_mesh_connection(queue, vis_discr, discr)
@@ -256,15 +279,8 @@ def write_mesh_connectivity_vtk_file(file_name, mesh,  compressor=None,):
             VTK_LINE,
             VF_LIST_OF_COMPONENTS)
 
-    centroids = np.empty(
-            (mesh.ambient_dim, mesh.nelements),
-            dtype=mesh.vertices.dtype)
-
-    for grp in mesh.groups:
-        iel_base = grp.element_nr_base
-        centroids[:, iel_base:iel_base+grp.nelements] = (
-                np.sum(mesh.vertices[:, grp.vertex_indices], axis=-1)
-                / grp.vertex_indices.shape[-1])
+    from meshmode.mesh.processing import find_element_centroids
+    centroids = find_element_centroids(mesh)
 
     cnx = mesh.element_connectivity
 
@@ -27,7 +27,7 @@ THE SOFTWARE.
 import numpy as np
 import modepy as mp
 import numpy.linalg as la
-from pytools import Record
+from pytools import Record, memoize_method
 
 __doc__ = """
 
@@ -35,6 +35,9 @@ __doc__ = """
     :members:
     :undoc-members:
 
+.. autoclass:: SimplexElementGroup
+    :members:
+
 .. autoclass:: Mesh
     :members:
     :undoc-members:
@@ -48,6 +51,32 @@ __doc__ = """
 
 # {{{ element group
 
+# Per-element geometric quantities are computed in chunks of this many
+# elements, to limit the size of temporaries.
+_GEOMETRY_CHUNK_SIZE = 2**14
+
+
+def _simplex_volumes(vertices):
+    """
+    :arg vertices: an array of shape *(ambient_dim, nelements, k+1)*
+        holding the vertices of *k*-simplices.
+    :return: the *k*-dimensional volumes of the simplices, as an array of
+        shape *(nelements,)*.
+    """
+
+    ambient_dim, nelements, nvertices = vertices.shape
+    k = nvertices - 1
+    if k == 0:
+        return np.ones(nelements)
+
+    # (nelements, ambient_dim, k)
+    spans = (vertices[:, :, 1:] - vertices[:, :, :1]).transpose(1, 0, 2)
+    gram = np.matmul(spans.transpose(0, 2, 1), spans)
+
+    from math import factorial
+    return np.sqrt(np.abs(np.linalg.det(gram))) / factorial(k)
+
+
 class MeshElementGroup(Record):
     """A group of elements sharing a common reference element.
 
@@ -213,6 +242,119 @@ class SimplexElementGroup(MeshElementGroup):
         else:
             raise NotImplementedError("dim=%d" % self.dim)
 
+    # {{{ element geometry
+
+    @memoize_method
+    def _element_geometry(self):
+        """Compute the geometric quantities of all elements in one vectorized
+        pass over chunks of elements. The vertices are found by evaluating
+        the nodes at the unit vertices.
+
+        :return: a :class:`dict` of arrays.
+        """
+
+        basis = mp.simplex_onb(self.dim, self.order)
+        to_vertices = mp.resampling_matrix(
+                basis, self.vertex_unit_coordinates().T, self.unit_nodes)
+
+        # Curved elements may bulge out between their nodes.
+        to_fine_nodes = None
+        if self.order > 1:
+            to_fine_nodes = mp.resampling_matrix(basis,
+                    mp.warp_and_blend_nodes(self.dim, 2*self.order),
+                    self.unit_nodes)
+
+        nvertices = self.dim + 1
+        vertex_pairs = np.triu_indices(nvertices, 1)
+        facets = [
+                [i for i in range(nvertices) if i != iomitted]
+                for iomitted in range(nvertices)]
+
+        ambient_dim = self.nodes.shape[0]
+        result = dict(
+                centroids=np.empty((ambient_dim, self.nelements)),
+                bbox_min=np.empty((ambient_dim, self.nelements)),
+                bbox_max=np.empty((ambient_dim, self.nelements)),
+                diameters=np.empty(self.nelements),
+                inradii=np.empty(self.nelements))
+
+        for start in range(0, self.nelements, _GEOMETRY_CHUNK_SIZE):
+            els = slice(start, start + _GEOMETRY_CHUNK_SIZE)
+            nodes = self.nodes[:, els]
+
+            # (ambient_dim, nelements_in_chunk, nvertices)
+            vertices = np.einsum("vj,dej->dev", to_vertices, nodes)
+
+            result["centroids"][:, els] = np.mean(vertices, axis=-1)
+
+            # {{{ bounding boxes
+
+            points = [vertices, nodes]
+            if to_fine_nodes is not None:
+                points.append(np.einsum("ij,dej->dei", to_fine_nodes, nodes))
+            points = np.concatenate(points, axis=-1)
+
+            bbox_min = np.min(points, axis=-1)
+            bbox_max = np.max(points, axis=-1)
+            if to_fine_nodes is not None:
+                pad = 0.01*np.max(bbox_max - bbox_min, axis=0)
+                bbox_min -= pad
+                bbox_max += pad
+
+            result["bbox_min"][:, els] = bbox_min
+            result["bbox_max"][:, els] = bbox_max
+
+            # }}}
+
+            edges = (vertices[:, :, vertex_pairs[0]]
+                    - vertices[:, :, vertex_pairs[1]])
+            result["diameters"][els] = np.max(
+                    np.sqrt(np.sum(edges**2, axis=0)), axis=-1)
+
+            facet_areas = sum(
+                    _simplex_volumes(vertices[:, :, facet]) for facet in facets)
+            result["inradii"][els] = (
+                    self.dim * _simplex_volumes(vertices) / facet_areas)
+
+        return result
+
+    def element_centroids(self):
+        """
+        :return: the centroids of the (straight-sided) simplices spanned by
+            the vertices of the elements, as an array of shape
+            *(ambient_dim, nelements)*.
+        """
+        return self._element_geometry()["centroids"]
+
+    def element_bounding_boxes(self):
+        """
+        :return: a tuple *(bbox_min, bbox_max)* of arrays of shape
+            *(ambient_dim, nelements)*, describing axis-aligned boxes
+            containing the vertices and nodes of each element. Curved
+            elements may bulge out between their nodes, so for those the
+            nodes are first resampled to a finer set of points, and the
+            boxes are padded by a small fraction of their size.
+        """
+        geometry = self._element_geometry()
+        return geometry["bbox_min"], geometry["bbox_max"]
+
+    def element_diameters(self):
+        """
+        :return: the length of the longest edge of each element, as an
+            array of shape *(nelements,)*.
+        """
+        return self._element_geometry()["diameters"]
+
+    def element_inradii(self):
+        """
+        :return: the radius of the sphere inscribed into the (straight-sided)
+            simplex spanned by the vertices of each element, as an array of
+            shape *(nelements,)*.
+        """
+        return self._element_geometry()["inradii"]
+
+    # }}}
+
     def vertex_unit_coordinates(self):
         if self.dim == 1:
             return np.array([
@@ -34,7 +34,10 @@ __doc__ = """
 .. autofunction:: find_volume_mesh_element_orientations
 .. autofunction:: perform_flips
 .. autofunction:: find_bounding_box
+.. autofunction:: find_element_centroids
+.. autofunction:: find_element_bounding_boxes
 .. autofunction:: merge_disjoint_meshes
+.. autofunction:: split_mesh_groups
 .. autofunction:: affine_map
 """
 
@@ -215,6 +218,31 @@ def find_bounding_box(mesh):
             np.max(mesh.vertices, axis=-1),
             )
 
+
+def find_element_centroids(mesh):
+    """
+    :return: an array of shape *(ambient_dim, nelements)* holding the
+        centroid of each element of *mesh*, see
+        :meth:`meshmode.mesh.SimplexElementGroup.element_centroids`.
+    """
+
+    return np.concatenate(
+            [grp.element_centroids() for grp in mesh.groups], axis=-1)
+
+
+def find_element_bounding_boxes(mesh):
+    """
+    :return: a tuple *(bbox_min, bbox_max)* of arrays of shape
+        *(ambient_dim, nelements)*, describing a box containing each element
+        of *mesh*, see
+        :meth:`meshmode.mesh.SimplexElementGroup.element_bounding_boxes`.
+    """
+
+    bboxes = [grp.element_bounding_boxes() for grp in mesh.groups]
+    return (
+            np.concatenate([bbox_min for bbox_min, _ in bboxes], axis=-1),
+            np.concatenate([bbox_max for _, bbox_max in bboxes], axis=-1))
+
 # }}}
 
 
@@ -271,6 +299,54 @@ def merge_disjoint_meshes(meshes, skip_tests=False):
 # }}}
 
 
+# {{{ splitting groups
+
+def split_mesh_groups(mesh, element_keys, skip_tests=False):
+    """Split each group of *mesh* into sub-groups of elements sharing the
+    same value in *element_keys*, such as a per-element polynomial order.
+
+    :arg element_keys: an array with one entry per element of *mesh*.
+    :return: a tuple *(new_mesh, old_element_numbers)*, where
+        *old_element_numbers* gives, for each element of *new_mesh*, its
+        number in *mesh*. Use it to carry per-element data over, as in
+        ``element_keys[old_element_numbers]``.
+    """
+
+    element_keys = np.asarray(element_keys)
+    if element_keys.shape != (mesh.nelements,):
+        raise ValueError("element_keys must have one entry per element")
+
+    new_groups = []
+    old_element_numbers = []
+
+    for grp in mesh.groups:
+        grp_keys = element_keys[
+                grp.element_nr_base:grp.element_nr_base + grp.nelements]
+
+        for key in np.unique(grp_keys):
+            iels = np.nonzero(grp_keys == key)[0]
+            new_groups.append(grp.copy(
+                vertex_indices=grp.vertex_indices[iels],
+                # make contiguous
+                nodes=grp.nodes[:, iels].copy()))
+            old_element_numbers.append(grp.element_nr_base + iels)
+
+    element_connectivity = mesh.connectivity_init_arg()
+    if isinstance(element_connectivity, tuple):
+        # refers to the old element numbers, recompute
+        element_connectivity = None
+
+    from meshmode.mesh import Mesh
+    new_mesh = Mesh(mesh.vertices, new_groups, skip_tests=skip_tests,
+            element_connectivity=element_connectivity,
+            vertex_id_dtype=mesh.vertex_id_dtype,
+            element_id_dtype=mesh.element_id_dtype)
+
+    return new_mesh, np.concatenate(old_element_numbers)
+
+# }}}
+
+
 # {{{ affine map
 
 def affine_map(mesh, A=None, b=None):  # noqa
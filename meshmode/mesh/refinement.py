@@ -23,64 +23,590 @@ THE SOFTWARE.
 """
 
 import numpy as np
+import modepy as mp
+
+__doc__ = """
+.. autoclass:: Refiner
+"""
+
+
+# {{{ helpers
+
+def _edge_keys(vertex_indices, edges):
+    """Return an integer key for each edge of each element that does not
+    depend on the orientation of the edge.
+
+    :arg vertex_indices: *(nelements, nvertices)*
+    :arg edges: *(nedges, 2)*, local vertex numbers of each edge
+    :return: *(nelements, nedges)*
+    """
+    a = vertex_indices[:, edges[:, 0]]
+    b = vertex_indices[:, edges[:, 1]]
+    return (np.minimum(a, b) << 32) | np.maximum(a, b)
 
 
-class _SplitFaceRecord(object):
+def _map_unit_nodes(unit_vertices, unit_nodes):
+    """Map *unit_nodes* of the reference simplex affinely onto the simplex
+    with vertices *unit_vertices* (of shape *(dim, dim+1)*).
     """
-    .. attribute:: neighboring_elements
-    .. attribute:: new_vertex_nr
+    origin = unit_vertices[:, :1]
+    return origin + np.dot(unit_vertices[:, 1:] - origin, (unit_nodes + 1)/2)
+
 
-        integer or None
+def _resample_nodes(grp, unit_points, element_indices):
+    """Evaluate the geometry of the elements *element_indices* of *grp*
+    at one point each, given in unit coordinates by the columns of
+    *unit_points*.
+
+    :return: *(ambient_dim, npoints)*
+    """
+    resampling_mat = mp.resampling_matrix(
+            mp.simplex_onb(grp.dim, grp.order), unit_points, grp.unit_nodes)
+    return np.einsum("pj,dpj->dp",
+            resampling_mat, grp.nodes[:, element_indices])
+
+
+def _get_edge_midpoints(mesh, parents, unit_vertices, iels, local_edges):
+    """Evaluate the midpoints of the edges *local_edges* (pairs of local
+    vertex numbers) of the elements *iels* on the geometry of their parents,
+    so that they lie on curved edges.
+
+    :return: *(ambient_dim, len(iels))*
+    """
+    midpoint_unit_coords = 0.5*(
+            unit_vertices[iels, :, local_edges[:, 0]]
+            + unit_vertices[iels, :, local_edges[:, 1]]).T
+
+    result = np.empty((mesh.ambient_dim, len(iels)), dtype=mesh.vertices.dtype)
+    for grp in mesh.groups:
+        grp_parents = parents[iels] - grp.element_nr_base
+        in_grp = (grp_parents >= 0) & (grp_parents < grp.nelements)
+        if in_grp.any():
+            result[:, in_grp] = _resample_nodes(grp,
+                    midpoint_unit_coords[:, in_grp], grp_parents[in_grp])
+
+    return result
+
+
+def _get_element_state(mesh):
+    """
+    :return: a tuple *(vertex_indices, parents, unit_vertices)* of arrays
+        covering the elements of all groups of *mesh*, giving
+        their vertex numbers, their own element numbers (as the parents
+        of their future children), and the vertices of the reference
+        simplex (in which the vertices of the children will be given).
     """
 
+    from meshmode.mesh import SimplexElementGroup
+
+    for grp in mesh.groups:
+        if not isinstance(grp, SimplexElementGroup):
+            raise NotImplementedError("refinement is only supported on "
+                    "exclusively SimplexElementGroup-based meshes")
+
+    vertex_indices = np.concatenate([
+        grp.vertex_indices for grp in mesh.groups]).astype(np.int64)
+
+    parents = np.arange(mesh.nelements)
+
+    unit_vertices = np.concatenate([
+        np.tile(grp.vertex_unit_coordinates().T, (grp.nelements, 1, 1))
+        for grp in mesh.groups])
+
+    return vertex_indices, parents, unit_vertices
+
+
+class _SplitEdgeTable(object):
+    """Edges scheduled for splitting, along with the numbers of their
+    midpoint vertices. Edges are identified by the keys from
+    :func:`_edge_keys`, which are kept sorted for lookup.
+    """
+
+    def __init__(self, vertices):
+        self.vertices = [vertices]
+        self.nvertices = vertices.shape[-1]
+
+        self.keys = np.empty(0, dtype=np.int64)
+        self.midpoints = np.empty(0, dtype=np.int64)
+
+    def contains(self, keys):
+        if not len(self.keys):
+            return np.zeros(keys.shape, dtype=bool)
+
+        idx = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return self.keys[idx] == keys
+
+    def get_midpoints(self, keys):
+        return self.midpoints[np.searchsorted(self.keys, keys)]
+
+    def add(self, keys, midpoint_coords):
+        new_midpoints = np.arange(
+                self.nvertices, self.nvertices + len(keys), dtype=np.int64)
+        self.nvertices += len(keys)
+        self.vertices.append(midpoint_coords)
+
+        keys = np.concatenate([self.keys, keys])
+        order = np.argsort(keys)
+        self.keys = keys[order]
+        self.midpoints = np.concatenate([self.midpoints, new_midpoints])[order]
+
+    def get_vertices(self):
+        return np.hstack(self.vertices)
+
+# }}}
+
 
 class Refiner(object):
+    """Conforming h-refinement of simplicial meshes by longest-edge
+    bisection.
+
+    Each element flagged for refinement is bisected at its longest edge.
+    Elements sharing a split edge are bisected in turn (possibly more than
+    once) until no hanging vertices remain, so that the refined mesh is
+    conforming. Each round of bisection is carried out on all affected
+    elements at once.
+
+    .. attribute:: last_mesh
+
+        The most recently refined mesh, or the mesh passed to the
+        constructor if :meth:`refine` has not been called.
+
+    .. attribute:: previous_mesh
+
+        The mesh that :attr:`last_mesh` was refined from, or *None*.
+
+    .. attribute:: last_split_elements
+
+        The indices of the elements of :attr:`previous_mesh` that were
+        split, or *None*.
+
+    .. attribute:: last_parent_elements
+
+        For each element of :attr:`last_mesh`, the index of the element of
+        :attr:`previous_mesh` containing it, or *None*. The children of each
+        element are numbered consecutively, and in the order of their
+        parents.
+
+    .. attribute:: last_child_unit_vertices
+
+        An array of shape *(last_mesh.nelements, dim, dim+1)* holding the
+        vertices of each element of :attr:`last_mesh` in the unit coordinates
+        of its parent, or *None*. Elements that were not split have the
+        vertices of the reference simplex.
+
+    .. attribute:: last_coarsened_mesh
+
+        The mesh that the most recent call to :meth:`coarsen` started from,
+        or *None*.
+
+    .. attribute:: last_coarsening_parent_elements
+
+        For each element of :attr:`last_coarsened_mesh`, the index of the
+        element of :attr:`last_mesh` containing it, or *None*.
+
+    .. attribute:: last_coarsening_child_unit_vertices
+
+        Like :attr:`last_child_unit_vertices`, for the elements of
+        :attr:`last_coarsened_mesh` in the unit coordinates of the elements
+        of :attr:`last_mesh` containing them, or *None*.
+
+    .. automethod:: get_empty_refine_flags
+    .. automethod:: refine
+    .. automethod:: refine_uniformly
+    .. automethod:: coarsen
+    """
+
     def __init__(self, mesh):
         self.last_mesh = mesh
-
-        # Indices in last_mesh that were split in the last round of
-        # refinement. Only these elements may be split this time
-        # around.
+        self.previous_mesh = None
         self.last_split_elements = None
+        self.last_parent_elements = None
+        self.last_child_unit_vertices = None
+
+        self.last_coarsened_mesh = None
+        self.last_coarsening_parent_elements = None
+        self.last_coarsening_child_unit_vertices = None
+
+    def _finish_refinement(self, mesh, vertices, vertex_indices, parents,
+            unit_vertices):
+        """Build the new :attr:`last_mesh` from the per-element state
+        relative to the parent mesh *mesh*, which becomes
+        :attr:`previous_mesh`.
+        """
+
+        from meshmode.mesh import SimplexElementGroup, Mesh
+
+        dim = mesh.dim
+
+        # Number the elements in the order of their parents, which also keeps
+        # groups contiguous.
+        order = np.argsort(parents, kind="mergesort")
+        vertex_indices = vertex_indices[order]
+        unit_vertices = unit_vertices[order]
+        parents = parents[order]
+
+        # {{{ build new groups
+
+        new_groups = []
+        for igrp, grp in enumerate(mesh.groups):
+            grp_start, grp_end = np.searchsorted(parents,
+                    [grp.element_nr_base, grp.element_nr_base + grp.nelements])
+
+            grp_parents = parents[grp_start:grp_end] - grp.element_nr_base
+            grp_unit_vertices = unit_vertices[grp_start:grp_end]
+
+            nodes = np.empty(
+                    (mesh.ambient_dim, grp_end - grp_start, grp.nunit_nodes),
+                    dtype=grp.nodes.dtype)
+
+            # Resample the nodes of the children in batches, one for each
+            # distinct sub-simplex of the parent.
+            child_types, child_type_indices = np.unique(
+                    grp_unit_vertices.reshape(len(grp_parents), -1),
+                    axis=0, return_inverse=True)
+            child_type_indices = child_type_indices.ravel()
+
+            for ichild_type, child_type in enumerate(child_types):
+                iels = np.nonzero(child_type_indices == ichild_type)[0]
+
+                resampling_mat = mp.resampling_matrix(
+                        mp.simplex_onb(grp.dim, grp.order),
+                        _map_unit_nodes(
+                            child_type.reshape(dim, dim+1), grp.unit_nodes),
+                        grp.unit_nodes)
+
+                nodes[:, iels] = np.einsum("ij,dej->dei",
+                        resampling_mat, grp.nodes[:, grp_parents[iels]])
+
+            new_groups.append(SimplexElementGroup(
+                grp.order,
+                vertex_indices[grp_start:grp_end].astype(
+                    grp.vertex_indices.dtype),
+                nodes, unit_nodes=grp.unit_nodes))
 
-    def get_refine_base_index(self):
-        if self.last_split_elements is None:
-            return 0
-        else:
-            return self.last_mesh.nelements - len(self.last_split_elements)
+        # }}}
+
+        new_mesh = Mesh(vertices, new_groups,
+                element_connectivity=None,
+                vertex_id_dtype=mesh.vertex_id_dtype,
+                element_id_dtype=mesh.element_id_dtype)
+
+        self.previous_mesh = mesh
+        self.last_mesh = new_mesh
+        self.last_split_elements = np.nonzero(
+                np.bincount(parents, minlength=mesh.nelements) > 1)[0]
+        self.last_parent_elements = parents
+        self.last_child_unit_vertices = unit_vertices
+
+        return new_mesh
 
     def get_empty_refine_flags(self):
-        return np.zeros(
-                self.last_mesh.nelements - self.get_refine_base_index(),
-                np.bool)
+        return np.zeros(self.last_mesh.nelements, bool)
 
     def refine(self, refine_flags):
         """
+        :arg refine_flags: an array of booleans, one for each element of
+            :attr:`last_mesh`, indicating which elements should be split.
+        :return: a refined mesh
+        """
+
+        mesh = self.last_mesh
+
+        refine_flags = np.asarray(refine_flags, dtype=bool)
+        if refine_flags.shape != (mesh.nelements,):
+            raise ValueError("refine_flags must have one entry per element")
+
+        dim = mesh.dim
+
+        from itertools import combinations
+        edges = np.array(list(combinations(range(dim+1), 2)), dtype=np.intp)
+
+        # These cover the elements of all groups, with the children
+        # replacing their parents as bisection proceeds.
+        vertex_indices, parents, unit_vertices = _get_element_state(mesh)
+
+        split_edges = _SplitEdgeTable(mesh.vertices)
+
+        def get_longest_edges(iels, keys):
+            el_vertices = split_edges.get_vertices()[:, vertex_indices[iels]]
+            lengths = np.sum((el_vertices[:, :, edges[:, 0]]
+                - el_vertices[:, :, edges[:, 1]])**2, axis=0)
+
+            # Break ties by key, so that all elements agree on the
+            # order of their common edges.
+            is_longest = lengths == np.max(lengths, axis=-1)[:, np.newaxis]
+            return np.argmin(
+                    np.where(is_longest, keys, np.iinfo(np.int64).max),
+                    axis=-1)
+
+        def split_longest_edges(iels, keys):
+            iedges = get_longest_edges(iels, keys[iels])
+            new_keys, first = np.unique(
+                    keys[iels, iedges], return_index=True)
+            split_edges.add(new_keys, _get_edge_midpoints(
+                mesh, parents, unit_vertices,
+                iels[first], edges[iedges[first]]))
+
+        keys = _edge_keys(vertex_indices, edges)
+        split_longest_edges(np.nonzero(refine_flags)[0], keys)
+
+        while True:
+            keys = _edge_keys(vertex_indices, edges)
+            has_split_edge = split_edges.contains(keys)
+            to_bisect = np.nonzero(np.any(has_split_edge, axis=-1))[0]
+
+            if not len(to_bisect):
+                break
+
+            longest_edges = get_longest_edges(to_bisect, keys[to_bisect])
+
+            # {{{ closure: elements are only ever split at their longest edge
+
+            needs_split = ~has_split_edge[to_bisect, longest_edges]
+            if needs_split.any():
+                split_longest_edges(to_bisect[needs_split], keys)
+                continue
+
+            # }}}
+
+            # {{{ bisect
+
+            bisect_edges = edges[longest_edges]
+            midpoints = split_edges.get_midpoints(
+                    keys[to_bisect, longest_edges])
+            midpoint_unit_vertices = 0.5*(
+                    unit_vertices[to_bisect, :, bisect_edges[:, 0]]
+                    + unit_vertices[to_bisect, :, bisect_edges[:, 1]])
+
+            # Replacing either end of the split edge by its midpoint
+            # preserves the orientation.
+            children_vertex_indices = []
+            children_unit_vertices = []
+            for iend in range(2):
+                child_vertex_indices = vertex_indices[to_bisect]
+                child_unit_vertices = unit_vertices[to_bisect]
+
+                iel = np.arange(len(to_bisect))
+                child_vertex_indices[iel, bisect_edges[:, iend]] = midpoints
+                child_unit_vertices[iel, :, bisect_edges[:, iend]] = \
+                        midpoint_unit_vertices
+
+                children_vertex_indices.append(child_vertex_indices)
+                children_unit_vertices.append(child_unit_vertices)
+
+            keep = np.ones(len(parents), dtype=bool)
+            keep[to_bisect] = False
+
+            vertex_indices = np.concatenate(
+                    [vertex_indices[keep]] + children_vertex_indices)
+            unit_vertices = np.concatenate(
+                    [unit_vertices[keep]] + children_unit_vertices)
+            parents = np.concatenate(
+                    [parents[keep], parents[to_bisect], parents[to_bisect]])
+
+            # }}}
+
+        return self._finish_refinement(mesh, split_edges.get_vertices(),
+                vertex_indices, parents, unit_vertices)
+
+    def refine_uniformly(self):
+        """Split each element of :attr:`last_mesh` into :math:`2^d` children
+        by connecting the midpoints of its edges, following the subdivision
+        of the reference simplex by :func:`modepy.tools.submesh`.
+
         :return: a refined mesh
         """
 
-        # multi-level mapping:
-        # {
-        #   dimension of intersecting entity (0=vertex,1=edge,2=face,...)
-        #   :
-        #   { frozenset of end vertices : _SplitFaceRecord }
-        # }
-        split_faces = {}
+        mesh = self.last_mesh
+        vertex_indices, parents, unit_vertices = _get_element_state(mesh)
+
+        dim = mesh.dim
+        nelements = mesh.nelements
+
+        # {{{ subdivision of the reference simplex
+
+        from pytools import \
+                generate_nonnegative_integer_tuples_summing_to_at_most as gnitstam
+        from modepy.tools import submesh
+
+        node_tuples = list(gnitstam(2, dim))
+        child_node_indices = np.array(submesh(node_tuples), dtype=np.intp)
+
+        node_unit_coords = np.array(node_tuples, dtype=np.float64).T - 1
+
+        # Make all children positively oriented.
+        spans = (node_unit_coords[:, child_node_indices[:, 1:]]
+                - node_unit_coords[:, child_node_indices[:, :1]])
+        flip = np.linalg.det(spans.transpose(1, 0, 2)) < 0
+        child_node_indices[flip, :2] = child_node_indices[flip, 1::-1]
+
+        # Each node of the subdivision is either a vertex or the midpoint
+        # of an edge of the reference simplex.
+        vertex_nodes = []
+        edge_nodes = []
+        for inode, node_tuple in enumerate(node_tuples):
+            bary_times_2 = (2 - sum(node_tuple),) + tuple(node_tuple)
+            if 2 in bary_times_2:
+                vertex_nodes.append((inode, bary_times_2.index(2)))
+            else:
+                edge_nodes.append((inode, tuple(
+                    i for i, b in enumerate(bary_times_2) if b == 1)))
+
+        # }}}
+
+        # {{{ global vertex numbers of the nodes of the subdivision
+
+        node_vertex_nrs = np.empty((nelements, len(node_tuples)), np.int64)
+        for inode, ivertex in vertex_nodes:
+            node_vertex_nrs[:, inode] = vertex_indices[:, ivertex]
+
+        edge_node_indices = np.array([inode for inode, _ in edge_nodes])
+        local_edges = np.array([edge for _, edge in edge_nodes], dtype=np.intp)
+
+        keys = _edge_keys(vertex_indices, local_edges)
+        new_keys, first = np.unique(keys, return_index=True)
+        iels, iedges = np.unravel_index(first, keys.shape)
+
+        split_edges = _SplitEdgeTable(mesh.vertices)
+        split_edges.add(new_keys, _get_edge_midpoints(
+            mesh, parents, unit_vertices, iels, local_edges[iedges]))
+
+        node_vertex_nrs[:, edge_node_indices] = split_edges.get_midpoints(keys)
+
+        # }}}
+
+        nchildren = len(child_node_indices)
+        return self._finish_refinement(mesh,
+                split_edges.get_vertices(),
+                node_vertex_nrs[:, child_node_indices].reshape(-1, dim+1),
+                np.repeat(parents, nchildren),
+                np.tile(node_unit_coords[:, child_node_indices].transpose(1, 0, 2),
+                    (nelements, 1, 1)))
+
+    def coarsen(self, coarsen_flags):
+        """Undo the splitting of elements of :attr:`previous_mesh` in
+        :attr:`last_mesh`, where all children are flagged. Children whose
+        merging would leave hanging vertices are kept, so that the coarsened
+        mesh remains conforming.
+
+        The coarsened mesh becomes :attr:`last_mesh`, still described
+        relative to :attr:`previous_mesh`. (So coarsening may be repeated,
+        but only back to :attr:`previous_mesh`.) The relation of its elements
+        to those of the mesh it was coarsened from is recorded in
+        :attr:`last_coarsening_parent_elements` and
+        :attr:`last_coarsening_child_unit_vertices`.
+
+        :arg coarsen_flags: an array of booleans, one for each element of
+            :attr:`last_mesh`.
+        :return: a coarsened mesh
+        """
+
+        if self.previous_mesh is None:
+            raise RuntimeError("no refinement to undo")
+
+        fine_mesh = self.last_mesh
+        coarse_mesh = self.previous_mesh
+
+        coarsen_flags = np.asarray(coarsen_flags, dtype=bool)
+        if coarsen_flags.shape != (fine_mesh.nelements,):
+            raise ValueError("coarsen_flags must have one entry per element")
+
+        parents = self.last_parent_elements
+        unit_vertices = self.last_child_unit_vertices
+        vertex_indices, _, _ = _get_element_state(fine_mesh)
+
+        nchildren = np.bincount(parents, minlength=coarse_mesh.nelements)
+        nflagged = np.bincount(parents, weights=coarsen_flags,
+                minlength=coarse_mesh.nelements)
+        mergeable = (nchildren > 1) & (nflagged == nchildren)
+
+        # {{{ keep the mesh conforming
+
+        # The vertices of previous_mesh come first in those of its
+        # refinements, so vertices with higher numbers were created by
+        # splitting elements. Merging an element removes those of its
+        # children, which is only possible if all elements sharing them are
+        # merged, too.
+
+        ncoarse_vertices = coarse_mesh.vertices.shape[-1]
+        is_new_vertex = vertex_indices >= ncoarse_vertices
+
+        while True:
+            is_merged = mergeable[parents]
+
+            is_vertex_kept = np.zeros(fine_mesh.vertices.shape[-1], bool)
+            is_vertex_kept[vertex_indices[~is_merged]] = True
+
+            blocked = is_merged & np.any(
+                    is_new_vertex & is_vertex_kept[vertex_indices], axis=-1)
+            if not blocked.any():
+                break
+
+            mergeable[parents[blocked]] = False
+
+        # }}}
+
+        # {{{ per-element state of the coarsened mesh, ordered by parent
+
+        merged_parents = np.nonzero(mergeable)[0]
+        coarse_vertex_indices, _, coarse_unit_vertices = \
+                _get_element_state(coarse_mesh)
+
+        new_vertex_indices = np.concatenate([
+            vertex_indices[~is_merged],
+            coarse_vertex_indices[merged_parents]])
+        new_parents = np.concatenate([parents[~is_merged], merged_parents])
+        new_unit_vertices = np.concatenate([
+            unit_vertices[~is_merged],
+            coarse_unit_vertices[merged_parents]])
+
+        order = np.argsort(new_parents, kind="mergesort")
+        new_vertex_indices = new_vertex_indices[order]
+        new_parents = new_parents[order]
+        new_unit_vertices = new_unit_vertices[order]
+
+        new_el_numbers = np.empty(len(order), dtype=np.intp)
+        new_el_numbers[order] = np.arange(len(order))
+
+        # }}}
+
+        # {{{ relation to the elements of fine_mesh
 
-        ibase = self.get_refine_base_index()
-        affected_group_indices = set()
+        nkept = np.count_nonzero(~is_merged)
 
-        for grp in self.last_mesh.groups:
-            iel_base
+        merged_parent_el_numbers = np.empty(coarse_mesh.nelements, np.intp)
+        merged_parent_el_numbers[merged_parents] = new_el_numbers[nkept:]
 
+        coarsening_parents = np.empty(fine_mesh.nelements, dtype=np.intp)
+        coarsening_parents[~is_merged] = new_el_numbers[:nkept]
+        coarsening_parents[is_merged] = \
+                merged_parent_el_numbers[parents[is_merged]]
 
+        coarsening_unit_vertices = unit_vertices.copy()
+        coarsening_unit_vertices[~is_merged] = coarse_unit_vertices[
+                parents[~is_merged]]
 
+        # }}}
 
+        # {{{ drop the vertices of merged children
 
+        is_vertex_used = np.zeros(fine_mesh.vertices.shape[-1], bool)
+        is_vertex_used[:ncoarse_vertices] = True
+        is_vertex_used[new_vertex_indices] = True
 
+        new_vertex_numbers = np.cumsum(is_vertex_used) - 1
 
+        # }}}
 
+        result = self._finish_refinement(coarse_mesh,
+                fine_mesh.vertices[:, is_vertex_used],
+                new_vertex_numbers[new_vertex_indices],
+                new_parents, new_unit_vertices)
 
+        self.last_coarsened_mesh = fine_mesh
+        self.last_coarsening_parent_elements = coarsening_parents
+        self.last_coarsening_child_unit_vertices = coarsening_unit_vertices
 
+        return result
 
 # vim: foldmethod=marker
@@ -1,6 +1,5 @@
 from __future__ import division
 from __future__ import absolute_import
-from six.moves import range
 
 __copyright__ = "Copyright (C) 2010,2012,2013 Andreas Kloeckner, Michael Tom"
 
@@ -25,24 +24,397 @@ THE SOFTWARE.
 """
 
 import numpy as np
-from pytools.spatial_btree import SpatialBinaryTreeBucket
+
+__doc__ = """
+.. autoclass:: ElementLookupTree
+.. autofunction:: make_element_lookup_tree
+.. autofunction:: locate_points
+"""
+
+
+# {{{ element lookup tree
+
+def _morton_codes(coords, bits):
+    """
+    :arg coords: an integer array of shape *(npoints, dim)*, with entries
+        less than ``2**bits``.
+    :return: the Morton (Z-order) codes of *coords*, as :class:`numpy.int64`.
+    """
+
+    npoints, dim = coords.shape
+    codes = np.zeros(npoints, dtype=np.int64)
+    for ibit in range(bits):
+        for idim in range(dim):
+            codes |= ((coords[:, idim] >> ibit) & 1) << (dim*ibit + idim)
+
+    return codes
+
+
+class ElementLookupTree(object):
+    """A bounding volume hierarchy over the bounding boxes of the elements of
+    a mesh, built in bulk: Elements are sorted along a Morton curve through
+    the centers of their bounding boxes and gathered into leaves of
+    *leaf_size* consecutive elements, which are then merged pairwise up to
+    the root. All data is kept in :mod:`numpy` arrays, so trees can be
+    pickled.
+
+    .. attribute:: element_bbox_min
+    .. attribute:: element_bbox_max
+
+        Arrays of shape *(nelements, ambient_dim)* holding the bounding box
+        of each element, padded by *eps*.
+
+    .. automethod:: find_candidate_elements
+    .. automethod:: generate_matches
+    .. automethod:: visualize
+    """
+
+    def __init__(self, mesh, eps=1e-12, leaf_size=16):
+        self.group_element_starts = np.array(
+                [grp.element_nr_base for grp in mesh.groups] + [mesh.nelements])
+
+        from meshmode.mesh.processing import find_element_bounding_boxes
+        bbox_min, bbox_max = find_element_bounding_boxes(mesh)
+        bbox_min = bbox_min.T - eps
+        bbox_max = bbox_max.T + eps
+        self.element_bbox_min = bbox_min
+        self.element_bbox_max = bbox_max
+
+        nelements, dim = bbox_min.shape
+
+        self.leaf_size = leaf_size
+
+        if nelements == 0:
+            # a tree without levels, in which no point finds candidates
+            self.element_order = np.zeros(0, dtype=np.intp)
+            self.level_bbox_min = []
+            self.level_bbox_max = []
+            return
+
+        # {{{ sort along a Morton curve
+
+        bits = min(21, 63 // dim)
+
+        centers = 0.5*(bbox_min + bbox_max)
+        lower = np.min(bbox_min, axis=0)
+        extent = np.max(bbox_max, axis=0) - lower
+        extent[extent == 0] = 1
+
+        quantized = ((centers - lower) / extent * (2**bits - 1)).astype(np.int64)
+        self.element_order = np.argsort(
+                _morton_codes(quantized, bits), kind="mergesort")
+
+        sorted_min = bbox_min[self.element_order]
+        sorted_max = bbox_max[self.element_order]
+
+        # }}}
+
+        # {{{ build the levels, from the leaves up
+
+        leaf_starts = np.arange(0, nelements, leaf_size)
+
+        level_min = [np.minimum.reduceat(sorted_min, leaf_starts, axis=0)]
+        level_max = [np.maximum.reduceat(sorted_max, leaf_starts, axis=0)]
+
+        while len(level_min[-1]) > 1:
+            pair_starts = np.arange(0, len(level_min[-1]), 2)
+            level_min.append(
+                    np.minimum.reduceat(level_min[-1], pair_starts, axis=0))
+            level_max.append(
+                    np.maximum.reduceat(level_max[-1], pair_starts, axis=0))
+
+        # The children of node i on one level are nodes 2i and 2i+1 on the
+        # next one.
+        self.level_bbox_min = level_min[::-1]
+        self.level_bbox_max = level_max[::-1]
+
+        # }}}
+
+    @property
+    def nelements(self):
+        return len(self.element_order)
+
+    def find_candidate_elements(self, points):
+        """Find the elements whose bounding boxes contain each of *points*.
+
+        :arg points: an array of shape *(ambient_dim, npoints)*.
+        :return: a tuple *(point_indices, element_nrs)* of arrays of the
+            same length, listing all matching pairs, sorted by point.
+        """
+
+        points = np.asarray(points).T
+        npoints = len(points)
+
+        if not self.level_bbox_min:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+
+        point_indices = np.arange(npoints)
+        nodes = np.zeros(npoints, dtype=np.intp)
+
+        def filter_inside(bbox_min, bbox_max, point_indices, nodes):
+            pts = points[point_indices]
+            inside = np.all(
+                    (bbox_min[nodes] <= pts) & (pts <= bbox_max[nodes]), axis=-1)
+            return point_indices[inside], nodes[inside]
+
+        # {{{ descend level by level
+
+        nlevels = len(self.level_bbox_min)
+        for ilevel in range(nlevels):
+            point_indices, nodes = filter_inside(
+                    self.level_bbox_min[ilevel], self.level_bbox_max[ilevel],
+                    point_indices, nodes)
+
+            if ilevel + 1 < nlevels:
+                point_indices = np.repeat(point_indices, 2)
+                nodes = (2*np.repeat(nodes, 2)
+                        + np.tile([0, 1], len(nodes)))
+
+                exists = nodes < len(self.level_bbox_min[ilevel + 1])
+                point_indices = point_indices[exists]
+                nodes = nodes[exists]
+
+        # }}}
+
+        # {{{ expand leaves into elements
+
+        starts = nodes * self.leaf_size
+        counts = np.minimum(starts + self.leaf_size, self.nelements) - starts
+
+        point_indices = np.repeat(point_indices, counts)
+        offsets = np.arange(np.sum(counts)) - np.repeat(
+                np.cumsum(counts) - counts, counts)
+        positions = np.repeat(starts, counts) + offsets
+
+        element_nrs = self.element_order[positions]
+        point_indices, element_nrs = filter_inside(
+                self.element_bbox_min, self.element_bbox_max,
+                point_indices, element_nrs)
+
+        # }}}
+
+        order = np.argsort(point_indices, kind="mergesort")
+        return point_indices[order], element_nrs[order]
+
+    def generate_matches(self, point):
+        """Generate tuples *(igrp, iel_grp)* of the group number and the
+        group-local element number of elements whose bounding boxes contain
+        *point*.
+        """
+
+        _, element_nrs = self.find_candidate_elements(
+                np.asarray(point).reshape(-1, 1))
+
+        igrps = np.searchsorted(
+                self.group_element_starts, element_nrs, side="right") - 1
+        for igrp, iel in zip(igrps, element_nrs):
+            yield int(igrp), int(iel - self.group_element_starts[igrp])
+
+    def visualize(self, file):
+        """Write the boxes of the leaves of a two-dimensional tree to *file*,
+        as closed polygons in the format understood by :program:`gnuplot`.
+        """
+
+        if not self.level_bbox_min:
+            return
+
+        for (x0, y0), (x1, y1) in zip(
+                self.level_bbox_min[-1], self.level_bbox_max[-1]):
+            for x, y in [(x0, y0), (x1, y0), (x1, y1), (x0, y1), (x0, y0)]:
+                file.write("%f %f\n" % (x, y))
+            file.write("\n")
 
 
 def make_element_lookup_tree(mesh, eps=1e-12):
-    from meshmode.mesh.processing import find_bounding_box
-    bbox_min, bbox_max = find_bounding_box(mesh)
-    bbox_min -= eps
-    bbox_max += eps
+    """
+    :return: an :class:`ElementLookupTree` for *mesh*.
+    """
+    return ElementLookupTree(mesh, eps)
+
+# }}}
+
+
+# {{{ point location
+
+def _get_affine_inverses(mesh, grp):
+    """
+    :return: a tuple *(origins, inverses)* of arrays of shape
+        *(ambient_dim, nelements)* and *(nelements, dim, ambient_dim)*, such
+        that the unit coordinates of a point *x* in element *iel* (in the
+        least-squares sense, for surfaces) are
+        ``inverses[iel] @ (x - origins[:, iel]) - 1``.
+    """
+
+    el_vertices = mesh.vertices[:, grp.vertex_indices]
+    origins = el_vertices[:, :, 0]
+
+    # (nelements, ambient_dim, dim), the Jacobian of the map from unit
+    # coordinates in [-1, 1]
+    jacobians = 0.5*(el_vertices[:, :, 1:]
+            - origins[:, :, np.newaxis]).transpose(1, 0, 2)
+
+    jacobians_t = jacobians.transpose(0, 2, 1)
+    inverses = np.linalg.solve(np.matmul(jacobians_t, jacobians), jacobians_t)
+
+    return origins, inverses
+
+
+def _solve_newton(modal_coeffs, basis, grad_basis, unit_coords, points,
+        tol, max_iterations):
+    """Invert the polynomial element maps given by *modal_coeffs* (of shape
+    *(ambient_dim, npoints, nbasis)*) at *points*, starting from
+    *unit_coords*, by (Gauss-)Newton iteration.
+    """
+
+    import modepy as mp
+
+    for i in range(max_iterations):
+        vdm = mp.vandermonde(basis, unit_coords)
+        grad_vdms = mp.vandermonde(grad_basis, unit_coords)
+        if not isinstance(grad_vdms, tuple):
+            grad_vdms = (grad_vdms,)
+
+        residuals = (np.einsum("pb,dpb->dp", vdm, modal_coeffs) - points).T
+
+        # (npoints, ambient_dim, dim)
+        jacobians = np.stack([
+            np.einsum("pb,dpb->pd", grad_vdm, modal_coeffs)
+            for grad_vdm in grad_vdms], axis=-1)
+
+        jacobians_t = jacobians.transpose(0, 2, 1)
+        steps = np.linalg.solve(
+                np.matmul(jacobians_t, jacobians),
+                np.matmul(jacobians_t, residuals[:, :, np.newaxis]))[:, :, 0]
+
+        unit_coords = unit_coords - steps.T
+
+        if np.max(np.abs(steps), initial=0) < tol:
+            break
+
+    return unit_coords
+
+
+def locate_points(mesh, points, tree=None, tol=1e-10, max_newton_iterations=20):
+    """Find the elements of *mesh* containing *points*, and the unit
+    coordinates of the points in them.
+
+    Candidate elements come from an :class:`ElementLookupTree`. The element
+    maps are then inverted for all candidates at once, by a linear solve for
+    affinely mapped elements and by Newton's method for curved ones.
+    Points on the boundary between elements are assigned to one of them.
+
+    :arg points: an array of shape *(ambient_dim, npoints)*.
+    :arg tree: an :class:`ElementLookupTree` for *mesh*, built if not given.
+    :arg tol: how far (in unit coordinates) outside of an element a point
+        may lie and still be considered inside. For surface meshes, points
+        also need to lie within *tol* times the element diameter of the
+        surface.
+    :return: a tuple *(element_nrs, unit_coords)*, where *element_nrs*
+        holds the (mesh-wide) number of the element containing each point,
+        or -1 if there is none, and *unit_coords* is an array of shape
+        *(mesh.dim, npoints)*, filled with NaN for points not found.
+    """
+
+    from meshmode.mesh import SimplexElementGroup
+    import modepy as mp
+
+    points = np.asarray(points)
+    npoints = points.shape[-1]
+
+    if tree is None:
+        tree = make_element_lookup_tree(mesh)
+
+    point_indices, element_nrs = tree.find_candidate_elements(points)
+
+    candidate_unit_coords = np.empty((mesh.dim, len(point_indices)))
+
+    for grp in mesh.groups:
+        if not isinstance(grp, SimplexElementGroup):
+            raise NotImplementedError("point location is only supported on "
+                    "exclusively SimplexElementGroup-based meshes")
+
+        grp_elements = element_nrs - grp.element_nr_base
+        in_grp = (grp_elements >= 0) & (grp_elements < grp.nelements)
+        if not in_grp.any():
+            continue
+
+        grp_elements = grp_elements[in_grp]
+        grp_points = points[:, point_indices[in_grp]]
+
+        origins, inverses = _get_affine_inverses(mesh, grp)
+        unit_coords = np.einsum("pra,ap->rp",
+                inverses[grp_elements],
+                grp_points - origins[:, grp_elements]) - 1
+
+        # {{{ refine the solution on curved elements
+
+        if grp.order > 1:
+            basis = mp.simplex_onb(grp.dim, grp.order)
+            vdm_inv = np.linalg.inv(mp.vandermonde(basis, grp.unit_nodes))
+
+            # (ambient_dim, nelements, nbasis)
+            modal_coeffs = np.einsum("dei,bi->deb", grp.nodes, vdm_inv)
+
+            # Elements whose nodes are an affine image of the unit nodes
+            # do not need Newton's method.
+            linear_vdm = np.vstack([
+                np.ones(grp.unit_nodes.shape[-1]), grp.unit_nodes]).T
+            affine_nodes = np.einsum("dej,ij->dei", grp.nodes,
+                    np.dot(linear_vdm, np.linalg.pinv(linear_vdm)))
+            is_curved = (np.max(np.abs(grp.nodes - affine_nodes), axis=(0, 2))
+                    > 1e-13 * grp.element_diameters())
+
+            curved = is_curved[grp_elements]
+            if curved.any():
+                # Newton's method may diverge for candidates that do not
+                # contain their point, those are rejected below.
+                with np.errstate(over="ignore", invalid="ignore"):
+                    unit_coords[:, curved] = _solve_newton(
+                            modal_coeffs[:, grp_elements[curved]],
+                            basis, mp.grad_simplex_onb(grp.dim, grp.order),
+                            unit_coords[:, curved], grp_points[:, curved],
+                            tol, max_newton_iterations)
+
+        # }}}
+
+        # {{{ reject points off surfaces
+
+        if grp.dim < mesh.ambient_dim:
+            mapped_points = np.einsum("pj,dpj->dp",
+                    mp.resampling_matrix(
+                        mp.simplex_onb(grp.dim, grp.order),
+                        unit_coords, grp.unit_nodes),
+                    grp.nodes[:, grp_elements])
+
+            off_surface = (
+                    np.max(np.abs(mapped_points - grp_points), axis=0)
+                    > tol*grp.element_diameters()[grp_elements])
+            unit_coords[:, off_surface] = np.nan
+
+        # }}}
+
+        candidate_unit_coords[:, in_grp] = unit_coords
+
+    # {{{ pick the first candidate containing each point
+
+    with np.errstate(invalid="ignore"):
+        bary = (candidate_unit_coords + 1) / 2
+        inside = (np.all(bary >= -tol, axis=0)
+                & (np.sum(bary, axis=0) <= 1 + tol))
+
+    found_points, first = np.unique(point_indices[inside], return_index=True)
+
+    result_element_nrs = np.full(npoints, -1, dtype=np.intp)
+    result_element_nrs[found_points] = element_nrs[inside][first]
+
+    result_unit_coords = np.full((mesh.dim, npoints), np.nan)
+    result_unit_coords[:, found_points] = candidate_unit_coords[:, inside][:, first]
 
-    tree = SpatialBinaryTreeBucket(bbox_min, bbox_max)
+    # }}}
 
-    for igrp, grp in enumerate(mesh.groups):
-        for iel_grp in range(grp.nelements):
-            el_vertices = mesh.vertices[:, grp.vertex_indices[iel_grp]]
+    return result_element_nrs, result_unit_coords
 
-            el_bbox_min = np.min(el_vertices, axis=-1) - eps
-            el_bbox_max = np.max(el_vertices, axis=-1) + eps
+# }}}
 
-            tree.insert((igrp, iel_grp), (el_bbox_min, el_bbox_max))
 
-    return tree
+# vim: foldmethod=marker
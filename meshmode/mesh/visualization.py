@@ -37,6 +37,9 @@ def draw_2d_mesh(mesh, draw_vertex_numbers=True, draw_element_numbers=True,
     import matplotlib.patches as mpatches
     from matplotlib.path import Path
 
+    from meshmode.mesh.processing import find_element_centroids
+    centroids = find_element_centroids(mesh)
+
     for igrp, grp in enumerate(mesh.groups):
         for iel, el in enumerate(grp.vertex_indices):
             elverts = mesh.vertices[:, el]
@@ -57,7 +60,7 @@ def draw_2d_mesh(mesh, draw_vertex_numbers=True, draw_element_numbers=True,
             pt.gca().add_patch(patch)
 
             if draw_element_numbers:
-                centroid = (np.sum(elverts, axis=1) / elverts.shape[1])
+                centroid = centroids[:, grp.element_nr_base + iel]
 
                 if len(mesh.groups) == 1:
                     el_label = str(iel)
@@ -75,14 +78,6 @@ def draw_2d_mesh(mesh, draw_vertex_numbers=True, draw_element_numbers=True,
                     bbox=dict(facecolor='white', alpha=0.5, lw=0))
 
     if draw_connectivity:
-        def global_iel_to_group_and_iel(global_iel):
-            for igrp, grp in enumerate(mesh.groups):
-                if global_iel < grp.nelements:
-                    return grp, global_iel
-                global_iel -= grp.nelements
-
-            raise ValueError("invalid element nr")
-
         cnx = mesh.element_connectivity
 
         nb_starts = cnx.neighbors_starts
@@ -90,14 +85,8 @@ def draw_2d_mesh(mesh, draw_vertex_numbers=True, draw_element_numbers=True,
             for nb_iel_g in cnx.neighbors[nb_starts[iel_g]:nb_starts[iel_g+1]]:
                 assert iel_g != nb_iel_g
 
-                grp, iel = global_iel_to_group_and_iel(iel_g)
-                nb_grp, nb_iel = global_iel_to_group_and_iel(nb_iel_g)
-
-                elverts = mesh.vertices[:, grp.vertex_indices[iel]]
-                nb_elverts = mesh.vertices[:, nb_grp.vertex_indices[nb_iel]]
-
-                centroid = (np.sum(elverts, axis=1) / elverts.shape[1])
-                nb_centroid = (np.sum(nb_elverts, axis=1) / nb_elverts.shape[1])
+                centroid = centroids[:, iel_g]
+                nb_centroid = centroids[:, nb_iel_g]
 
                 dx = nb_centroid - centroid
                 start = centroid + 0.15*dx
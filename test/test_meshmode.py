@@ -39,6 +39,38 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+# {{{ helpers
+
+def _make_box_discretization(cl_ctx, dim, order=3, npoints=4, extent=1,
+        real_dtype=np.float64):
+    from meshmode.mesh.generation import generate_box_mesh
+    from meshmode.discretization import Discretization
+    from meshmode.discretization.poly_element import \
+            PolynomialWarpAndBlendGroupFactory
+
+    mesh = generate_box_mesh(dim*(np.linspace(0, extent, npoints),),
+            order=order)
+    return Discretization(cl_ctx, mesh,
+            PolynomialWarpAndBlendGroupFactory(order), real_dtype=real_dtype)
+
+
+def _make_box_boundary_restriction(queue, dim, order=3, npoints=4):
+    """
+    :return: a tuple ``(vol_discr, bdry_discr, bdry_connection)``
+    """
+    from meshmode.discretization.poly_element import \
+            PolynomialWarpAndBlendGroupFactory
+    from meshmode.discretization.connection import make_boundary_restriction
+
+    vol_discr = _make_box_discretization(queue.context, dim, order, npoints)
+    bdry_mesh, bdry_discr, bdry_connection = make_boundary_restriction(
+            queue, vol_discr, PolynomialWarpAndBlendGroupFactory(order))
+
+    return vol_discr, bdry_discr, bdry_connection
+
+# }}}
+
+
 def test_circle_mesh(do_plot=False):
     from meshmode.mesh.io import generate_gmsh, FileSource
     print("BEGIN GEN")
@@ -109,6 +141,807 @@ def test_boundary_interpolation(ctx_getter):
     assert eoc_rec.order_estimate() >= order-0.5
 
 
+@pytest.mark.parametrize("dim", [2, 3])
+def test_fused_connection(ctx_getter, dim):
+    cl_ctx = ctx_getter()
+    queue = cl.CommandQueue(cl_ctx)
+
+    vol_discr, bdry_discr, bdry_connection = \
+            _make_box_boundary_restriction(queue, dim)
+
+    x = vol_discr.nodes()[0].with_queue(queue)
+    f = 0.1*cl.clmath.sin(30*x)
+
+    bdry_f_fused = bdry_connection(queue, f, fused=True).get(queue=queue)
+    bdry_f_batched = bdry_connection(queue, f, fused=False).get(queue=queue)
+
+    assert la.norm(bdry_f_fused - bdry_f_batched, np.inf) < 1e-14
+
+
+def test_chained_connection(ctx_getter):
+    cl_ctx = ctx_getter()
+    queue = cl.CommandQueue(cl_ctx)
+
+    from meshmode.discretization import Discretization
+    from meshmode.discretization.poly_element import \
+            QuadratureSimplexGroupFactory
+    from meshmode.discretization.connection import (
+            make_same_mesh_connection, ChainedDiscretizationConnection)
+
+    order = 3
+    vol_discr, bdry_discr, bdry_connection = \
+            _make_box_boundary_restriction(queue, 3, order)
+
+    quad_bdry_discr = Discretization(cl_ctx, bdry_discr.mesh,
+            QuadratureSimplexGroupFactory(2*order))
+    quad_connection = make_same_mesh_connection(
+            queue, quad_bdry_discr, bdry_discr)
+
+    chained = ChainedDiscretizationConnection(
+            [bdry_connection, quad_connection])
+    assert len(chained._applied_connections) == 1
+
+    x = vol_discr.nodes()[0].with_queue(queue)
+    f = 0.1*cl.clmath.sin(30*x)
+
+    f_seq = quad_connection(queue, bdry_connection(queue, f)) \
+            .get(queue=queue)
+    f_chained = chained(queue, f).get(queue=queue)
+
+    assert la.norm(f_seq - f_chained, np.inf) < 1e-13
+
+    nested = ChainedDiscretizationConnection(
+            [ChainedDiscretizationConnection([bdry_connection]),
+                quad_connection])
+    assert len(nested._applied_connections) == 1
+    assert la.norm(nested(queue, f).get(queue=queue) - f_chained,
+            np.inf) < 1e-13
+
+    # the adjoint cannot be composed: the boundary data is kept in an
+    # intermediate array, which is reused across calls
+    lift_chained = ChainedDiscretizationConnection(
+            [bdry_connection, bdry_connection.adjoint()])
+    assert len(lift_chained._applied_connections) == 2
+
+    f_lift_seq = bdry_connection.adjoint()(
+            queue, bdry_connection(queue, f)).get(queue=queue)
+    for g in [f, 2*f]:
+        f_lift_chained = lift_chained(queue, g).get(queue=queue)
+    assert len(lift_chained._intermediates) == 1
+    assert la.norm(2*f_lift_seq - f_lift_chained, np.inf) < 1e-13
+
+
+def test_same_mesh_connection_fast_paths(ctx_getter):
+    cl_ctx = ctx_getter()
+    queue = cl.CommandQueue(cl_ctx)
+
+    from meshmode.discretization import Discretization
+    from meshmode.discretization.poly_element import (
+            PolynomialWarpAndBlendGroupFactory,
+            InterpolatoryQuadratureSimplexGroupFactory)
+    from meshmode.discretization.connection import (
+            make_same_mesh_connection, IdentityDiscretizationConnection)
+
+    order = 3
+    discr = _make_box_discretization(cl_ctx, 2, order)
+    same_discr = Discretization(cl_ctx, discr.mesh,
+            PolynomialWarpAndBlendGroupFactory(order))
+    quad_discr = Discretization(cl_ctx, discr.mesh,
+            InterpolatoryQuadratureSimplexGroupFactory(order))
+
+    x = discr.nodes()[0].with_queue(queue)
+    f = 0.1*cl.clmath.sin(30*x)
+
+    identity = make_same_mesh_connection(queue, same_discr, discr)
+    assert isinstance(identity, IdentityDiscretizationConnection)
+    assert identity(queue, f) is f
+
+    resample = make_same_mesh_connection(queue, quad_discr, discr)
+    assert not isinstance(resample, IdentityDiscretizationConnection)
+    assert list(resample._identity_map_groups()) == [0]
+
+    grp = discr.groups[0]
+    f_quad_ref = np.einsum("ij,kj->ki",
+            resample._resample_matrix(0, 0),
+            grp.view(f.get()))
+    f_quad = quad_discr.groups[0].view(resample(queue, f).get(queue=queue))
+
+    assert la.norm((f_quad - f_quad_ref).ravel(), np.inf) < 1e-14
+
+
+@pytest.mark.parametrize("dim", [2, 3])
+def test_connection_to_sparse(ctx_getter, dim):
+    pytest.importorskip("scipy")
+
+    cl_ctx = ctx_getter()
+    queue = cl.CommandQueue(cl_ctx)
+
+    vol_discr, bdry_discr, bdry_connection = \
+            _make_box_boundary_restriction(queue, dim)
+
+    x = vol_discr.nodes()[0].with_queue(queue)
+    f = 0.1*cl.clmath.sin(30*x)
+    bdry_f = bdry_connection(queue, f).get(queue=queue)
+
+    f_host = f.get()
+    for fmt in ["csr", "bsr"]:
+        mat = bdry_connection.to_sparse(format=fmt)
+        assert mat.shape == (bdry_discr.nnodes, vol_discr.nnodes)
+        assert la.norm(mat.dot(f_host) - bdry_f, np.inf) < 1e-14
+
+    assert la.norm(bdry_connection.apply_host(f_host) - bdry_f, np.inf) < 1e-14
+
+
+@pytest.mark.parametrize("dim", [2, 3])
+def test_connection_adjoint(ctx_getter, dim):
+    cl_ctx = ctx_getter()
+    queue = cl.CommandQueue(cl_ctx)
+
+    vol_discr, bdry_discr, bdry_connection = \
+            _make_box_boundary_restriction(queue, dim)
+    lift = bdry_connection.adjoint()
+
+    vol_x = vol_discr.nodes()[0].with_queue(queue)
+    f = 0.1*cl.clmath.sin(30*vol_x)
+    bdry_x = bdry_discr.nodes()[0].with_queue(queue)
+    g = 0.1*cl.clmath.cos(20*bdry_x)
+
+    restricted_f = bdry_connection(queue, f).with_queue(queue)
+    lifted_g = lift(queue, g).with_queue(queue)
+
+    lhs = cl.array.dot(restricted_f, g).get()
+    rhs = cl.array.dot(f, lifted_g).get()
+    assert abs(lhs - rhs) < 1e-13 * abs(lhs)
+
+    assert la.norm(lift.apply_host(g.get()) - lifted_g.get(), np.inf) < 1e-14
+
+
+def test_reference_operator_cache(ctx_getter):
+    cl_ctx = ctx_getter()
+
+    from meshmode.discretization.reference_cache import ReferenceOperatorCache
+
+    discr_1 = _make_box_discretization(cl_ctx, 2)
+    discr_2 = _make_box_discretization(cl_ctx, 2)
+
+    grp_1, = discr_1.groups
+    grp_2, = discr_2.groups
+    assert grp_1.unit_nodes is grp_2.unit_nodes
+    assert grp_1.diff_matrices() is grp_2.diff_matrices()
+    assert grp_1.resampling_matrix() is grp_2.resampling_matrix()
+    assert not grp_1.unit_nodes.flags.writeable
+
+    # {{{ eviction
+
+    cache = ReferenceOperatorCache(max_nbytes=3*8*100)
+    for i in range(5):
+        cache.get(("ones", i), lambda: np.ones(100))
+
+    assert len(cache) == 3
+    assert cache.nbytes == 3*8*100
+    assert cache.misses == 5
+
+    cache.get(("ones", 4), lambda: None)
+    assert cache.hits == 1
+
+    # }}}
+
+
+def test_warm_up(ctx_getter):
+    cl_ctx = ctx_getter()
+    queue = cl.CommandQueue(cl_ctx)
+
+    from meshmode.discretization import _make_diff_kernel
+
+    vol_discr, bdry_discr, bdry_connection = \
+            _make_box_boundary_restriction(queue, 3, npoints=3)
+
+    assert vol_discr.warm_up(queue) >= 0
+    assert bdry_connection.warm_up(
+            queue, dtypes=[np.float64, np.complex128]) >= 0
+    assert bdry_connection.adjoint().warm_up(queue) >= 0
+
+    # kernels are shared among discretizations with the same node counts
+    other_discr = _make_box_discretization(cl_ctx, 3, npoints=3)
+    grp, = vol_discr.groups
+    other_grp, = other_discr.groups
+    assert (_make_diff_kernel(grp.nunit_nodes, vol_discr.real_dtype)
+            is _make_diff_kernel(other_grp.nunit_nodes, other_discr.real_dtype))
+
+
+@pytest.mark.parametrize("dim", [2, 3])
+def test_reference_gradient(ctx_getter, dim):
+    cl_ctx = ctx_getter()
+    queue = cl.CommandQueue(cl_ctx)
+
+    from pytools.obj_array import make_obj_array
+
+    discr = _make_box_discretization(cl_ctx, dim)
+
+    x = discr.nodes()[0].with_queue(queue)
+    f = cl.clmath.sin(3*x)
+    g = (x**2).astype(discr.complex_dtype)
+
+    grad_f = discr.num_reference_gradient(queue, f)
+    grad_f_2, grad_g = discr.num_reference_gradient(
+            queue, make_obj_array([f, g]))
+    assert grad_f.shape == (dim, discr.nnodes)
+
+    for field, grad in [(f, grad_f), (f, grad_f_2), (g, grad_g)]:
+        grad = grad.get(queue=queue)
+        for ref_axis in range(dim):
+            ref_grad = discr.num_reference_derivative(
+                    queue, (ref_axis,), field).get(queue=queue)
+            assert la.norm(grad[ref_axis] - ref_grad, np.inf) < 1e-12
+
+    with pytest.raises(ValueError):
+        discr.num_reference_gradient(queue, f[:-1])
+    with pytest.raises(ValueError):
+        discr.num_reference_gradient(queue, make_obj_array([f, g[:-1]]))
+    with pytest.raises(ValueError):
+        discr.num_reference_gradient(queue, make_obj_array([f, g]), out=grad_f)
+
+
+@pytest.mark.parametrize("dim", [2, 3])
+@pytest.mark.parametrize("curved", [False, True])
+def test_geometric_factors(ctx_getter, dim, curved):
+    cl_ctx = ctx_getter()
+    queue = cl.CommandQueue(cl_ctx)
+
+    from meshmode.discretization import Discretization
+    from meshmode.discretization.poly_element import \
+            PolynomialWarpAndBlendGroupFactory
+    from meshmode.discretization.connection import make_boundary_restriction
+
+    order = 3
+    discr = _make_box_discretization(cl_ctx, dim, order)
+
+    if curved:
+        # leaves the vertices in place
+        grp, = discr.mesh.groups
+        nodes = grp.nodes.copy()
+        nodes[0] += 0.02*np.sin(3*np.pi*nodes[0])
+
+        from meshmode.mesh import Mesh
+        mesh = Mesh(discr.mesh.vertices, [grp.copy(nodes=nodes)])
+        discr = Discretization(cl_ctx, mesh,
+                PolynomialWarpAndBlendGroupFactory(order))
+
+    nodes = discr.nodes().with_queue(queue)
+    jac = discr.jacobian(queue).get(queue=queue)
+    for iaxis in range(dim):
+        for ref_axis in range(dim):
+            ref_jac = discr.num_reference_derivative(
+                    queue, (ref_axis,), nodes[iaxis]).get(queue=queue)
+            assert la.norm(jac[iaxis, ref_axis] - ref_jac, np.inf) < 1e-12
+
+    inv_jac = discr.inverse_jacobian(queue).get(queue=queue)
+    assert np.abs(
+            np.einsum("ran,asn->rsn", inv_jac, jac)
+            - np.eye(dim)[:, :, np.newaxis]).max() < 1e-12
+
+    det = discr.jacobian_determinant().get(queue=queue)
+    ref_det = la.det(jac.transpose(2, 0, 1))
+    assert la.norm(det - ref_det, np.inf) < 1e-12
+    assert la.norm(
+            discr.area_element().get(queue=queue) - np.abs(ref_det),
+            np.inf) < 1e-12
+
+    if not curved:
+        bdry_mesh, bdry_discr, bdry_connection = make_boundary_restriction(
+                queue, discr, PolynomialWarpAndBlendGroupFactory(order))
+
+        normals = bdry_discr.normals().get(queue=queue)
+        assert la.norm(la.norm(normals, axis=0) - 1, np.inf) < 1e-12
+
+        # all faces are axis-aligned
+        assert la.norm(np.abs(normals).max(axis=0) - 1, np.inf) < 1e-12
+
+
+@pytest.mark.parametrize("dim", [2, 3])
+def test_integral_and_norms(ctx_getter, dim):
+    cl_ctx = ctx_getter()
+    queue = cl.CommandQueue(cl_ctx)
+
+    discr = _make_box_discretization(cl_ctx, dim, order=4, extent=2)
+
+    x = discr.nodes()[0].with_queue(queue)
+    y = discr.nodes()[1].with_queue(queue)
+    volume = 2**dim
+
+    assert abs(discr.integral(queue, 1 + 0*x) - volume) < 1e-12
+    assert abs(discr.integral(queue, 1j*x) - 1j*volume) < 1e-12
+
+    # int_0^2 x^p dx = 2^(p+1)/(p+1)
+    assert abs(discr.norm(queue, x) - np.sqrt(volume*4/3)) < 1e-12
+    assert abs(discr.norm(queue, 1j*x) - np.sqrt(volume*4/3)) < 1e-12
+    assert abs(discr.norm(queue, x, 3) - (volume*2)**(1/3)) < 1e-12
+    assert abs(discr.norm(queue, x, np.inf) - 2) < 1e-12
+
+    assert abs(discr.inner_product(queue, x, y) - volume) < 1e-12
+    assert abs(discr.inner_product(queue, 1j*x, y) + 1j*volume) < 1e-12
+
+    with pytest.raises(ValueError):
+        discr.inner_product(queue, x, y[:-1])
+
+    # the weight of each node is looked up in the table of its group
+    from meshmode.mesh import Mesh
+    from meshmode.discretization import Discretization
+    from meshmode.discretization.poly_element import \
+            PolynomialWarpAndBlendGroupFactory
+
+    grp, = discr.mesh.groups
+    nsplit = grp.nelements // 3
+    split_mesh = Mesh(discr.mesh.vertices, [
+        grp.copy(vertex_indices=grp.vertex_indices[:nsplit],
+            nodes=grp.nodes[:, :nsplit].copy()),
+        grp.copy(vertex_indices=grp.vertex_indices[nsplit:],
+            nodes=grp.nodes[:, nsplit:].copy()),
+        ])
+    split_discr = Discretization(cl_ctx, split_mesh,
+            PolynomialWarpAndBlendGroupFactory(4))
+    split_x = split_discr.nodes()[0].with_queue(queue)
+    assert abs(split_discr.integral(queue, split_x) - volume) < 1e-12
+    assert abs(split_discr.norm(queue, split_x) - np.sqrt(volume*4/3)) < 1e-12
+
+    # single precision reductions do not need fp64 support
+    discr_32 = _make_box_discretization(cl_ctx, dim, order=4, extent=2,
+            real_dtype=np.float32)
+    x_32 = discr_32.nodes()[0].with_queue(queue)
+    assert abs(discr_32.norm(queue, x_32) - np.sqrt(volume*4/3)) < 1e-5
+
+
+def test_allocator_and_out(ctx_getter):
+    cl_ctx = ctx_getter()
+    queue = cl.CommandQueue(cl_ctx)
+
+    from meshmode.discretization.connection import \
+            ChainedDiscretizationConnection
+
+    vol_discr, bdry_discr, bdry_connection = \
+            _make_box_boundary_restriction(queue, 2)
+
+    import pyopencl.tools as cl_tools
+    assert isinstance(vol_discr.allocator, cl_tools.MemoryPool)
+    assert bdry_discr.allocator is vol_discr.allocator
+
+    x = vol_discr.nodes()[0].with_queue(queue)
+
+    out = bdry_discr.empty(x.dtype, queue=queue)
+    for cnx in [bdry_connection,
+            ChainedDiscretizationConnection([bdry_connection])]:
+        assert cnx(queue, x, out=out) is out
+        assert la.norm((out - bdry_connection(queue, x)).get(), np.inf) == 0
+
+    vol_out = vol_discr.empty(x.dtype, queue=queue)
+    assert bdry_connection.adjoint()(queue, out, out=vol_out) is vol_out
+    assert vol_discr.num_reference_derivative(
+            queue, (0,), x, out=vol_out) is vol_out
+    assert vol_discr.quad_weights(queue, out=vol_out) is vol_out
+
+    with pytest.raises(ValueError):
+        bdry_connection(queue, x, out=vol_out)
+
+
+def test_non_blocking_operators(ctx_getter):
+    cl_ctx = ctx_getter()
+    queue = cl.CommandQueue(cl_ctx)
+
+    vol_discr, bdry_discr, bdry_connection = \
+            _make_box_boundary_restriction(queue, 2)
+
+    # kernel tuning synchronizes, so get it out of the way
+    vol_discr.warm_up(queue)
+    bdry_connection.warm_up(queue)
+
+    x = vol_discr.nodes(queue)[0]
+    ref_bdry_f = bdry_connection(queue, x).get(queue=queue)
+    ref_df = vol_discr.num_reference_derivative(queue, (0,), x).get(queue=queue)
+
+    # None of this may block, since the user event is only set afterwards.
+    user_evt = cl.UserEvent(cl_ctx)
+    bdry_f = bdry_connection(queue, x, wait_for=[user_evt])
+    df = vol_discr.num_reference_derivative(queue, (0,), x, wait_for=[user_evt])
+    assert bdry_f.events and df.events
+
+    from meshmode.discretization.connection import make_same_mesh_connection
+    identity = make_same_mesh_connection(queue, vol_discr, vol_discr)
+    x_copy = identity(queue, x, wait_for=[user_evt])
+    assert x_copy is not x and x_copy.events
+
+    user_evt.set_status(cl.command_execution_status.COMPLETE)
+
+    assert la.norm(bdry_f.get(queue=queue) - ref_bdry_f, np.inf) == 0
+    assert la.norm(df.get(queue=queue) - ref_df, np.inf) == 0
+    assert la.norm(x_copy.get(queue=queue) - x.get(queue=queue), np.inf) == 0
+
+
+@pytest.mark.parametrize("dim", [2, 3])
+def test_host_backend(ctx_getter, dim):
+    cl_ctx = ctx_getter()
+    queue = cl.CommandQueue(cl_ctx)
+
+    from meshmode.discretization import Discretization
+    from meshmode.discretization.poly_element import \
+            PolynomialWarpAndBlendGroupFactory
+    from meshmode.discretization.connection import make_boundary_restriction
+
+    order = 3
+    vol_discr, bdry_discr, bdry_connection = \
+            _make_box_boundary_restriction(queue, dim, order)
+
+    host_vol_discr = Discretization(None, vol_discr.mesh,
+            PolynomialWarpAndBlendGroupFactory(order))
+    _, host_bdry_discr, host_bdry_connection = make_boundary_restriction(
+            None, host_vol_discr, PolynomialWarpAndBlendGroupFactory(order))
+
+    x = vol_discr.nodes()[0].with_queue(queue)
+    f = cl.clmath.sin(3*x)
+
+    host_x = host_vol_discr.nodes()[0]
+    assert isinstance(host_x, np.ndarray)
+    assert la.norm(host_x - x.get(), np.inf) < 1e-14
+    host_f = np.sin(3*host_x)
+
+    def check(host_result, result):
+        assert isinstance(host_result, np.ndarray)
+        assert la.norm((host_result - result.get(queue=queue)).ravel(),
+                np.inf) < 1e-12
+
+    check(host_vol_discr.num_reference_derivative(None, (0,), host_f),
+            vol_discr.num_reference_derivative(queue, (0,), f))
+    check(host_vol_discr.num_reference_gradient(None, host_f),
+            vol_discr.num_reference_gradient(queue, f))
+    check(host_vol_discr.quad_weights(None), vol_discr.quad_weights(queue))
+    check(host_vol_discr.inverse_jacobian(), vol_discr.inverse_jacobian())
+    check(host_bdry_discr.normals(), bdry_discr.normals())
+
+    host_bdry_f = host_bdry_connection(None, host_f)
+    check(host_bdry_f, bdry_connection(queue, f))
+    check(host_bdry_connection.adjoint()(None, host_bdry_f),
+            bdry_connection.adjoint()(queue, bdry_connection(queue, f)))
+
+    assert abs(host_vol_discr.norm(None, host_f)
+            - vol_discr.norm(queue, f)) < 1e-12
+
+
+def test_multi_component(ctx_getter):
+    cl_ctx = ctx_getter()
+    queue = cl.CommandQueue(cl_ctx)
+
+    vol_discr, bdry_discr, bdry_connection = \
+            _make_box_boundary_restriction(queue, 2)
+
+    from meshmode.discretization.connection import (
+            make_same_mesh_connection, ChainedDiscretizationConnection)
+    chained = ChainedDiscretizationConnection([
+        make_same_mesh_connection(queue, vol_discr, vol_discr),
+        bdry_connection])
+
+    x, y = vol_discr.nodes().with_queue(queue)
+    fields = [cl.clmath.sin(3*x), x*y, y + 1]
+    stacked = vol_discr.empty(x.dtype, queue=queue, extra_dims=(3,))
+    for i, field in enumerate(fields):
+        stacked[i] = field
+
+    from pytools.obj_array import make_obj_array
+
+    def check(operator):
+        ref_results = [operator(field).get(queue=queue) for field in fields]
+
+        for vec in [stacked, make_obj_array(fields)]:
+            results = operator(vec)
+            assert len(results) == len(fields)
+            for result, ref_result in zip(results, ref_results):
+                assert la.norm(result.get(queue=queue) - ref_result, np.inf) < 1e-14
+
+    for fused in [False, True]:
+        check(lambda vec: bdry_connection(queue, vec, fused=fused))
+    check(lambda vec: chained(queue, vec))
+    check(lambda vec: vol_discr.num_reference_derivative(queue, (1,), vec))
+    check(lambda vec: vol_discr.num_reference_gradient(queue, vec))
+
+    # stacked gradients, on the host as well
+    from meshmode.discretization import Discretization
+    from meshmode.discretization.poly_element import \
+            PolynomialWarpAndBlendGroupFactory
+    host_vol_discr = Discretization(None, vol_discr.mesh,
+            PolynomialWarpAndBlendGroupFactory(3))
+
+    stacked_grad = vol_discr.num_reference_gradient(queue, stacked)
+    assert stacked_grad.shape == (3, 2, vol_discr.nnodes)
+    host_stacked_grad = host_vol_discr.num_reference_gradient(
+            None, stacked.get(queue=queue))
+    assert host_stacked_grad.shape == (3, 2, vol_discr.nnodes)
+    for i, field in enumerate(fields):
+        ref_grad = vol_discr.num_reference_gradient(queue, field).get(queue=queue)
+        assert la.norm(stacked_grad[i].get(queue=queue) - ref_grad,
+                np.inf) < 1e-14
+        assert la.norm(host_stacked_grad[i] - ref_grad, np.inf) < 1e-12
+
+    bdry_stacked = bdry_connection(queue, stacked)
+    adjoint = bdry_connection.adjoint()
+    ref_adj = [adjoint(queue, bdry_stacked[i]).get(queue=queue) for i in range(3)]
+    assert la.norm(adjoint(queue, bdry_stacked).get(queue=queue) - np.array(ref_adj),
+            np.inf) < 1e-14
+
+    host_stacked = stacked.get(queue=queue)
+    host_result = bdry_connection.apply_host(host_stacked)
+    assert la.norm(host_result - bdry_stacked.get(queue=queue), np.inf) < 1e-14
+
+    with pytest.raises(ValueError):
+        bdry_connection(queue, bdry_stacked)
+
+
+@pytest.mark.parametrize("dim", [2, 3])
+def test_refinement_connection(ctx_getter, dim):
+    cl_ctx = ctx_getter()
+    queue = cl.CommandQueue(cl_ctx)
+
+    from meshmode.discretization import Discretization
+    from meshmode.discretization.poly_element import \
+            PolynomialWarpAndBlendGroupFactory
+    from meshmode.discretization.connection import make_refinement_connection
+    from meshmode.mesh.refinement import Refiner
+
+    order = 3
+    coarse_discr = _make_box_discretization(cl_ctx, dim, order)
+    host_coarse_discr = Discretization(None, coarse_discr.mesh,
+            PolynomialWarpAndBlendGroupFactory(order))
+
+    refiner = Refiner(coarse_discr.mesh)
+    flags = refiner.get_empty_refine_flags()
+    flags[::3] = True
+    refiner.refine(flags)
+
+    connection = make_refinement_connection(refiner, coarse_discr,
+            PolynomialWarpAndBlendGroupFactory(order))
+    fine_discr = connection.to_discr
+    assert fine_discr.mesh is refiner.last_mesh
+
+    # one batch per child type, however many elements were split
+    cgrp, = connection.groups
+    assert len(cgrp.batches) < len(refiner.last_split_elements)
+    assert sum(batch.nelements for batch in cgrp.batches) \
+            == fine_discr.mesh.nelements
+
+    def f(x):
+        return x[0]**3 - 2*x[0]*x[-1] + 1
+
+    coarse_f = f(coarse_discr.nodes().with_queue(queue))
+    ref_fine_f = f(fine_discr.nodes().get(queue=queue))
+
+    for fused in [False, True]:
+        fine_f = connection(queue, coarse_f, fused=fused).get(queue=queue)
+        assert la.norm(fine_f - ref_fine_f, np.inf) < 1e-12
+
+    host_connection = make_refinement_connection(refiner, host_coarse_discr,
+            PolynomialWarpAndBlendGroupFactory(order))
+    host_fine_f = host_connection(None, f(host_coarse_discr.nodes()))
+    assert la.norm(host_fine_f - ref_fine_f, np.inf) < 1e-12
+
+
+@pytest.mark.parametrize("dim", [1, 2, 3])
+def test_uniform_refinement(dim):
+    from meshmode.mesh.generation import generate_box_mesh, make_curve_mesh, \
+            starfish
+    from meshmode.mesh.refinement import Refiner
+    from math import factorial
+
+    if dim == 1:
+        mesh = make_curve_mesh(starfish, np.linspace(0, 1, 20), order=3)
+    else:
+        mesh = generate_box_mesh(dim*(np.linspace(0, 1, 3),), order=3)
+
+    refiner = Refiner(mesh)
+    fine_mesh = refiner.refine_uniformly()
+
+    assert fine_mesh.nelements == 2**dim * mesh.nelements
+    assert np.array_equal(refiner.last_split_elements,
+            np.arange(mesh.nelements))
+
+    if dim > 1:
+        # all children have the same volume
+        el_vertices = fine_mesh.vertices[:, fine_mesh.groups[0].vertex_indices]
+        spans = el_vertices[:, :, 1:] - el_vertices[:, :, :1]
+        volumes = la.det(spans.transpose(1, 0, 2)) / factorial(dim)
+        assert np.allclose(volumes, volumes[0], rtol=1e-13, atol=0)
+        assert abs(np.sum(volumes) - 1) < 1e-13
+
+
+@pytest.mark.parametrize("dim", [2, 3])
+def test_refinement_hierarchy(ctx_getter, dim):
+    cl_ctx = ctx_getter()
+    queue = cl.CommandQueue(cl_ctx)
+
+    from meshmode.discretization.poly_element import \
+            PolynomialWarpAndBlendGroupFactory
+    from meshmode.discretization.connection import make_refinement_hierarchy
+    from meshmode.mesh.generation import generate_box_mesh
+
+    order = 2
+    mesh = generate_box_mesh(dim*(np.linspace(0, 1, 3),), order=order)
+    hierarchy = make_refinement_hierarchy(cl_ctx, mesh,
+            PolynomialWarpAndBlendGroupFactory(order), 3)
+
+    assert [m.nelements for m in hierarchy.meshes] == [
+            mesh.nelements * 2**(dim*ilevel) for ilevel in range(3)]
+    assert hierarchy.prolongation(0) is hierarchy.prolongation(0)
+    assert hierarchy.discretization(1) is hierarchy.prolongation(0).to_discr
+    assert hierarchy.discretization(1) is hierarchy.prolongation(1).from_discr
+
+    def f(x):
+        return x[0]**2 - x[0]*x[-1]
+
+    for ilevel in range(2):
+        coarse_discr = hierarchy.discretization(ilevel)
+        fine_discr = hierarchy.discretization(ilevel + 1)
+
+        fine_f = hierarchy.prolongation(ilevel)(
+                queue, f(coarse_discr.nodes().with_queue(queue)))
+        assert la.norm(fine_f.get(queue=queue)
+                - f(fine_discr.nodes().get(queue=queue)), np.inf) < 1e-12
+
+        # the restriction is the adjoint of the prolongation
+        u = np.random.randn(coarse_discr.nnodes)
+        v = np.random.randn(fine_discr.nnodes)
+        pu = hierarchy.prolongation(ilevel)(
+                queue, cl.array.to_device(queue, u)).get(queue=queue)
+        rv = hierarchy.restriction(ilevel)(
+                queue, cl.array.to_device(queue, v)).get(queue=queue)
+        assert abs(np.dot(pu, v) - np.dot(u, rv)) < 1e-10 * la.norm(pu)*la.norm(v)
+
+
+@pytest.mark.parametrize("dim", [2, 3])
+def test_coarsening(ctx_getter, dim):
+    cl_ctx = ctx_getter()
+    queue = cl.CommandQueue(cl_ctx)
+
+    from meshmode.discretization.poly_element import \
+            PolynomialWarpAndBlendGroupFactory
+    from meshmode.discretization.connection import (
+            make_refinement_connection, make_coarsening_connection)
+    from meshmode.mesh.refinement import Refiner
+
+    order = 2
+    coarse_discr = _make_box_discretization(cl_ctx, dim, order)
+    coarse_mesh = coarse_discr.mesh
+
+    refiner = Refiner(coarse_mesh)
+    flags = refiner.get_empty_refine_flags()
+    flags[::4] = True
+    fine_mesh = refiner.refine(flags)
+    fine_discr = make_refinement_connection(refiner, coarse_discr,
+            PolynomialWarpAndBlendGroupFactory(order)).to_discr
+
+    # partial coarsening keeps the mesh conforming
+    flags = np.zeros(fine_mesh.nelements, dtype=bool)
+    flags[:fine_mesh.nelements // 2] = True
+    mesh = refiner.coarsen(flags)
+    assert coarse_mesh.nelements <= mesh.nelements < fine_mesh.nelements
+    assert refiner.last_coarsened_mesh is fine_mesh
+
+    from itertools import combinations
+    faces = np.sort(mesh.groups[0].vertex_indices[
+        :, list(combinations(range(dim+1), dim))], axis=-1).reshape(-1, dim)
+    faces, counts = np.unique(faces, axis=0, return_counts=True)
+    face_vertices = mesh.vertices[:, faces[counts == 1]]
+    assert np.all(np.any(
+            np.all(np.abs(face_vertices) < 1e-14, axis=-1)
+            | np.all(np.abs(face_vertices - 1) < 1e-14, axis=-1), axis=0))
+
+    # coarsening everything gets back to the original mesh
+    flags = np.ones(mesh.nelements, dtype=bool)
+    partial_discr = make_coarsening_connection(refiner, fine_discr,
+            PolynomialWarpAndBlendGroupFactory(order)).to_discr
+    mesh = refiner.coarsen(flags)
+    assert mesh.nelements == coarse_mesh.nelements
+    assert np.array_equal(mesh.vertices, coarse_mesh.vertices)
+
+    projection = make_coarsening_connection(refiner, partial_discr,
+            PolynomialWarpAndBlendGroupFactory(order))
+
+    def f(x):
+        return x[0]**2 - x[0]*x[-1] + 1
+
+    # exact for polynomials, conservative for anything
+    partial_x = partial_discr.nodes().with_queue(queue)
+    result = projection(queue, f(partial_x))
+    assert la.norm(result.get(queue=queue)
+            - f(projection.to_discr.nodes().get(queue=queue)), np.inf) < 1e-12
+
+    g = cl.clmath.sin(5*partial_x[0])
+    assert abs(projection.to_discr.integral(queue, projection(queue, g))
+            - partial_discr.integral(queue, g)) < 1e-13
+
+
+@pytest.mark.parametrize("dim", [2, 3])
+def test_p_refinement(ctx_getter, dim):
+    cl_ctx = ctx_getter()
+    queue = cl.CommandQueue(cl_ctx)
+
+    from meshmode.discretization import Discretization
+    from meshmode.discretization.poly_element import (
+            PolynomialWarpAndBlendGroupFactory, PerElementOrderGroupFactory)
+    from meshmode.discretization.connection import (
+            make_order_change_connection, IdentityDiscretizationConnection)
+    from meshmode.mesh.generation import generate_box_mesh
+    from meshmode.mesh.processing import split_mesh_groups
+
+    mesh = generate_box_mesh(dim*(np.linspace(0, 1, 4),))
+    grp, = mesh.groups
+    centroids = np.mean(mesh.vertices[:, grp.vertex_indices], axis=-1)
+    element_orders = np.where(centroids[0] > 0.5, 3, 2)
+
+    mesh, old_element_numbers = split_mesh_groups(mesh, element_orders)
+    element_orders = element_orders[old_element_numbers]
+    assert len(mesh.groups) == 2
+
+    p_discr = Discretization(cl_ctx, mesh, PerElementOrderGroupFactory(
+        PolynomialWarpAndBlendGroupFactory, element_orders))
+    assert [grp.order for grp in p_discr.groups] == [2, 3]
+
+    low_discr = Discretization(cl_ctx, mesh,
+            PolynomialWarpAndBlendGroupFactory(1))
+
+    def f(x):
+        return x[0]**2 - x[0]*x[-1] + 3*x[-1]
+
+    def g(x):
+        return 2*x[0] - x[-1] + 1
+
+    p_f = f(p_discr.nodes().with_queue(queue))
+    p_g = g(p_discr.nodes().with_queue(queue))
+
+    # elevation is exact
+    up = make_order_change_connection(queue, p_discr, low_discr)
+    low_g = g(low_discr.nodes().with_queue(queue))
+    assert la.norm(up(queue, low_g).get(queue=queue) - p_g.get(),
+            np.inf) < 1e-12
+
+    # reduction is an L^2 projection: exact for linears, and it preserves
+    # integrals
+    down = make_order_change_connection(queue, low_discr, p_discr)
+    assert la.norm(down(queue, p_g).get(queue=queue) - low_g.get(),
+            np.inf) < 1e-12
+    assert abs(low_discr.integral(queue, down(queue, p_f))
+            - p_discr.integral(queue, p_f)) < 1e-12
+
+    same = make_order_change_connection(queue, p_discr, p_discr)
+    assert all(same._identity_map_groups().values())
+    assert not isinstance(same, IdentityDiscretizationConnection)
+
+    with pytest.raises(ValueError):
+        Discretization(cl_ctx, mesh, PerElementOrderGroupFactory(
+            PolynomialWarpAndBlendGroupFactory, np.arange(mesh.nelements)))
+
+
+@pytest.mark.parametrize("candidate", [
+    "split_nodes", "element_per_work_item",
+    "elements_per_group", "prefetch_matrix"])
+def test_kernel_tuning_candidates(ctx_getter, candidate):
+    cl_ctx = ctx_getter()
+    queue = cl.CommandQueue(cl_ctx)
+
+    from meshmode.discretization import _make_diff_kernel
+
+    discr = _make_box_discretization(cl_ctx, 2, order=4, npoints=5)
+    grp, = discr.groups
+
+    vec = discr.nodes()[0].with_queue(queue)**2
+    diff_mat = grp.diff_matrices()[0]
+
+    tknl = _make_diff_kernel(grp.nunit_nodes, discr.real_dtype)
+    result = discr.empty(discr.real_dtype, queue=queue)
+    tknl._get_transformed_kernel(candidate)(queue,
+            diff_mat=diff_mat,
+            result=grp.view(result.reshape(1, -1)),
+            vec=grp.view(vec.reshape(1, -1)))
+
+    ref_result = np.dot(grp.view(vec.get()), diff_mat.T)
+    assert la.norm(grp.view(result.get()) - ref_result) < 1e-12
+
+
 def test_element_orientation():
     from meshmode.mesh.io import generate_gmsh, FileSource
 
@@ -382,6 +1215,65 @@ def test_box_mesh():
     generate_box_mesh(3*(np.linspace(0, 1, 5),))
 
 
+@pytest.mark.parametrize("dim", [1, 2, 3])
+def test_refinement(dim):
+    from meshmode.mesh.generation import (
+            generate_box_mesh, make_curve_mesh, starfish)
+    from meshmode.mesh.refinement import Refiner
+    from itertools import combinations
+    from math import factorial
+
+    if dim == 1:
+        mesh = make_curve_mesh(starfish, np.linspace(0, 1, 20), order=3)
+    else:
+        mesh = generate_box_mesh(dim*(np.linspace(0, 1, 4),), order=3)
+
+    refiner = Refiner(mesh)
+
+    for i in range(3):
+        prev_mesh = refiner.last_mesh
+        flags = refiner.get_empty_refine_flags()
+        flags[i::5] = True
+
+        # the Mesh constructor checks node/vertex consistency and orientation
+        mesh = refiner.refine(flags)
+
+        assert refiner.previous_mesh is prev_mesh
+        assert set(np.nonzero(flags)[0]) <= set(refiner.last_split_elements)
+        assert mesh.nelements > prev_mesh.nelements
+        assert np.array_equal(np.unique(refiner.last_parent_elements),
+                np.arange(prev_mesh.nelements))
+
+        grp, = mesh.groups
+        vertex_indices = grp.vertex_indices
+
+        if dim == 1:
+            # no hanging vertices: only the ends of the curve are unshared
+            counts = np.bincount(vertex_indices.ravel())
+            prev_counts = np.bincount(prev_mesh.groups[0].vertex_indices.ravel())
+            assert np.all(counts <= 2)
+            assert np.sum(counts == 1) == np.sum(prev_counts == 1)
+            continue
+
+        # volume is preserved
+        el_vertices = mesh.vertices[:, vertex_indices]
+        spans = el_vertices[:, :, 1:] - el_vertices[:, :, :1]
+        volume = np.sum(la.det(spans.transpose(1, 0, 2))) / factorial(dim)
+        assert abs(volume - 1) < 1e-13
+
+        # no hanging vertices: faces on the interior are shared by two elements
+        faces = np.sort(vertex_indices[
+            :, list(combinations(range(dim+1), dim))], axis=-1).reshape(-1, dim)
+        faces, counts = np.unique(faces, axis=0, return_counts=True)
+        assert np.all(counts <= 2)
+
+        face_vertices = mesh.vertices[:, faces[counts == 1]]
+        on_boundary = np.any(
+                np.all(np.abs(face_vertices) < 1e-14, axis=-1)
+                | np.all(np.abs(face_vertices - 1) < 1e-14, axis=-1), axis=0)
+        assert on_boundary.all()
+
+
 def test_as_python():
     from meshmode.mesh.generation import make_curve_mesh, cloverleaf
     mesh = make_curve_mesh(cloverleaf, np.linspace(0, 1, 100), order=3)
@@ -412,17 +1304,281 @@ def test_lookup_tree(do_plot=False):
 
     extent = bbox_max-bbox_min
 
-    for i in range(20):
-        pt = bbox_min + np.random.rand(2) * extent
-        print(pt)
-        for igrp, iel in tree.generate_matches(pt):
-            print(igrp, iel)
+    points = bbox_min[:, np.newaxis] + np.random.rand(2, 500) * extent[:, np.newaxis]
+    point_indices, element_nrs = tree.find_candidate_elements(points)
+
+    grp, = mesh.groups
+    el_nodes = np.concatenate(
+            [mesh.vertices[:, grp.vertex_indices], grp.nodes], axis=-1)
+    assert np.all(tree.element_bbox_min <= np.min(el_nodes, axis=-1).T)
+    assert np.all(np.max(el_nodes, axis=-1).T <= tree.element_bbox_max)
+
+    for i in range(0, points.shape[1], 25):
+        pt = points[:, i]
+        inside = np.all(
+                (tree.element_bbox_min <= pt)
+                & (pt <= tree.element_bbox_max), axis=-1)
+        ref_matches = set(np.nonzero(inside)[0])
+
+        assert set(element_nrs[point_indices == i]) == ref_matches
+        assert set(iel for igrp, iel in tree.generate_matches(pt)) \
+                == ref_matches
+
+    from pickle import loads, dumps
+    tree2 = loads(dumps(tree))
+    assert all(np.array_equal(a, b) for a, b in zip(
+        tree2.find_candidate_elements(points), (point_indices, element_nrs)))
 
     if do_plot:
         with open("tree.dat", "w") as outf:
             tree.visualize(outf)
 
 
+def test_lookup_tree_empty_mesh():
+    from meshmode.mesh import Mesh
+    from meshmode.mesh.generation import generate_box_mesh
+    mesh = generate_box_mesh(2*(np.linspace(0, 1, 3),), order=1)
+
+    grp, = mesh.groups
+    empty_mesh = Mesh(mesh.vertices, [
+        grp.copy(
+            vertex_indices=grp.vertex_indices[:0],
+            nodes=grp.nodes[:, :0].copy())],
+        skip_tests=True)
+    assert empty_mesh.nelements == 0
+
+    from meshmode.mesh.tools import make_element_lookup_tree
+    tree = make_element_lookup_tree(empty_mesh)
+    assert tree.nelements == 0
+    assert not tree.level_bbox_min
+
+    point_indices, element_nrs = tree.find_candidate_elements(
+            np.random.rand(2, 10))
+    assert len(point_indices) == len(element_nrs) == 0
+    assert list(tree.generate_matches(np.zeros(2))) == []
+
+
+def test_element_geometry():
+    from meshmode.mesh import SimplexElementGroup, Mesh
+
+    # a right triangle with legs of length 2, and the unit tetrahedron
+    for vertices, diameter, inradius in [
+            (np.array([[0, 0], [2, 0], [0, 2]], dtype=np.float64).T,
+                2*np.sqrt(2), 2 - np.sqrt(2)),
+            (np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1]],
+                dtype=np.float64).T,
+                np.sqrt(2), 1/(3 + np.sqrt(3))),
+            ]:
+        dim = vertices.shape[0]
+        grp = SimplexElementGroup(1,
+                np.arange(dim + 1, dtype=np.int32).reshape(1, -1),
+                vertices.reshape(dim, 1, dim + 1), dim=dim)
+        grp, = Mesh(vertices, [grp]).groups
+
+        assert np.allclose(grp.element_centroids()[:, 0],
+                np.mean(vertices, axis=-1))
+        assert np.allclose(grp.element_diameters(), diameter)
+        assert np.allclose(grp.element_inradii(), inradius)
+
+        bbox_min, bbox_max = grp.element_bounding_boxes()
+        assert np.allclose(bbox_min[:, 0], 0)
+        assert np.allclose(bbox_max[:, 0], np.max(vertices, axis=-1))
+
+    # mesh-wide, compared with the vertices
+    from meshmode.mesh.generation import generate_box_mesh
+    from meshmode.mesh.processing import (
+            find_element_centroids, find_element_bounding_boxes)
+    mesh = generate_box_mesh(3*(np.linspace(0, 1, 4),), order=2)
+    grp, = mesh.groups
+    el_vertices = mesh.vertices[:, grp.vertex_indices]
+
+    assert np.allclose(find_element_centroids(mesh),
+            np.mean(el_vertices, axis=-1))
+
+    bbox_min, bbox_max = find_element_bounding_boxes(mesh)
+    assert np.all(bbox_min <= np.min(el_vertices, axis=-1))
+    assert np.all(np.max(el_vertices, axis=-1) <= bbox_max)
+
+
+@pytest.mark.parametrize("dim", [1, 2, 3])
+def test_locate_points(dim):
+    import modepy as mp
+    from meshmode.mesh.tools import locate_points
+
+    if dim == 1:
+        from meshmode.mesh.generation import make_curve_mesh, starfish
+        mesh = make_curve_mesh(starfish, np.linspace(0, 1, 20), order=4)
+    elif dim == 2:
+        # curved elements
+        from meshmode.mesh.generation import generate_icosphere
+        mesh = generate_icosphere(1, order=3)
+    else:
+        from meshmode.mesh.generation import generate_box_mesh
+        mesh = generate_box_mesh(3*(np.linspace(0, 1, 4),), order=2)
+
+    grp, = mesh.groups
+
+    # {{{ points inside known elements
+
+    npoints = 500
+    bary = np.random.rand(grp.dim + 1, npoints)
+    bary /= np.sum(bary, axis=0)
+    unit_coords = 2*bary[1:] - 1
+
+    element_nrs = np.random.randint(0, grp.nelements, npoints)
+
+    resampling_mat = mp.resampling_matrix(
+            mp.simplex_onb(grp.dim, grp.order), unit_coords, grp.unit_nodes)
+    points = np.einsum("pj,dpj->dp", resampling_mat, grp.nodes[:, element_nrs])
+
+    found_element_nrs, found_unit_coords = locate_points(mesh, points)
+
+    assert np.array_equal(found_element_nrs, element_nrs)
+    assert np.max(np.abs(found_unit_coords - unit_coords)) < 1e-10
+
+    # }}}
+
+    # points outside the mesh
+    outside_points = np.full((mesh.ambient_dim, 3), 5.)
+    if grp.dim < mesh.ambient_dim:
+        # off the surface, but inside the bounding boxes of elements
+        outside_points[:, :2] = 1.001*points[:, :2]
+    found_element_nrs, found_unit_coords = locate_points(mesh, outside_points)
+    assert np.all(found_element_nrs == -1)
+    assert np.all(np.isnan(found_unit_coords))
+
+
+@pytest.mark.parametrize("dim", [2, 3])
+def test_point_evaluation_connection(ctx_getter, dim):
+    cl_ctx = ctx_getter()
+    queue = cl.CommandQueue(cl_ctx)
+
+    from meshmode.discretization import Discretization
+    from meshmode.discretization.poly_element import (
+            PolynomialWarpAndBlendGroupFactory, PerElementOrderGroupFactory)
+    from meshmode.discretization.connection import (
+            make_point_evaluation_connection)
+    from meshmode.mesh.generation import generate_box_mesh
+    from meshmode.mesh.processing import split_mesh_groups
+
+    # two groups, of different orders
+    mesh = generate_box_mesh(dim*(np.linspace(0, 1, 4),))
+    grp, = mesh.groups
+    centroids = np.mean(mesh.vertices[:, grp.vertex_indices], axis=-1)
+    element_orders = np.where(centroids[0] > 0.5, 3, 2)
+    mesh, old_element_numbers = split_mesh_groups(mesh, element_orders)
+
+    discr = Discretization(cl_ctx, mesh, PerElementOrderGroupFactory(
+        PolynomialWarpAndBlendGroupFactory,
+        element_orders[old_element_numbers]))
+
+    def f(x):
+        return x[0]**2 - x[0]*x[-1] + 3*x[-1]
+
+    points = np.random.rand(dim, 300)*1.2 - 0.1
+    outside = np.any((points < 0) | (points > 1), axis=0)
+
+    conn = make_point_evaluation_connection(discr, points)
+    assert np.array_equal(conn.element_nrs < 0, outside)
+
+    nodes = discr.nodes().with_queue(queue)
+    f_discr = f(nodes)
+
+    ref = f(points)
+    ref[outside] = np.nan
+
+    result = conn(queue, f_discr).get(queue=queue)
+    assert np.allclose(result, ref, rtol=0, atol=1e-12, equal_nan=True)
+
+    result = conn(queue, f_discr.get())
+    assert np.allclose(result, ref, rtol=0, atol=1e-12, equal_nan=True)
+
+    # multiple components
+    from pytools.obj_array import make_obj_array
+    result = conn(queue, make_obj_array([f_discr, 2*nodes[0]]))
+    assert np.allclose(result[0].get(queue=queue), ref,
+            rtol=0, atol=1e-12, equal_nan=True)
+    assert np.allclose(result[1].get(queue=queue)[~outside],
+            2*points[0, ~outside], rtol=0, atol=1e-12)
+
+    # all candidate transformations of the kernel agree
+    from meshmode.discretization.connection import \
+            _make_point_evaluation_kernel
+    from meshmode.discretization.tuning import (
+            POINT_CANDIDATES, _get_device_key)
+
+    device_key = _get_device_key(queue.device)
+    tknls = [
+            _make_point_evaluation_kernel(grp.nunit_nodes, f_discr.dtype)
+            for grp in discr.groups]
+    try:
+        for candidate in POINT_CANDIDATES:
+            if int(candidate.split("_")[-1]) > queue.device.max_work_group_size:
+                continue
+
+            for tknl in tknls:
+                tknl._device_kernels[device_key] = \
+                        tknl._get_transformed_kernel(candidate)
+
+            result = conn(queue, f_discr).get(queue=queue)
+            assert np.allclose(result, ref, rtol=0, atol=1e-12, equal_nan=True)
+    finally:
+        for tknl in tknls:
+            tknl._device_kernels.pop(device_key, None)
+
+
+@pytest.mark.parametrize("dim", [2, 3])
+def test_mesh_transfer_connection(ctx_getter, dim):
+    cl_ctx = ctx_getter()
+    queue = cl.CommandQueue(cl_ctx)
+
+    from meshmode.discretization.connection import make_mesh_transfer_connection
+
+    # The element boundaries of the two meshes do not line up.
+    from_discr = _make_box_discretization(cl_ctx, dim, order=3, npoints=5)
+    to_discr = _make_box_discretization(cl_ctx, dim, order=2, npoints=4)
+
+    def f(x):
+        return x[0]**2 - x[0]*x[-1] + 3*x[-1]
+
+    from_f = f(from_discr.nodes().with_queue(queue))
+    to_f = f(to_discr.nodes().with_queue(queue)).get()
+
+    # {{{ smooth data is transferred exactly
+
+    for conservative in [False, True]:
+        conn = make_mesh_transfer_connection(to_discr, from_discr,
+                conservative=conservative)
+
+        assert la.norm(conn(queue, from_f).get(queue=queue) - to_f,
+                np.inf) < 1e-11
+        assert la.norm(conn(queue, from_f.get()) - to_f, np.inf) < 1e-11
+
+    # }}}
+
+    # {{{ the conservative mode preserves integrals of rough data
+
+    from_grp, = from_discr.groups
+    rough = np.repeat(2 + np.sin(np.arange(from_grp.nelements)),
+            from_grp.nunit_nodes)
+    rough_integral = from_discr.integral(queue,
+            cl.array.to_device(queue, rough))
+
+    errors = []
+    for nsubdivisions in [1, 4]:
+        conn = make_mesh_transfer_connection(to_discr, from_discr,
+                conservative=True, nsubdivisions=nsubdivisions)
+        errors.append(abs(
+            to_discr.integral(queue, cl.array.to_device(queue,
+                conn(queue, rough)))
+            - rough_integral) / rough_integral)
+
+    assert errors[1] < errors[0]
+    assert errors[1] < 1e-4
+
+    # }}}
+
+
 if __name__ == "__main__":
     import sys
     if len(sys.argv) > 1: